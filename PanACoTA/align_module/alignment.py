@@ -47,16 +47,38 @@ March 2017
 import os
 import sys
 import logging
+import queue
+import collections
 import multiprocessing
 import progressbar
 import threading
 
 from PanACoTA import utils
+from PanACoTA.align_module import workspace
 
 main_logger = logging.getLogger("align.alignment")
 
+# Files already parsed by this process: {path: ((size, mtime), result)}. Only the last
+# files are kept: they are the files of the family being aligned. Entries are forgotten
+# whenever the pipeline writes the file, so that a file rewritten with the same size and
+# modification time (coarse mtime on network filesystems) is never served from the cache.
+PARSED_FILES = collections.OrderedDict()
+MAX_PARSED_FILES = 16
+# Small families are grouped into tasks costing at most 1/SMALL_TASKS_PER_THREAD of what
+# each thread has to align
+SMALL_TASKS_PER_THREAD = 20
+# mafft options for each alignment mode
+MAFFT_MODES = {"auto": "--auto",
+               "L-INS-i": "--localpair --maxiterate 1000",
+               "FFT-NS-2": "--retree 2 --maxiterate 0",
+               "PartTree": "--retree 1 --parttree"}
+# Default thresholds used to choose the mode of each family in adaptive mode (see
+# ``choose_mode``): L-INS-i up to 200 sequences of at most 2000 aa (as mafft --auto does),
+# PartTree from 10000 sequences, FFT-NS-2 in between.
+MODE_THRESHOLDS = {"linsi_max_seqs": 200, "linsi_max_len": 2000, "parttree_min_seqs": 10000}
 
-def align_all_families(prefix, all_fams, ngenomes, dname, quiet, threads):
+
+def align_all_families(prefix, all_fams, ngenomes, dname, quiet, threads, options=None):
     """
     For each family:
 
@@ -79,6 +101,23 @@ def align_all_families(prefix, all_fams, ngenomes, dname, quiet, threads):
         True if nothing must be written in stdout/stderr, False otherwise
     threads : int
         max number of threads that can be used by mafft
+    options : dict or None
+        options used to align each family (see ``family_alignment``):
+
+        - btr_awk: True to back-translate with the awk script instead of the python
+          back-translation
+        - mafft_threads: number of threads used by mafft for this family (set by
+          ``schedule_families`` when using several threads)
+        - dedup: True to align only 1 copy of identical proteins, and copy its aligned
+          sequence for all its duplicates
+        - compact: True to keep family alignments without the missing genomes (they are
+          only added as gaps when grouping alignments by genome)
+        - workspace: True to store the files of each family in the workspace (see
+          ``workspace`` module) as soon as it is aligned
+        - mode_thresholds: None to align all families with ``mafft --auto``, or dict of
+          thresholds (see ``MODE_THRESHOLDS``) to choose the mafft mode of each family from
+          its size (see ``choose_modes``)
+        - mafft_modes: {num_fam: mafft mode} (set from mode_thresholds)
 
     Returns
     -------
@@ -98,44 +137,90 @@ def align_all_families(prefix, all_fams, ngenomes, dname, quiet, threads):
         bar = progressbar.ProgressBar(widgets=widgets, max_value=nbfam,
                                       term_width=79).start()
     final = []
+    options = options or {}
+    # Family files may have been extracted again since they were parsed
+    PARSED_FILES.clear()
+    # Families already stored in the workspace are finished: nothing to check or redo
+    stored = []
+    mode = workspace.align_mode(options.get("compact", False))
+    if options.get("workspace", False):
+        stored_set = workspace.stored_families(prefix, all_fams, mode)
+        stored = [num_fam for num_fam in all_fams if num_fam in stored_set]
+        final.extend(["OK"] * len(stored))
+        if stored:
+            main_logger.info(f"{len(stored)} families already aligned in workspace "
+                             f"{workspace.workspace_files(prefix)[0]}")
+        all_fams = [num_fam for num_fam in all_fams if num_fam not in stored_set]
+        if not quiet:
+            bar.update(len(final))
+    # Modes are recorded only for the families which are sent to mafft in this run: the
+    # ones which are not aligned yet
+    new_modes = {}
+    if options.get("mode_thresholds") is not None:
+        chosen = choose_modes(prefix, all_fams, options["mode_thresholds"],
+                              options.get("dedup", False))
+        options = dict(options, mafft_modes={num_fam: record[2]
+                                             for num_fam, record in chosen.items()})
+        new_modes = {num_fam: record for num_fam, record in chosen.items()
+                     if not os.path.isfile(f"{prefix}-mafft-align.{num_fam}.aln")}
+    aligned = set()
+    # Files of a family aligned without problem are stored in the workspace as soon as it is
+    # finished, so that aldir only contains the files of the families being aligned
+    to_store = options.get("workspace", False)
     if threads == 1:
-        update_bar = 1
+        update_bar = len(final) + 1
         for num_fam in all_fams:
-            f = handle_family_1thread((prefix, num_fam, ngenomes))
+            f = handle_family_1thread((prefix, num_fam, ngenomes, options))
             final.append(f)
-            bar.update(update_bar)
+            if f:
+                aligned.add(num_fam)
+            if f and to_store:
+                workspace.store(prefix, workspace.family_files(prefix, num_fam), mode)
+            if not quiet:
+                bar.update(update_bar)
             update_bar+=1
 
-    else:
-        pool = multiprocessing.Pool(threads)
-
+    elif all_fams:
         # Create a Queue to put logs from processes, and handle them after from a single thread
         m = multiprocessing.Manager()
         q = m.Queue()
-        # arguments : (gpath, cores_prokka, name, force, nbcont, q) for each genome
-        arguments = [(prefix, num_fam, ngenomes, q) for num_fam in all_fams]
+        # Biggest families first, with several mafft threads for the huge ones, and small
+        # families grouped in a same task.
+        tasks = schedule_families(prefix, all_fams, threads)
+        # Listen for logs in processes
+        lp = threading.Thread(target=utils.logger_thread, args=(q,))
+        lp.start()
+        # All tasks share 'threads' threads: a task starts as soon as there are enough free
+        # threads for its mafft threads
+        pool = multiprocessing.Pool(threads)
+        # arguments : (prefix, fam_nums, ngenomes, q, options, mafft_threads) for each task
+        arguments = [(prefix, fams, ngenomes, q, options, mafft_threads)
+                     for fams, mafft_threads in tasks]
+        tasks_threads = [mafft_threads for _, mafft_threads in tasks]
         try:
-            final = pool.map_async(handle_family, arguments, chunksize=1)
+            for res in run_tasks(pool, handle_families, arguments, tasks_threads, threads):
+                for num_fam, status in res:
+                    final.append(status)
+                    if status:
+                        aligned.add(num_fam)
+                    if status and to_store:
+                        workspace.store(prefix, workspace.family_files(prefix, num_fam), mode)
+                if not quiet:
+                    bar.update(len(final))
             pool.close()
-            # Listen for logs in processes
-            lp = threading.Thread(target=utils.logger_thread, args=(q,))
-            lp.start()
-            if not quiet:
-                while True:
-                    if final.ready():
-                        break
-                    remaining = final._number_left
-                    bar.update(nbfam - remaining)
-                bar.finish()
             pool.join()
-            q.put(None)
-            lp.join()
-            final = final.get()
         # If an error occurs (or user kills with keybord), terminate pool and exit
         except Exception as excp:  # pragma: no cover
             pool.terminate()
             main_logger.error(excp)
             sys.exit(1)
+        if not quiet:
+            bar.finish()
+        q.put(None)
+        lp.join()
+    if new_modes:
+        record_modes(prefix, {num_fam: record for num_fam, record in new_modes.items()
+                              if num_fam in aligned})
     # We re-aligned (or added missing genomes) at least one family 
     # -> remove concatenated files and groupby files (if they exist)
     if set(final) != {"OK"}:
@@ -153,6 +238,250 @@ def align_all_families(prefix, all_fams, ngenomes, dname, quiet, threads):
     return False not in final
 
 
+def schedule_families(prefix, all_fams, threads):
+    """
+    Define the tasks to run to align all families with 'threads' processes.
+
+    The cost of aligning a family is estimated from the size of its extracted proteins
+    file, which is proportional to its number of sequences x their mean length. Families
+    are then sorted by decreasing cost, so that the longest alignments do not start last:
+
+    - a family costing more than 2 times the mean cost per thread (total cost / threads) is
+      aligned with several mafft threads (as many as times this mean cost)
+    - small families (costing less than 1/SMALL_TASKS_PER_THREAD of the mean cost per thread)
+      are grouped into a same task
+
+    Parameters
+    ----------
+    prefix :  str
+        path to ``aldir/<name of dataset>``
+    all_fams : []
+        list of all family numbers
+    threads : int
+        number of processes aligning families
+
+    Returns
+    -------
+    list
+        [(list of family numbers, number of threads for mafft)] for each task, in the order
+        they must be launched
+    """
+    costs = {}
+    for num_fam in all_fams:
+        prt_file = f"{prefix}-current.{num_fam}.prt"
+        costs[num_fam] = os.path.getsize(prt_file) if os.path.isfile(prt_file) else 0
+    thread_cost = max(sum(costs.values()) / threads, 1)
+    small_cost = thread_cost / SMALL_TASKS_PER_THREAD
+    tasks = []
+    small_fams = []
+    small_total = 0
+    # sorted is stable: families with the same cost keep their order
+    for num_fam in sorted(all_fams, key=lambda fam: costs[fam], reverse=True):
+        cost = costs[num_fam]
+        if cost >= small_cost:
+            mafft_threads = min(threads, max(1, int(cost // thread_cost)))
+            tasks.append(([num_fam], mafft_threads))
+            continue
+        if small_fams and small_total + cost > small_cost:
+            tasks.append((small_fams, 1))
+            small_fams = []
+            small_total = 0
+        small_fams.append(num_fam)
+        small_total += cost
+    if small_fams:
+        tasks.append((small_fams, 1))
+    return tasks
+
+
+def run_tasks(pool, func, arguments, tasks_threads, threads):
+    """
+    Run func on each argument with the pool, sharing 'threads' threads between all tasks:
+    each task is launched as soon as there are enough free threads for its mafft threads.
+    Tasks are launched in their order, but a task which does not fit in the free threads
+    does not block the next ones: smaller tasks fill the free threads while bigger ones are
+    running.
+
+    The pool must have 'threads' processes, so that a launched task never waits for a free
+    process.
+
+    Parameters
+    ----------
+    pool : multiprocessing.Pool
+        pool of 'threads' processes
+    func : function
+        function run for each task
+    arguments : list
+        argument given to func for each task, in the order they must be launched
+    tasks_threads : list
+        number of threads used by each task
+    threads : int
+        max number of threads that can be used at the same time
+
+    Returns
+    -------
+    generator
+        result of func for each task, in the order they finished
+    """
+    done = queue.Queue()
+    pending = list(range(len(arguments)))
+    free = threads
+    running = 0
+    while pending or running:
+        waiting = []
+        for index in pending:
+            need = min(tasks_threads[index], threads)
+            if need > free:
+                waiting.append(index)
+                continue
+            free -= need
+            running += 1
+            pool.apply_async(func, (arguments[index],),
+                             callback=lambda res, need=need: done.put((need, res, None)),
+                             error_callback=lambda err, need=need: done.put((need, None, err)))
+        pending = waiting
+        need, res, err = done.get()
+        free += need
+        running -= 1
+        if err is not None:
+            raise err
+        yield res
+
+
+def choose_modes(prefix, all_fams, thresholds, dedup=False):
+    """
+    Choose the mafft mode used to align each family, from its number of sequences
+    (distinct sequences with dedup) and its longest protein (see ``choose_mode``).
+
+    Parameters
+    ----------
+    prefix :  str
+        path to ``aldir/<name of dataset>``
+    all_fams : []
+        list of family numbers to align
+    thresholds : dict
+        thresholds to choose the mode (see ``MODE_THRESHOLDS``)
+    dedup : bool
+        True if only 1 copy of identical proteins is aligned
+
+    Returns
+    -------
+    dict
+        {num_fam: (number of sequences to align, longest protein, mafft mode)} for all
+        families of all_fams whose proteins are extracted
+    """
+    chosen = {}
+    for num_fam in all_fams:
+        prt_file = f"{prefix}-current.{num_fam}.prt"
+        if not os.path.isfile(prt_file):
+            continue
+        nseqs, ndistinct, maxlen = family_profile(prt_file)
+        nb_align = ndistinct if dedup else nseqs
+        chosen[num_fam] = (nb_align, maxlen, choose_mode(nb_align, maxlen, thresholds))
+    counts = collections.Counter(record[2] for record in chosen.values())
+    main_logger.info("mafft modes chosen: " + ", ".join(f"{mode} for {nb} families"
+                                                       for mode, nb in sorted(counts.items())))
+    return chosen
+
+
+def record_modes(prefix, new_modes):
+    """
+    Record the mafft mode used to align families in ``<prefix>-mafft-modes.tsv`` (family
+    number, number of sequences to align, longest protein, mode), so that the same alignments
+    can be redone. Families which are not in new_modes keep the mode recorded by a previous
+    run: their alignments were not done again.
+
+    Parameters
+    ----------
+    prefix :  str
+        path to ``aldir/<name of dataset>``
+    new_modes : dict
+        {num_fam: (number of sequences aligned, longest protein, mafft mode)} for each
+        family aligned by mafft in this run (see ``choose_modes``)
+    """
+    modes_file = f"{prefix}-mafft-modes.tsv"
+    records = {}
+    if os.path.isfile(modes_file):
+        with open(modes_file, "r") as modf:
+            for line in modf:
+                fields = line.strip().split("\t")
+                if len(fields) == 4 and fields[0].isdigit():
+                    records[fields[0]] = fields[1:]
+    for num_fam, record in new_modes.items():
+        records[str(num_fam)] = [str(field) for field in record]
+    with open(modes_file, "w") as modf:
+        modf.write("family\tnb_seqs\tmax_length\tmode\n")
+        for num_fam in sorted(records, key=int):
+            modf.write("\t".join([num_fam] + records[num_fam]) + "\n")
+
+
+def family_profile(prt_file):
+    """
+    Get the size of the given family
+
+    Parameters
+    ----------
+    prt_file : str
+        path to file containing all proteins extracted
+
+    Returns
+    -------
+    tuple
+        (number of proteins, number of distinct proteins, length of the longest protein)
+    """
+    seqs = set()
+    nseqs = 0
+    maxlen = 0
+    seq = []
+    with open(prt_file, "r") as prtf:
+        for line in prtf:
+            if line.startswith(">"):
+                nseqs += 1
+                if seq:
+                    seq = "".join(seq)
+                    seqs.add(seq)
+                    maxlen = max(maxlen, len(seq))
+                seq = []
+            else:
+                seq.append(line.strip())
+    if seq:
+        seq = "".join(seq)
+        seqs.add(seq)
+        maxlen = max(maxlen, len(seq))
+    return nseqs, len(seqs), maxlen
+
+
+def choose_mode(nseqs, maxlen, thresholds):
+    """
+    Choose the mafft mode to align a family:
+
+    - L-INS-i (most accurate, very slow) for small families: at most linsi_max_seqs
+      sequences, and at most linsi_max_len aa
+    - PartTree (fast, less accurate) for huge families: at least parttree_min_seqs sequences
+    - FFT-NS-2 for all other families
+
+    Parameters
+    ----------
+    nseqs : int
+        number of sequences to align
+    maxlen : int
+        length of the longest sequence
+    thresholds : dict
+        thresholds to choose the mode (see ``MODE_THRESHOLDS``). Missing thresholds take
+        their default value.
+
+    Returns
+    -------
+    str
+        mafft mode, key of ``MAFFT_MODES``
+    """
+    thresholds = dict(MODE_THRESHOLDS, **thresholds)
+    if nseqs <= thresholds["linsi_max_seqs"] and maxlen <= thresholds["linsi_max_len"]:
+        return "L-INS-i"
+    if nseqs >= thresholds["parttree_min_seqs"]:
+        return "PartTree"
+    return "FFT-NS-2"
+
+
 def handle_family_1thread(args):
     """
     For the given family:
@@ -164,11 +493,12 @@ def handle_family_1thread(args):
     Parameters
     ----------
     args : ()
-         (prefix, num_fam, ngenomes, q) with:
+         (prefix, num_fam, ngenomes, options) with:
 
          - prefix: path to ``aldir/<name of dataset>``
          - num_fam: the current family number
          - ngenomes: the total number of genomes in dataset
+         - options: dict of alignment options (see ``align_all_families``), can be empty
 
     Returns
     -------
@@ -180,7 +510,7 @@ def handle_family_1thread(args):
         - False if any problem (extractions, alignment, btr, add missing genomes...)
         - True if just generated all files, and everything is ok
     """
-    prefix, num_fam, ngenomes = args
+    prefix, num_fam, ngenomes, options = args
     logger = logging.getLogger('align.align_family')
     # Get file names
     prt_file = f"{prefix}-current.{num_fam}.prt"
@@ -190,7 +520,11 @@ def handle_family_1thread(args):
     btr_file = f"{prefix}-mafft-prt2nuc.{num_fam}.aln"
     # Align all sequences for given family
     status1 = family_alignment(prt_file, gen_file, miss_file, mafft_file, btr_file,
-                               num_fam, ngenomes, logger)
+                               num_fam, ngenomes, logger,
+                               btr_awk=options.get("btr_awk", False),
+                               mafft_threads=options.get("mafft_threads", 1),
+                               dedup=options.get("dedup", False),
+                               mafft_mode=options.get("mafft_modes", {}).get(num_fam, "auto"))
     #  status1 is:
     # - False if problem with extractions, alignment or backtranslation -> return False
     # - 'nb_seqs' = number of sequences aligned if everything went well (extractions and
@@ -198,9 +532,14 @@ def handle_family_1thread(args):
     # - "OK" if extractions and alignments went well, and btr already exists and is ok
     # If it returned true or the , Add missing genomes
     # If 'OK' or nb_seq, add missing genomes
-    if status1:
+    if status1 and options.get("compact", False):
+        # Do not add missing genomes: they will be added when grouping alignments by genome
+        added_aa = check_compact(mafft_file, "protein", miss_file, num_fam, ngenomes, status1, logger)
+        added_nucl = check_compact(btr_file, "back-translated", miss_file, num_fam, ngenomes, status1, logger)
+    elif status1:
         added_aa = add_missing_genomes(mafft_file, "protein", miss_file, num_fam, ngenomes, status1, logger)
         added_nucl = add_missing_genomes(btr_file, "back-translated", miss_file, num_fam, ngenomes, status1, logger)
+    if status1:
         # 1 of them false: return false
         # both are "OK": return OK (no need to remove concatenated and grouped files)
         # 1 of them true (not "OK"): return true
@@ -225,12 +564,13 @@ def handle_family(args):
     Parameters
     ----------
     args : ()
-         (prefix, num_fam, ngenomes, q) with:
+         (prefix, num_fam, ngenomes, q, options) with:
 
          - prefix: path to ``aldir/<name of dataset>``
          - num_fam: the current family number
          - ngenomes: the total number of genomes in dataset
          - q: a queue, which will be used by logger to put logs while in other process
+         - options: dict of alignment options (see ``align_all_families``), can be empty
 
     Returns
     -------
@@ -242,7 +582,7 @@ def handle_family(args):
         - False if any problem (extractions, alignment, btr, add missing genomes...)
         - True if just generated all files, and everything is ok
     """
-    prefix, num_fam, ngenomes, q = args
+    prefix, num_fam, ngenomes, q, options = args
     qh = logging.handlers.QueueHandler(q)
     root = logging.getLogger()
     root.setLevel(logging.DEBUG)
@@ -250,7 +590,34 @@ def handle_family(args):
     logging.addLevelName(utils.detail_lvl(), "DETAIL")
     root.addHandler(qh)
     logger = logging.getLogger('align.align_family')
-    return handle_family_1thread((prefix, num_fam, ngenomes))
+    return handle_family_1thread((prefix, num_fam, ngenomes, options))
+
+
+def handle_families(args):
+    """
+    Align all families of a task (see ``handle_family``)
+
+    Parameters
+    ----------
+    args : ()
+         (prefix, fam_nums, ngenomes, q, options, mafft_threads) with:
+
+         - prefix: path to ``aldir/<name of dataset>``
+         - fam_nums: the family numbers to align
+         - ngenomes: the total number of genomes in dataset
+         - q: a queue, which will be used by logger to put logs while in other process
+         - options: dict of alignment options (see ``align_all_families``), or None
+         - mafft_threads: number of threads mafft can use for those families
+
+    Returns
+    -------
+    list
+        (num_fam, result of ``handle_family``) for each family of the task
+    """
+    prefix, fam_nums, ngenomes, q, options, mafft_threads = args
+    options = dict(options or {}, mafft_threads=mafft_threads)
+    return [(num_fam, handle_family((prefix, num_fam, ngenomes, q, options)))
+            for num_fam in fam_nums]
 
 
 def add_missing_genomes(align_file, ali_type, miss_file, num_fam, ngenomes, status1, logger):
@@ -312,9 +679,10 @@ def add_missing_genomes(align_file, ali_type, miss_file, num_fam, ngenomes, stat
     # status is length of sequence (if it was True or False, it already ended this function)
     logger.log(utils.detail_lvl(), f"Adding missing genomes for family {num_fam} in {ali_type} alignment.")
     len_aln = status
-    with open(miss_file, "r") as missf, open(align_file, "a") as alif:
-        for genome in missf:
-            genome = genome.strip()
+    missing = missing_genomes(miss_file)
+    forget_parsed(align_file)
+    with open(align_file, "a") as alif:
+        for genome in missing:
             toadd = ">" + genome + "\n" + "-" * len_aln + "\n"
             alif.write(toadd)
     # check_add_missing called with prev=False :
@@ -323,6 +691,57 @@ def add_missing_genomes(align_file, ali_type, miss_file, num_fam, ngenomes, stat
     return ret
 
 
+def check_compact(align_file, ali_type, miss_file, num_fam, ngenomes, status1, logger):
+    """
+    Once all family proteins are aligned, and back-translated to nucleotides, check the
+    alignment without adding missing genomes: it must contain, with the missing genomes, all
+    genomes of the dataset. Missing genomes will only be added as gaps in the alignment grouped
+    by genome.
+
+    Parameters
+    ----------
+    align_file : str
+        path to file containing alignments (proteins if from mafft output,
+        or nucleic sequences if after backtranslating them)
+    ali_type : str
+        protein or backtranslated
+    miss_file : str
+        path to file containing the list of missing genomes in this family
+    num_fam : int
+        family number
+    ngenomes : int
+        total number of genomes in dataset
+    status1 : bool or str
+        "OK" if we did not redo the alignments as they already were as expected, True if
+        we just did them
+    logger : logging.Logger
+        the logger, having a queue Handler, to give logs to the main logger
+
+    Returns
+    -------
+    bool or str
+        - "OK" if alignment file was not recreated, and is as expected
+        - False if problem in alignment file (sequences with different lengths, or genomes
+          missing which are not in miss_file)
+        - True if alignment file was just created, and is as expected
+    """
+    res = check_lens(align_file, num_fam, logger)
+    if not res:
+        return False
+    nb = res[1]
+    nbmiss = len(missing_genomes(miss_file))
+    # It can also contain all genomes, if missing genomes were added in a previous run
+    if nb not in [ngenomes - nbmiss, ngenomes]:
+        logger.error((f"ERROR: family {num_fam} contains {nb} genomes and {nbmiss} missing "
+                      f"genomes instead of the {ngenomes} genomes in input.\n"))
+        return False
+    if status1 == "OK":
+        logger.warning(f"{ali_type} alignment already done for family {num_fam}. The program will use "
+                       "it for next steps")
+        return "OK"
+    return True
+
+
 def check_add_missing(btr_file, num_fam, ngenomes, logger, prev):
     """
     Check back-translated alignment while missing genomes have been added
@@ -383,7 +802,8 @@ def check_add_missing(btr_file, num_fam, ngenomes, logger, prev):
 
 
 def family_alignment(prt_file, gen_file, miss_file, mafft_file, btr_file,
-                     num_fam, ngenomes, logger):
+                     num_fam, ngenomes, logger, btr_awk=False, mafft_threads=1, dedup=False,
+                     mafft_mode="auto"):
     """
     From a given family, align all its proteins with mafft, back-translate
     to nucleotides, and add missing genomes in this family.
@@ -407,6 +827,14 @@ def family_alignment(prt_file, gen_file, miss_file, mafft_file, btr_file,
         total number of genomes in dataset
     logger : logging.Logger
         logger with queueHandler to give logs to main logger
+    btr_awk : bool
+        True to back-translate with the awk script, False to use the python back-translation
+    mafft_threads : int
+        number of threads mafft can use to align this family
+    dedup : bool
+        True to align only 1 copy of identical proteins (see ``mafft_align``)
+    mafft_mode : str
+        mafft mode used to align this family (key of ``MAFFT_MODES``)
 
     Returns
     -------
@@ -432,16 +860,11 @@ def family_alignment(prt_file, gen_file, miss_file, mafft_file, btr_file,
     if os.path.isfile(mafft_file):
         # There can be nbfprt (number of proteins extracted) 
         # or nb_genomes (proteins extracted + missing added with '-')
-        nbfal1 = check_nb_seqs(mafft_file, nbfprt, logger, "")
-        nbfal2 = check_nb_seqs(mafft_file, ngenomes, logger, "")
-        # if nbfal1: missing genomes have not been added yet. Save this value for later
-        if nbfal1:
-            nbfal = nbfal1
-        # if nbfal2: missing genomes already there, save for later
-        elif nbfal2:
-            nbfal = nbfal2
+        # - nbfprt: missing genomes have not been added yet
+        # - ngenomes: missing genomes already there
+        nbfal = check_nb_seqs(mafft_file, [nbfprt, ngenomes], logger, "")
         # If not any of those 2 numbers: error
-        else:
+        if not nbfal:
             message = (f"fam {num_fam}: Will redo alignment, because found a different number of proteins "
                        f"extracted in {prt_file} ({nbfprt}) and proteins aligned in "
                        f"existing {mafft_file}")
@@ -452,7 +875,8 @@ def family_alignment(prt_file, gen_file, miss_file, mafft_file, btr_file,
     # yet), remove btr (will be regenerated), and do alignment with mafft
     if not os.path.isfile(mafft_file):
         utils.remove(btr_file)  # remove if exists...
-        nbfal = mafft_align(num_fam, prt_file, mafft_file, nbfprt, logger)
+        nbfal = mafft_align(num_fam, prt_file, mafft_file, nbfprt, logger,
+                            mafft_threads=mafft_threads, dedup=dedup, mafft_mode=mafft_mode)
     # If problem with alignment, return False
     if not nbfal:
         return False
@@ -475,7 +899,8 @@ def family_alignment(prt_file, gen_file, miss_file, mafft_file, btr_file,
     # or just not generated yet), do back-translation, and return:
     # - number of sequences back-translated if it went well,
     # - False otherwise
-    return back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger)
+    return back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger,
+                          use_awk=btr_awk)
 
 
 def check_extractions(num_fam, miss_file, prt_file, gen_file, ngenomes, logger):
@@ -509,7 +934,7 @@ def check_extractions(num_fam, miss_file, prt_file, gen_file, ngenomes, logger):
     logger.log(utils.detail_lvl(), f"Checking extractions for family {num_fam}")
 
     # Check that extractions went well
-    nbmiss = utils.count(miss_file)
+    nbmiss = len(missing_genomes(miss_file))
     # If files with proteins extracted do not even exist, close with error
     # (they should have been created at the previous step)
     if not os.path.isfile(gen_file):
@@ -520,8 +945,8 @@ def check_extractions(num_fam, miss_file, prt_file, gen_file, ngenomes, logger):
         logger.error(f"fam {num_fam}: no file with proteins extracted "
                      f"('{prt_file}'). Cannot align.")
         sys.exit(1)
-    nbfprt = utils.grep(prt_file, "^>", counts=True)
-    nbfgen = utils.grep(gen_file, "^>", counts=True)
+    nbfprt = fasta_stats(prt_file)[0]
+    nbfgen = fasta_stats(gen_file)[0]
     if nbmiss + nbfprt != ngenomes:
         logger.error(("fam {}: wrong sum of missing genomes ({}) and prt extracted ({}) for {} "
                       "genomes in the dataset.").format(num_fam, nbmiss, nbfprt, ngenomes))
@@ -533,9 +958,14 @@ def check_extractions(num_fam, miss_file, prt_file, gen_file, ngenomes, logger):
     return nbfprt
 
 
-def mafft_align(num_fam, prt_file, mafft_file, nbfprt, logger):
+def mafft_align(num_fam, prt_file, mafft_file, nbfprt, logger, mafft_threads=1, dedup=False,
+                mafft_mode="auto"):
     """
-    Align all proteins of the given family with mafft
+    Align all proteins of the given family with mafft.
+
+    With dedup, identical proteins are aligned only once: mafft aligns one representative
+    per distinct sequence, and the alignment is then re-expanded so that mafft_file
+    contains a row for each protein of prt_file, in the same order.
 
     Parameters
     ----------
@@ -549,6 +979,12 @@ def mafft_align(num_fam, prt_file, mafft_file, nbfprt, logger):
         number of proteins extracted in prt file
     logger : logging.Logger
         logger with queueHandler to give logs to main logger
+    mafft_threads : int
+        number of threads mafft can use
+    dedup : bool
+        True to align only 1 copy of identical proteins
+    mafft_mode : str
+        mafft mode used to align the family (key of ``MAFFT_MODES``), "auto" by default
 
     Returns
     -------
@@ -557,24 +993,127 @@ def mafft_align(num_fam, prt_file, mafft_file, nbfprt, logger):
         False otherwise
     """
     logger.log(utils.detail_lvl(), f"Aligning family {num_fam}")
-    cmd = f"mafft --auto {prt_file}"
+    members = None
+    to_align = prt_file
+    out_align = mafft_file
+    if dedup:
+        uniq_prt = mafft_file + ".uniq.prt"
+        nb_uniq, members = dedup_proteins(prt_file, uniq_prt)
+        if nb_uniq < nbfprt:
+            logger.log(utils.detail_lvl(), f"fam {num_fam}: aligning {nb_uniq} distinct proteins "
+                                           f"out of {nbfprt}")
+            to_align = uniq_prt
+            out_align = mafft_file + ".uniq.aln"
+        else:
+            members = None
+            os.remove(uniq_prt)
+    if mafft_threads > 1:
+        cmd = f"mafft {MAFFT_MODES[mafft_mode]} --thread {mafft_threads} {to_align}"
+    else:
+        cmd = f"mafft {MAFFT_MODES[mafft_mode]} {to_align}"
     error = f"Problem while trying to align fam {num_fam}"
-    stdout = open(mafft_file, "w")
+    forget_parsed(mafft_file)
+    stdout = open(out_align, "w")
     stderr = open(mafft_file + ".log", "w")
     logger.log(utils.detail_lvl(), f"Mafft command: {cmd}")
     ret = utils.run_cmd(cmd, error, stdout=stdout, stderr=stderr, logger=logger)
     stdout.close()
     if not isinstance(ret, int):
         ret = ret.returncode
+    if members is not None:
+        os.remove(to_align)
+        if ret == 0:
+            try:
+                expand_alignment(out_align, members, mafft_file)
+            except KeyError as err:
+                logger.error(f"{error}: {err}")
+                ret = 1
+        os.remove(out_align)
     if ret != 0:
-        os.remove(mafft_file)
+        utils.remove(mafft_file)
         return False
     message = (f"fam {num_fam}: different number of proteins extracted in {prt_file} ({nbfprt}) and proteins "
                f"aligned in {mafft_file}")
     return check_nb_seqs(mafft_file, nbfprt, logger, message)
 
 
-def back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger):
+def dedup_proteins(prt_file, uniq_file):
+    """
+    Write 1 copy of each distinct protein of prt_file to uniq_file. Representatives are
+    named by their index (0 for the first distinct sequence found, 1 for the next one etc.)
+
+    Parameters
+    ----------
+    prt_file : str
+        path to file containing all proteins extracted for the family
+    uniq_file : str
+        path to the file which will contain the distinct proteins
+
+    Returns
+    -------
+    tuple
+        (nb_uniq, members) with nb_uniq the number of distinct proteins, and members the
+        list of (header, index of its representative), for each protein of prt_file,
+        in the same order
+    """
+    uniq = {}
+    members = []
+
+    def add_protein(header, seq):
+        seq = "".join(seq)
+        if seq not in uniq:
+            uniq[seq] = len(uniq)
+            uniqf.write(f">{uniq[seq]}\n")
+            uniqf.write("".join(seq[i:i + 60] + "\n" for i in range(0, len(seq), 60)))
+        members.append((header, uniq[seq]))
+
+    header = None
+    seq = []
+    with open(prt_file, "r") as prtf, open(uniq_file, "w") as uniqf:
+        for line in prtf:
+            if line.startswith(">"):
+                if header is not None:
+                    add_protein(header, seq)
+                header = line[1:].rstrip("\n")
+                seq = []
+            elif header is not None:
+                seq.append(line.strip())
+        if header is not None:
+            add_protein(header, seq)
+    return len(uniq), members
+
+
+def expand_alignment(uniq_aln, members, mafft_file):
+    """
+    From the alignment of distinct proteins, write the alignment of all proteins: each
+    protein gets the aligned sequence of its representative.
+
+    Parameters
+    ----------
+    uniq_aln : str
+        path to the alignment of distinct proteins (named by their index)
+    members : list
+        list of (header, index of its representative), as returned by ``dedup_proteins``
+    mafft_file : str
+        path to file which will contain the alignment of all proteins
+
+    Raises
+    ------
+    KeyError
+        if a representative is not in the alignment of distinct proteins
+    """
+    with open(uniq_aln, "r") as alnf:
+        aligned = {name: seq for name, seq in read_fasta_seqs(alnf)}
+    with open(mafft_file, "w") as mafftf:
+        for header, rep in members:
+            if str(rep) not in aligned:
+                raise KeyError(f"no aligned sequence found for protein {header.split()[0]}")
+            seq = aligned[str(rep)]
+            mafftf.write(">" + header + "\n")
+            mafftf.write("".join(seq[i:i + 60] + "\n" for i in range(0, len(seq), 60)))
+
+
+def back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger, use_awk=False):
     """
     Backtranslate protein alignment to nucleotides
 
@@ -593,6 +1132,9 @@ def back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger):
         number of sequences aligned for the family by mafft
     logger : logging.Logger
         logger with queueHandler to give logs to main logger
+    use_awk : bool
+        True to back-translate with the awk script (prt2codon.awk), False (default) to
+        back-translate in python, in a single pass
 
     Returns
     -------
@@ -601,11 +1143,58 @@ def back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger):
         - number of sequences in btr file if everything went well
     """
     logger.log(utils.detail_lvl(), f"Back-translating family {num_fam}")
+    error = f"Problem while trying to backtranslate {mafft_file} to a nucleotide alignment"
+    forget_parsed(btr_file)
+    if use_awk:
+        return back_translate_awk(num_fam, mafft_file, gen_file, btr_file, nbfal, logger, error)
+    try:
+        lengths = back_translate_seqs(num_fam, mafft_file, gen_file, btr_file, logger)
+    except OSError as err:
+        logger.error(f"{error}: {err}")
+        lengths = None
+    if lengths is None:
+        utils.remove(btr_file)
+        return False
+    nbseqs = len(lengths)
+    message = (f"fam {num_fam}: different number of proteins aligned in {mafft_file} ({nbfal}) and genes "
+               f"back-translated in {btr_file}")
+    if nbseqs != nbfal:
+        logger.error(f"{message} ({nbseqs})")
+        return False
+    return nbseqs
+
+
+def back_translate_awk(num_fam, mafft_file, gen_file, btr_file, nbfal, logger, error):
+    """
+    Backtranslate protein alignment to nucleotides with the awk script prt2codon.awk
+
+    Parameters
+    ----------
+    num_fam : int
+        current family number. Used for log messages
+    mafft_file : str
+        path to file containing protein alignments by mafft
+    gen_file : str
+        path to file containing all sequences, not aligned, in nucleotides
+    btr_file : str
+        path to the file that will contain the nucleotide alignment
+    nbfal : int
+        number of sequences aligned for the family by mafft
+    logger : logging.Logger
+        logger with queueHandler to give logs to main logger
+    error : str
+        error message if awk command fails
+
+    Returns
+    -------
+    bool
+        - False if problem (back-translation, different number of families...)
+        - number of sequences in btr file if everything went well
+    """
     curpath = os.path.dirname(os.path.abspath(__file__))
     awk_script = os.path.join(curpath, "prt2codon.awk")
     cmd = f"awk -f {awk_script} {mafft_file} {gen_file}"
     stdout = open(btr_file, "w")
-    error = f"Problem while trying to backtranslate {mafft_file} to a nucleotide alignment"
     ret = utils.run_cmd(cmd, error, stdout=stdout, logger=logger)
     stdout.close()
     if not isinstance(ret, int):
@@ -617,7 +1206,89 @@ def back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger):
                f"back-translated in {btr_file}")
     # Check number of sequences in btr file, and return True/False according to it
     # It should contain the same number of sequences as the mafft file.
-    return check_nb_seqs(mafft_file, nbfal, logger, message)
+    return check_nb_seqs(btr_file, nbfal, logger, message)
+
+
+def back_translate_seqs(num_fam, mafft_file, gen_file, btr_file, logger):
+    """
+    Write the nucleotide alignment corresponding to the protein alignment: each amino-acid
+    is replaced by its codon in the gene, and each gap by '---'. Sequences are written
+    in the same order as in the protein alignment, 60 nucleotides per line (same output as
+    prt2codon.awk).
+
+    Parameters
+    ----------
+    num_fam : int
+        current family number. Used for log messages
+    mafft_file : str
+        path to file containing protein alignments by mafft
+    gen_file : str
+        path to file containing all genes (not aligned) of the family
+    btr_file : str
+        path to the file that will contain the nucleotide alignment
+    logger : logging.Logger
+        logger with queueHandler to give logs to main logger
+
+    Returns
+    -------
+    list or None
+        length of each sequence back-translated, or None if a protein of the alignment does
+        not have its gene in gen_file
+    """
+    with open(gen_file, "r") as genf:
+        genes = dict(read_fasta_seqs(genf))
+    lengths = []
+    with open(mafft_file, "r") as mafftf, open(btr_file, "w") as btrf:
+        for name, prot in read_fasta_seqs(mafftf):
+            if name not in genes:
+                logger.error(f"fam {num_fam}: no gene found in {gen_file} for protein {name} "
+                             f"of {mafft_file}. It cannot be back-translated.")
+                return None
+            gene = genes[name]
+            codons = []
+            pos = 0
+            for aa in prot:
+                if aa == "-":
+                    codons.append("---")
+                else:
+                    codons.append(gene[pos:pos + 3])
+                    pos += 3
+            seq = "".join(codons)
+            btrf.write(">" + name + "\n")
+            btrf.write("".join(seq[i:i + 60] + "\n" for i in range(0, len(seq), 60)))
+            lengths.append(len(seq))
+    return lengths
+
+
+def read_fasta_seqs(fastaf):
+    """
+    Read all sequences of an open fasta file.
+
+    Parameters
+    ----------
+    fastaf : _io.TextIO
+        open fasta file
+
+    Returns
+    -------
+    generator
+        (name, sequence) for each sequence, with name the first word of its header
+    """
+    name = None
+    seq = []
+    for line in fastaf:
+        if line.startswith(">"):
+            if name is not None:
+                yield name, "".join(seq)
+            fields = line[1:].split()
+            name = fields[0] if fields else ""
+            seq = []
+        elif name is not None:
+            fields = line.split()
+            if fields:
+                seq.append(fields[0])
+    if name is not None:
+        yield name, "".join(seq)
 
 
 def check_nb_seqs(alnfile, nbfal, logger, message=""):
@@ -641,7 +1312,7 @@ def check_nb_seqs(alnfile, nbfal, logger, message=""):
         - False if not same number of sequences
         - nbseqs in align file if found among values in 'nbfal'
     """
-    nbseqs = utils.grep(alnfile, "^>", counts=True)
+    nbseqs = fasta_stats(alnfile)[0]
     if isinstance(nbfal, int):
         nbfal = [nbfal]
     for num in nbfal:
@@ -674,24 +1345,134 @@ def check_lens(aln_file, num_fam, logger):
         same length).
         If they all have the same length, returns this length and the number of sequences
     """
-    nb_gen = 0
-    all_sums = set()
-    with open(aln_file, "r") as btrf:
-        cur_sum = 0
-        start = True
-        for line in btrf:
-            if line.startswith(">"):
-                nb_gen += 1
-                if not start:
-                    all_sums.add(cur_sum)
-                    cur_sum = 0
-            else:
-                start = False
-                cur_sum += len(line.strip())
-        all_sums.add(cur_sum)
+    nb_gen, lengths = fasta_stats(aln_file)
+    all_sums = set(lengths) if lengths else {0}
     if len(all_sums) > 1:
         logger.error(f"Nucleic alignments for family {num_fam} (in {aln_file}) do not all have the same "
                      f"length. Lengths found are: {all_sums}\n")
         return False
     # Return sequence length and number of sequences in alignment file
     return list(all_sums)[0], nb_gen
+
+
+def fasta_stats(fasta):
+    """
+    Get the number of sequences in the given fasta file, and the length of each of them.
+
+    The file is read only once while it is not modified: the result is kept for the next
+    checks of this file (see ``parse_once``).
+
+    Parameters
+    ----------
+    fasta : str
+        path to the fasta file (extracted sequences or alignment)
+
+    Returns
+    -------
+    tuple
+        (number of sequences, [length of each sequence])
+    """
+    return parse_once(fasta, read_fasta_stats)
+
+
+def read_fasta_stats(fasta):
+    """
+    Read the given fasta file, and get its number of sequences, and the length of each of them
+
+    Parameters
+    ----------
+    fasta : str
+        path to the fasta file
+
+    Returns
+    -------
+    tuple
+        (number of sequences, [length of each sequence])
+    """
+    lengths = []
+    with open(fasta, "r") as fastaf:
+        for line in fastaf:
+            if line.startswith(">"):
+                lengths.append(0)
+            elif lengths:
+                lengths[-1] += len(line.strip())
+    return len(lengths), lengths
+
+
+def missing_genomes(miss_file):
+    """
+    Get the list of genomes missing in a family.
+
+    Parameters
+    ----------
+    miss_file : str
+        path to the file containing the list of missing genomes (1 per line)
+
+    Returns
+    -------
+    list
+        list of genomes missing in the family
+    """
+    return parse_once(miss_file, read_missing_genomes)
+
+
+def read_missing_genomes(miss_file):
+    """
+    Read the list of genomes missing in a family.
+
+    Parameters
+    ----------
+    miss_file : str
+        path to the file containing the list of missing genomes (1 per line)
+
+    Returns
+    -------
+    list
+        list of genomes missing in the family
+    """
+    with open(miss_file, "r") as missf:
+        return [line.strip() for line in missf]
+
+
+def parse_once(filename, parser):
+    """
+    Parse the given file, unless it was already parsed by this process, and did not change
+    since then (same inode, size and modification time). In that case, return the previous
+    result. Only results of files really parsed are kept.
+
+    Parameters
+    ----------
+    filename : str
+        path to the file to parse
+    parser : function
+        function parsing the file, called with the filename
+
+    Returns
+    -------
+    Object
+        result of parser
+    """
+    stat = os.stat(filename)
+    key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if filename in PARSED_FILES and PARSED_FILES[filename][0] == key:
+        PARSED_FILES.move_to_end(filename)
+        return PARSED_FILES[filename][1]
+    result = parser(filename)
+    PARSED_FILES[filename] = (key, result)
+    PARSED_FILES.move_to_end(filename)
+    while len(PARSED_FILES) > MAX_PARSED_FILES:
+        PARSED_FILES.popitem(last=False)
+    return result
+
+
+def forget_parsed(filename):
+    """
+    Forget the result of parsing 'filename': it is about to be written again, and must be
+    parsed again the next time it is checked.
+
+    Parameters
+    ----------
+    filename : str
+        path to the file which will be written
+    """
+    PARSED_FILES.pop(filename, None)
@@ -36,14 +36,214 @@
 import sys
 import os
 import logging
+import mmap
+import shutil
+import collections
+import multiprocessing
 import progressbar
 
 from PanACoTA import utils
+from PanACoTA.align_module import workspace as ws
 
 logger = logging.getLogger("align.extract")
 
+# Max number of family files kept open at the same time while extracting sequences
+MAX_OPEN_FILES = 128
+# Size (number of characters) from which the buffer of a family is written to its file
+FAMILY_BUFFER_SIZE = 1 << 16
+# Max number of characters kept in all buffers before writing everything
+TOTAL_BUFFER_SIZE = 1 << 26
 
-def get_all_seqs(all_genomes, dname, dbpath, listdir, aldir, all_fams, quiet):
+
+class ExtractionWriters:
+    """
+    Writers used to extract sequences to their family files.
+
+    Instead of opening and closing the family file for each sequence, lines to write are
+    kept in a buffer per output file. A buffer is written to its file when it reaches
+    'buffer_size' characters, or when all buffers together contain more than 'total_size'
+    characters. File handles are kept in a pool of at most 'max_open' files: when the pool
+    is full, the least recently used file is closed.
+
+    Files are always opened in append mode, and lines are written in the order they were
+    given for each file, so that output files are the same as when writing each
+    sequence directly.
+
+    Parameters
+    ----------
+    max_open : int
+        max number of files open at the same time
+    buffer_size : int
+        number of characters from which the buffer of a file is written
+    total_size : int
+        max number of characters kept in all buffers
+    """
+
+    def __init__(self, max_open=MAX_OPEN_FILES, buffer_size=FAMILY_BUFFER_SIZE,
+                 total_size=TOTAL_BUFFER_SIZE):
+        self.max_open = max(1, max_open)
+        self.buffer_size = buffer_size
+        self.total_size = total_size
+        self.buffers = {}  # {filename: [lines to write]}
+        self.sizes = {}  # {filename: number of characters in buffer}
+        self.total = 0
+        self.handles = collections.OrderedDict()  # {filename: open file}, by last use
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, filename, line):
+        """
+        Add 'line' to the buffer of 'filename', and write buffers if they are full.
+
+        Parameters
+        ----------
+        filename : str
+            path to the file to which the line must be written
+        line : str
+            line to write
+        """
+        if filename not in self.buffers:
+            self.buffers[filename] = []
+            self.sizes[filename] = 0
+        self.buffers[filename].append(line)
+        self.sizes[filename] += len(line)
+        self.total += len(line)
+        if self.sizes[filename] >= self.buffer_size:
+            self.flush(filename)
+        elif self.total >= self.total_size:
+            self.flush_all()
+
+    def flush(self, filename):
+        """
+        Write the buffer of 'filename' to this file.
+
+        Parameters
+        ----------
+        filename : str
+            path to the file whose buffer must be written
+        """
+        data = self.pop_buffer(filename)
+        if data:
+            self.get_handle(filename).write(data)
+
+    def pop_buffer(self, filename):
+        """
+        Empty the buffer of 'filename', and return its content.
+
+        Parameters
+        ----------
+        filename : str
+            path to the file whose buffer must be emptied
+
+        Returns
+        -------
+        str
+            all lines which were in the buffer ("" if nothing)
+        """
+        lines = self.buffers.get(filename)
+        if not lines:
+            return ""
+        self.total -= self.sizes[filename]
+        self.buffers[filename] = []
+        self.sizes[filename] = 0
+        return "".join(lines)
+
+    def flush_all(self):
+        """
+        Write all buffers to their files.
+        """
+        for filename in list(self.buffers):
+            self.flush(filename)
+
+    def get_handle(self, filename):
+        """
+        Get the file handle to write in 'filename'. Open it if needed, closing the least
+        recently used file if the pool is full.
+
+        Parameters
+        ----------
+        filename : str
+            path to the file to write
+
+        Returns
+        -------
+        _io.TextIO
+            file open in append mode
+        """
+        if filename in self.handles:
+            self.handles.move_to_end(filename)
+            return self.handles[filename]
+        if len(self.handles) >= self.max_open:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        outf = open(filename, "a")
+        self.handles[filename] = outf
+        return outf
+
+    def close(self):
+        """
+        Write all buffers, and close all files.
+        """
+        self.flush_all()
+        for outf in self.handles.values():
+            outf.close()
+        self.handles.clear()
+        self.buffers.clear()
+        self.sizes.clear()
+        self.total = 0
+
+
+class FragmentWriters(ExtractionWriters):
+    """
+    Writers used by a process extracting the sequences of a shard of genomes.
+
+    Instead of writing to the family files, buffers are written, as blocks, to a unique
+    fragment file. Each block is saved in 'index' as (family_file, offset, size), in the
+    order it was written, so that the main process can then copy all blocks to their
+    family file, in the same order as if sequences were written directly.
+
+    Parameters
+    ----------
+    fragfile : str
+        path to the fragment file
+    total_size : int
+        max number of characters kept in all buffers, before writing them to the fragment file
+    """
+
+    def __init__(self, fragfile, total_size=TOTAL_BUFFER_SIZE):
+        super().__init__(max_open=1, buffer_size=total_size, total_size=total_size)
+        self.fragfile = fragfile
+        self.fragf = open(fragfile, "wb")
+        self.index = []  # [(family file, offset in fragment, size)]
+
+    def flush(self, filename):
+        """
+        Write the buffer of 'filename' as a block of the fragment file.
+
+        Parameters
+        ----------
+        filename : str
+            path to the family file whose buffer must be written
+        """
+        data = self.pop_buffer(filename).encode()
+        if data:
+            self.index.append((filename, self.fragf.tell(), len(data)))
+            self.fragf.write(data)
+
+    def close(self):
+        """
+        Write all buffers to the fragment file, and close it.
+        """
+        super().close()
+        self.fragf.close()
+
+
+def get_all_seqs(all_genomes, dname, dbpath, listdir, aldir, all_fams, quiet, threads=1,
+                 workspace=False, compact=False, plan=None):
     """
     For all genomes, extract its proteins present in a persistent family to the file
     corresponding to this family.
@@ -57,16 +257,30 @@ def get_all_seqs(all_genomes, dname, dbpath, listdir, aldir, all_fams, quiet):
     dbpath : str
         path to folder containing 'Proteins' and 'Genes' folders
     listdir : str
-        path to folder containing the lists of proteins/genes to extract
+        path to folder containing the lists of proteins/genes to extract (not used if plan
+        is given)
     aldir : str
         path to folder where extracted proteins/genes must be saved
     all_fams : []
         list of all family numbers
     quiet : bool
         True if nothin must be written to stdout/stderr, False otherwise
+    threads : int
+        max number of processes which can extract sequences at the same time
+    workspace : bool
+        True if families already aligned are stored in the workspace (see ``workspace`` module)
+    compact : bool
+        True if family alignments do not contain missing genomes: families stored in the
+        workspace in another mode must be extracted again
+    plan : dict or None
+        extraction plan kept in memory instead of the lists of proteins/genes to extract
+        (see ``pan_to_pergenome.extraction_plan``)
     """
+    stored = None
+    if workspace:
+        stored = ws.stored_families(os.path.join(aldir, dname), all_fams, ws.align_mode(compact))
     # Get list of files not already existing
-    files_todo = check_existing_extract(all_fams, aldir, dname)
+    files_todo = check_existing_extract(all_fams, aldir, dname, stored)
     if len(files_todo) == 0:
         logger.info(("All extraction files already existing (see detailed log for "
                      "more information)"))
@@ -87,25 +301,226 @@ def get_all_seqs(all_genomes, dname, dbpath, listdir, aldir, all_fams, quiet):
                    progressbar.ETA()]
         bar = progressbar.ProgressBar(widgets=widgets, max_value=nbgen, term_width=79).start()
         curnum = 1
-    for genome in all_genomes:
-        ge_gen = os.path.join(listdir, dname + "-getEntry_gen_" + genome + ".txt")
-        ge_prt = os.path.join(listdir, dname + "-getEntry_prt_" + genome + ".txt")
-        logger.details(f"Extracting proteins and genes from {genome}")
-        prtdb = os.path.join(dbpath, "Proteins", genome + ".prt")
-        gendb = os.path.join(dbpath, "Genes", genome + ".gen")
-        get_genome_seqs(prtdb, ge_prt, files_todo)
-        get_genome_seqs(gendb, ge_gen, files_todo)
-        if not quiet:
-            bar.update(curnum)
-            curnum += 1
+    if threads > 1 and nbgen > 1:
+        extract_all_parallel(all_genomes, dname, dbpath, listdir, aldir, files_todo,
+                             threads, bar, plan)
+    else:
+        # Same writers for all genomes: family files stay open (and buffered) between genomes
+        with ExtractionWriters() as writers:
+            for genome in all_genomes:
+                logger.details(f"Extracting proteins and genes from {genome}")
+                extract_genome(genome, dname, dbpath, listdir, files_todo, writers, plan)
+                if not quiet:
+                    bar.update(curnum)
+                    curnum += 1
     if not quiet:
         bar.finish()
 
 
-def check_existing_extract(all_fams, aldir, dname):
+def extract_genome(genome, dname, dbpath, listdir, files_todo, writers, plan=None):
+    """
+    Extract proteins and genes of the given genome to their family files.
+
+    Parameters
+    ----------
+    genome : str
+        name of the genome
+    dname : str
+        name of dataset
+    dbpath : str
+        path to folder containing 'Proteins' and 'Genes' folders
+    listdir : str
+        path to folder containing the lists of proteins/genes to extract (not used if plan
+        is given)
+    files_todo : list
+        list of files which must be generated (prt and gen files)
+    writers : ExtractionWriters
+        writers used to write sequences to their family file
+    plan : dict or None
+        extraction plan kept in memory: {genome: {member: family file without extension}}
+    """
+    prtdb = os.path.join(dbpath, "Proteins", genome + ".prt")
+    gendb = os.path.join(dbpath, "Genes", genome + ".gen")
+    if plan is not None:
+        members = plan[genome]
+        to_prt = {mem: fam_file + ".prt" for mem, fam_file in members.items()}
+        extract_genome_seqs(prtdb, to_prt, files_todo, writers=writers)
+        to_gen = {mem: fam_file + ".gen" for mem, fam_file in members.items()}
+        extract_genome_seqs(gendb, to_gen, files_todo, writers=writers)
+        return
+    ge_gen = os.path.join(listdir, dname + "-getEntry_gen_" + genome + ".txt")
+    ge_prt = os.path.join(listdir, dname + "-getEntry_prt_" + genome + ".txt")
+    get_genome_seqs(prtdb, ge_prt, files_todo, writers=writers)
+    get_genome_seqs(gendb, ge_gen, files_todo, writers=writers)
+
+
+def extract_all_parallel(all_genomes, dname, dbpath, listdir, aldir, files_todo, threads,
+                         bar=None, plan=None):
+    """
+    Extract proteins and genes from all genomes, using several processes.
+
+    Genomes are split into shards of consecutive genomes. Each process extracts the
+    sequences of a shard to a fragment file. Then, fragments are copied to the family
+    files, in the order of the shards, so that family files are the same as when
+    extracting all genomes one after the other.
+
+    Parameters
+    ----------
+    all_genomes : []
+        list of all genome names
+    dname : str
+        name of dataset
+    dbpath : str
+        path to folder containing 'Proteins' and 'Genes' folders
+    listdir : str
+        path to folder containing the lists of proteins/genes to extract (not used if plan
+        is given)
+    aldir : str
+        path to folder where extracted proteins/genes must be saved
+    files_todo : list
+        list of files which must be generated (prt and gen files)
+    threads : int
+        max number of processes to use
+    bar : progressbar.ProgressBar or None
+        progressbar to update when genomes are extracted (None if quiet)
+    plan : dict or None
+        extraction plan kept in memory instead of the lists of proteins/genes to extract
+    """
+    tmpdir = os.path.join(aldir, f"{dname}-extract_tmp")
+    os.makedirs(tmpdir, exist_ok=True)
+    shards = split_genomes(all_genomes, threads * 4)
+    arguments = [(shard, dname, dbpath, listdir, files_todo,
+                  os.path.join(tmpdir, f"fragment_{num}.txt"), shard_plan(plan, shard))
+                 for num, shard in enumerate(shards)]
+    done = 0
+    pool = multiprocessing.Pool(threads)
+    try:
+        with ExtractionWriters() as writers:
+            # imap returns results in the order of shards, whatever the order they finish
+            for num, index in enumerate(pool.imap(extract_shard, arguments)):
+                fragfile = arguments[num][5]
+                merge_fragment(fragfile, index, writers)
+                os.remove(fragfile)
+                for genome in shards[num]:
+                    logger.details(f"Extracting proteins and genes from {genome}")
+                done += len(shards[num])
+                if bar:
+                    bar.update(done)
+        pool.close()
+        pool.join()
+    # If an error occurs (or user kills with keybord), terminate pool and exit
+    except Exception as excp:  # pragma: no cover
+        pool.terminate()
+        logger.error(excp)
+        sys.exit(1)
+    shutil.rmtree(tmpdir)
+
+
+def shard_plan(plan, shard):
+    """
+    Get the part of the extraction plan concerning the genomes of a shard, so that each
+    process only receives what it needs
+
+    Parameters
+    ----------
+    plan : dict or None
+        extraction plan kept in memory, or None if lists of proteins/genes to extract are
+        written in files
+    shard : list
+        list of genomes of the shard
+
+    Returns
+    -------
+    dict or None
+        extraction plan of the genomes of the shard, or None if there is no plan
+    """
+    if plan is None:
+        return None
+    return {genome: plan[genome] for genome in shard}
+
+
+def split_genomes(all_genomes, nb_shards):
+    """
+    Split the list of genomes into at most 'nb_shards' lists of consecutive genomes.
+
+    Parameters
+    ----------
+    all_genomes : []
+        list of all genome names
+    nb_shards : int
+        max number of shards
+
+    Returns
+    -------
+    list
+        list of shards (each shard is a list of consecutive genomes)
+    """
+    nb_shards = max(1, min(nb_shards, len(all_genomes)))
+    size, left = divmod(len(all_genomes), nb_shards)
+    shards = []
+    start = 0
+    for num in range(nb_shards):
+        end = start + size + (1 if num < left else 0)
+        shards.append(all_genomes[start:end])
+        start = end
+    return shards
+
+
+def extract_shard(args):
+    """
+    Extract proteins and genes of all genomes of a shard to a fragment file.
+
+    Parameters
+    ----------
+    args : tuple
+        (genomes, dname, dbpath, listdir, files_todo, fragfile, plan) with:
+
+        - genomes: list of genomes of the shard
+        - dname: name of dataset
+        - dbpath: path to folder containing 'Proteins' and 'Genes' folders
+        - listdir: path to folder containing the lists of proteins/genes to extract
+        - files_todo: list of files which must be generated (prt and gen files)
+        - fragfile: path to the fragment file to write
+        - plan: extraction plan of the genomes of the shard, or None to read the lists of
+          proteins/genes to extract in listdir
+
+    Returns
+    -------
+    list
+        [(family file, offset in fragment, size)] for each block written in fragment file
+    """
+    genomes, dname, dbpath, listdir, files_todo, fragfile, plan = args
+    writers = FragmentWriters(fragfile)
+    with writers:
+        for genome in genomes:
+            extract_genome(genome, dname, dbpath, listdir, files_todo, writers, plan)
+    return writers.index
+
+
+def merge_fragment(fragfile, index, writers):
+    """
+    Copy all blocks of a fragment file to their family file.
+
+    Parameters
+    ----------
+    fragfile : str
+        path to the fragment file
+    index : list
+        [(family file, offset in fragment, size)] for each block of the fragment
+    writers : ExtractionWriters
+        writers used to write to family files
+    """
+    with open(fragfile, "rb") as fragf:
+        for filename, offset, size in index:
+            fragf.seek(offset)
+            writers.write(filename, fragf.read(size).decode())
+
+
+def check_existing_extract(all_fams, aldir, dname, stored=None):
     """
     For each family, check if its prt and gen extraction file already exist.
-    If both exist, no need to re-extract for those families.
+    If both exist, or if the family is already stored in the workspace, no need to
+    re-extract for those families.
     If only one or no one exists, put to list to extract.
 
     Parameters
@@ -116,6 +531,8 @@ def check_existing_extract(all_fams, aldir, dname):
         path to directory where extraction files must be saved
     dname : str
         name of the dataset
+    stored : set or None
+        families already aligned and stored in the workspace
 
     Returns
     -------
@@ -124,6 +541,8 @@ def check_existing_extract(all_fams, aldir, dname):
     """
     extract_fams = []
     for fam in all_fams:
+        if stored and fam in stored:
+            continue
         genfile = os.path.join(aldir, "{}-current.{}.gen".format(dname, fam))
         prtfile = os.path.join(aldir, "{}-current.{}.prt".format(dname, fam))
         if not os.path.isfile(genfile) or not os.path.isfile(prtfile):
@@ -148,9 +567,10 @@ def check_existing_extract(all_fams, aldir, dname):
     return extract_fams
 
 
-def get_genome_seqs(fasta, tabfile, files_todo, outfile=None):
+def get_genome_seqs(fasta, tabfile, files_todo, outfile=None, writers=None):
     """
-    From a fasta file, extract all sequences given in the tab file.
+    From a fasta file, extract all sequences given in the tab file. If the fasta file has an
+    index (see ``utils.index_fasta``), only the sequences to extract are read.
     The tab file can contain:
 
     - 1 sequence name per line -> all sequences will be extracted to the same file
@@ -173,21 +593,55 @@ def get_genome_seqs(fasta, tabfile, files_todo, outfile=None):
         if None, the tab file must contain 2 columns (1 for the sequence name,
         1 for its output file). If an outfile is given (not None), only the 1st column of tab file
         will be considered, and all sequences will be extracted to the given outfile.
+    writers : ExtractionWriters or None
+        writers used to write sequences to their family file (when no outfile given). If None,
+        new writers are used, and all files are closed at the end of this genome.
     """
     with open(tabfile, "r") as tabf:
         to_extract = get_names_to_extract(tabf, outfile)
+    if outfile and os.path.isfile(outfile):
+        logger.warning("Sequences are already extracted in {}. This will "
+                       "be used for next step. If you want "
+                       "to re-extract all sequences, use option -F (or "
+                       "--force)".format(outfile))
+        return
     if outfile:
-        if os.path.isfile(outfile):
-            logger.warning("Sequences are already extracted in {}. This will "
-                           "be used for next step. If you want "
-                           "to re-extract all sequences, use option -F (or "
-                           "--force)".format(outfile))
-            return
-        with open(fasta, "r") as fasf, open(outfile, "a") as outf:
-            extract_sequences(to_extract, fasf, outf=outf)
+        # If fasta file is indexed, directly read the sequences to extract
+        index = utils.read_fasta_index(fasta)
+        with open(outfile, "a") as outf:
+            if index is not None:
+                extract_indexed(to_extract, fasta, index, outf=outf)
+            else:
+                with open(fasta, "r") as fasf:
+                    extract_sequences(to_extract, fasf, outf=outf)
+    else:
+        extract_genome_seqs(fasta, to_extract, files_todo, writers=writers)
+
+
+def extract_genome_seqs(fasta, to_extract, files_todo, writers=None):
+    """
+    From a fasta file, extract all given sequences to their family file. If the fasta file
+    has an index (see ``utils.index_fasta``), only the sequences to extract are read.
+
+    Parameters
+    ----------
+    fasta : str
+        path to fasta file from which sequences must be extracted
+    to_extract : dict
+        {sequence_to_extract: file_to_which_it_will_be_extracted}
+    files_todo : list
+        list of files which must be generated (prt and gen files). Others
+        already exist, so ignore them.
+    writers : ExtractionWriters or None
+        writers used to write sequences to their family file. If None, new writers are used,
+        and all files are closed at the end of this genome.
+    """
+    index = utils.read_fasta_index(fasta)
+    if index is not None:
+        extract_indexed(to_extract, fasta, index, files_todo=files_todo, writers=writers)
     else:
         with open(fasta, "r") as fasf:
-            extract_sequences(to_extract, fasf, files_todo=files_todo)
+            extract_sequences(to_extract, fasf, files_todo=files_todo, writers=writers)
 
 
 def get_names_to_extract(tabf, outfile):
@@ -226,7 +680,7 @@ def get_names_to_extract(tabf, outfile):
     return to_extract
 
 
-def extract_sequences(to_extract, fasf, files_todo=None, outf=None):
+def extract_sequences(to_extract, fasf, files_todo=None, outf=None, writers=None):
     """
     Extract sequences from an open fasta file 'fasf', and a list of sequences to
     extract
@@ -246,7 +700,14 @@ def extract_sequences(to_extract, fasf, files_todo=None, outf=None):
         considered, and all these sequences will be extracted to 'outfile' (if 'to_extract' is a
         list, will extract all sequences of this list). Otherwise, if None,
         each sequence will be extracted to its corresponding value in 'to_extract'.
+    writers : ExtractionWriters or None
+        writers used to write each sequence to its output file, when 'outf' is None. If None,
+        new writers are created, and closed at the end of the extraction.
     """
+    if outf is None and writers is None:
+        with ExtractionWriters() as own_writers:
+            extract_sequences(to_extract, fasf, files_todo=files_todo, writers=own_writers)
+        return
 
     # Create optimized index for requests
     if files_todo is None:
@@ -254,15 +715,13 @@ def extract_sequences(to_extract, fasf, files_todo=None, outf=None):
     files_todo = frozenset(files_todo)
     if type(to_extract) == list:
         to_extract = frozenset(to_extract)
-    # State machine variables
-    previous_fp = None
+    # State machine variables: output of the current sequence (open file if 'outf' given,
+    # filename otherwise). None if current sequence must not be extracted.
+    current_out = None
 
     for line in fasf:
         if line[0] == '>':
-            # Close previous file if needed
-            if outf is None and previous_fp is not None:
-                previous_fp.close()
-            previous_fp = None
+            current_out = None
 
             # Extract sequence name
             last_char = line.find(' ')
@@ -272,18 +731,69 @@ def extract_sequences(to_extract, fasf, files_todo=None, outf=None):
 
             # Seq is part of sequences to extract
             if seq in to_extract:
-                # Open the right file
-                previous_fp = outf
-                if previous_fp is None:
+                # Find the right output
+                current_out = outf
+                if current_out is None:
                     out = to_extract[seq]
                     if out in files_todo:
-                        previous_fp = open(out, "a")
+                        current_out = out
                     else:
                         print(f"Sequence {seq} not written because no output file specified", file=sys.stderr)
 
-        # Write the line content if the file pointer is opened
-        if previous_fp is not None:
-            previous_fp.write(line)
+        # Write the line content if the current sequence must be extracted
+        if current_out is not None:
+            if outf is None:
+                writers.write(current_out, line)
+            else:
+                current_out.write(line)
+
 
-    if outf is None and previous_fp is not None:
-        previous_fp.close()
+def extract_indexed(to_extract, fasta, index, files_todo=None, outf=None, writers=None):
+    """
+    Extract sequences from an indexed fasta file: only read records of sequences to
+    extract, in the order they appear in the fasta file.
+
+    Parameters
+    ----------
+    to_extract : dict or []
+        {sequence_to_extract: file_to_which_it_will_be_extracted} or list of sequences to
+        extract, all in a same outfile (name must be given in 'outf')
+    fasta : str
+        path to fasta file containing sequences
+    index : dict
+        index of fasta file: {sequence name: [(offset, size) of each record with this name]}
+    files_todo : list or None
+        list of files which must be generated (prt and gen files). Others
+        already exist, so ignore them.
+    outf : _io.TextIO or None
+        If given, all sequences are extracted to this open file. Otherwise, each sequence
+        is extracted to its corresponding value in 'to_extract'.
+    writers : ExtractionWriters or None
+        writers used to write each sequence to its output file, when 'outf' is None. If None,
+        new writers are created, and closed at the end of the extraction.
+    """
+    if outf is None and writers is None:
+        with ExtractionWriters() as own_writers:
+            extract_indexed(to_extract, fasta, index, files_todo=files_todo,
+                            writers=own_writers)
+        return
+    if files_todo is None:
+        files_todo = []
+    files_todo = frozenset(files_todo)
+    # All records with a name to extract, as when reading the whole fasta file
+    records = sorted(record + (seq,) for seq in to_extract if seq in index
+                     for record in index[seq])
+    if not records:
+        return
+    with open(fasta, "rb") as fasf, \
+            mmap.mmap(fasf.fileno(), 0, access=mmap.ACCESS_READ) as fasmm:
+        for start, size, seq in records:
+            if outf is not None:
+                outf.write(fasmm[start:start + size].decode())
+                continue
+            out = to_extract[seq]
+            if out in files_todo:
+                writers.write(out, fasmm[start:start + size].decode())
+            else:
+                print(f"Sequence {seq} not written because no output file specified",
+                      file=sys.stderr)
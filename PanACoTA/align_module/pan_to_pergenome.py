@@ -55,6 +55,10 @@ Output:
 - for each family: ``<outdir>/Align-<dname>/<dname>-current.<fam_num>.miss.lst``: list of
   genomes which do not have members in family 'fam_num'.
 
+Instead of writing the 2 lists of proteins/genes to extract for each genome, the extraction
+plan can also be kept in memory, and given directly to the extraction step (see
+``get_seqs.get_all_seqs``).
+
 @author GEM
 November 2016
 """
@@ -63,15 +67,19 @@ import os
 import sys
 import logging
 
+from PanACoTA.align_module import workspace as ws
+
 logger = logging.getLogger("align.pan_to_pergenome")
 
 
-def get_per_genome(persgen, list_gen, dname, outdir):
+def get_per_genome(persgen, list_gen, dname, outdir, write_lists=True, workspace=False,
+                   compact=False):
     """
     From persistent genome and list of all genomes, sort persistent proteins by genome
 
     For each genome, write all persistent proteins to a file, with the family from which they
-    are, in order to extract those proteins after.
+    are, in order to extract those proteins after (or, if write_lists is False, keep them
+    in memory in the extraction plan).
     For each family, also save the names of genomes which do not have any member. This will
     be used to complete the alignments by stretches of '-'.
 
@@ -85,22 +93,34 @@ def get_per_genome(persgen, list_gen, dname, outdir):
         name of the dataset
     outdir : str
         Directory where files must be saved. Will create 2 subfolders: ``Align-<dname>``
-        and ``List-<dname>``
+        and ``List-<dname>`` (only ``Align-<dname>`` if write_lists is False)
+    write_lists : bool
+        True to write the lists of proteins/genes to extract for each genome, False to
+        return the extraction plan instead
+    workspace : bool
+        True if families already aligned are stored in the workspace (see ``workspace``
+        module): their list of missing genomes is not written again
+    compact : bool
+        True if family alignments do not contain missing genomes (alignment mode of the
+        families stored in the workspace)
 
     Returns
     -------
-    (all_genomes, aldir, listdir, families) : tuple
+    (all_genomes, aldir, listdir, families, plan) : tuple
 
         * all_genomes : [] list of all genome names
         * aldir : str, path to align directory
-        * listdir : str, path to List directory
+        * listdir : str, path to List directory (not created if write_lists is False)
         * families : str, list of family numbers
+        * plan : dict or None, extraction plan if write_lists is False (see
+          ``extraction_plan``), None otherwise
     """
     # Define output directories
     aldir = os.path.join(outdir, "Align-" + dname)
     listdir = os.path.join(outdir, "List-" + dname)
     os.makedirs(aldir, exist_ok=True)
-    os.makedirs(listdir, exist_ok=True)
+    if write_lists:
+        os.makedirs(listdir, exist_ok=True)
 
     # Get list of all genomes
     all_genomes = get_all_genomes(list_gen)
@@ -110,9 +130,17 @@ def get_per_genome(persgen, list_gen, dname, outdir):
     logger.info("Reading PersGenome and constructing lists of missing genomes in each family.")
     all_prots, fam_genomes, several = proteins_per_strain(persgen, all_genomes)
     # Write output files
-    write_getentry_files(all_prots, several, listdir, aldir, dname, all_genomes)
-    write_missing_genomes(fam_genomes, several, all_genomes, aldir, dname)
-    return all_genomes, aldir, listdir, fam_genomes.keys()
+    plan = None
+    if write_lists:
+        write_getentry_files(all_prots, several, listdir, aldir, dname, all_genomes)
+    else:
+        plan = extraction_plan(all_prots, several, aldir, dname, all_genomes)
+    stored = None
+    if workspace:
+        stored = ws.stored_families(os.path.join(aldir, dname), fam_genomes,
+                                    ws.align_mode(compact))
+    write_missing_genomes(fam_genomes, several, all_genomes, aldir, dname, stored)
+    return all_genomes, aldir, listdir, fam_genomes.keys(), plan
 
 
 def get_all_genomes(list_gen):
@@ -230,6 +258,51 @@ def write_getentry_files(all_prots, several, listdir, aldir, dname, all_genomes)
         sys.exit(1)
 
 
+def extraction_plan(all_prots, several, aldir, dname, all_genomes):
+    """
+    For each genome, get all its persistent proteins, with the file to which they must be
+    extracted (same information as the files written by ``write_getentry_files``, but kept
+    in memory).
+
+    Parameters
+    ----------
+    all_prots : dict
+        {strain: {member: fam_num}}
+    several : dict
+        {fam_num: [genomes having several members in family]}
+    aldir : str
+         directory where extracted proteins per family must be saved
+    dname : str
+        name of dataset
+    all_genomes : list
+        list of all genomes
+
+    Returns
+    -------
+    dict
+        {genome: {member: path to family extraction files without extension}}, for example
+        ``<aldir>/<dname>-current.<fam_num>``: proteins will be extracted to this path + '.prt',
+        and genes to this path + '.gen'.
+    """
+    # Same string for all members of a family
+    fam_files = {fam: os.path.join(aldir, dname + "-current." + fam) for fam in several}
+    plan = {}
+    error = []
+    for strain in all_genomes:
+        members = all_prots.get(strain, {})
+        plan[strain] = {mem: fam_files[fam] for mem, fam in members.items()
+                        if strain not in several[fam]}
+        if not members:
+            error.append(strain)
+    if error:
+        for gen in error:
+            logger.error(f"There is not any protein for genome {gen} in any family! "
+                         "The program will close, please fix this problem to be able to "
+                         "run the alignments")
+        sys.exit(1)
+    return plan
+
+
 def write_genome_file(listdir, aldir, dname, strain, member, several):
     """
     For a given genome, write all the proteins and genes to extract to its file.
@@ -272,7 +345,7 @@ def write_genome_file(listdir, aldir, dname, strain, member, several):
                 gepf.write(mem + " " + prtfile + "\n")
 
 
-def write_missing_genomes(fam_genomes, several, all_genomes, aldir, dname):
+def write_missing_genomes(fam_genomes, several, all_genomes, aldir, dname, stored=None):
     """
     For each family, write the names of all genomes which do not have any member in
     the family.
@@ -289,14 +362,30 @@ def write_missing_genomes(fam_genomes, several, all_genomes, aldir, dname):
         directory where the lists of missing genomes per family must be saved
     dname : str
         name of dataset
+    stored : set or None
+        families already aligned and stored in the workspace: no need to write their list
     """
+    # Index of each genome in the bitset of a family
+    genome_nums = {genome: num for num, genome in enumerate(all_genomes)}
     for fam, genomes in fam_genomes.items():
+        if stored and fam in stored:
+            continue
+        # Genomes present in the family with only 1 member
+        present = bytearray(len(all_genomes))
+        for genome in genomes:
+            if genome in genome_nums:
+                present[genome_nums[genome]] = 1
+        for genome in several[fam]:
+            if genome in genome_nums:
+                present[genome_nums[genome]] = 0
         # File where missing genomes will be written
         missfile = os.path.join(aldir, f"{dname}-current.{fam}.miss.lst")
         with open(missfile, "w") as mff:
-            # missing = missing or several members:
-            # miss: all genomes - genomes in the family
-            # several: add to 'miss' genomes with several members in the family
-            missing = (set(all_genomes) - set(genomes)).union(set(several[fam]))
+            # missing = missing or several members
+            missing = []
+            num = present.find(0)
+            while num != -1:
+                missing.append(all_genomes[num])
+                num = present.find(0, num + 1)
             if missing:
                 mff.write("\n".join(missing) + "\n")
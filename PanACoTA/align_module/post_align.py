@@ -43,21 +43,37 @@ March 2017
 
 import os
 import sys
+import mmap
+import array
 import logging
 import progressbar
 import multiprocessing
+import numpy as np
 from PanACoTA import utils
+from PanACoTA.align_module import workspace as ws
 
 logger = logging.getLogger("align.post")
 
+# Max number of characters of the alignment put in a matrix at the same time when finding
+# site patterns
+PATTERNS_CHUNK = 1 << 26
 
-def post_alignment(fam_nums, all_genomes, prefix, outdir, dname, prot_ali, quiet):
+
+def post_alignment(fam_nums, all_genomes, prefix, outdir, dname, prot_ali, quiet, compact=False,
+                   workspace=False, patterns=None, trimmed=False, matrix=False):
     """
     After the alignment of all proteins by family:
 
     - concatenate all alignment files
     - group the alignment by genome
 
+    With compact family alignments (missing genomes not added as gap rows), there is no
+    concatenation: the alignment grouped by genome is directly built from all family alignments.
+
+    If asked, the nucleic alignment grouped by genome is then compressed into its site
+    patterns (see ``compress_sites``), and the alignments grouped by genome are also saved
+    as binary matrices (see ``write_matrix``).
+
     Parameters
     ----------
     fam_nums : []
@@ -74,29 +90,66 @@ def post_alignment(fam_nums, all_genomes, prefix, outdir, dname, prot_ali, quiet
         true: also give concatenated alignment in aa
     quiet : bool
         True if nothing must be sent to sdtout/stderr, False otherwise
+    compact : bool
+        True if family alignments do not contain missing genomes
+    workspace : bool
+        True if family alignments can be stored in the workspace (see ``workspace`` module)
+    patterns : str or None
+        None to keep only the alignment grouped by genome, "all" to also write its site
+        patterns and their weights, "variable" to write only its variable site patterns
+    trimmed : bool
+        True to use the trimmed family alignments (see ``trimming`` module). Alignments
+        grouped by genome are then called ``<dname>-trim.<nucl or aa>.grp.aln``, so that
+        they are never mistaken for the untrimmed ones (and conversely)
+    matrix : bool
+        True to also save each alignment grouped by genome as a uint8 matrix, with its row
+        names and the columns of each family
     """
-    all_alns_nucl, status_nucl = concat_alignments(fam_nums, prefix, "nucl", quiet)
+    if compact:
+        all_alns_nucl, status_nucl = family_files(fam_nums, prefix, "nucl", workspace,
+                                                    trimmed), "OK"
+    else:
+        all_alns_nucl, status_nucl = concat_alignments(fam_nums, prefix, "nucl", quiet,
+                                                       workspace, trimmed)
     treedir = os.path.join(outdir, "Phylo-" + dname)
     os.makedirs(treedir, exist_ok=True)
-    outfile_nucl = os.path.join(treedir, dname + ".nucl.grp.aln")
-    res_nucl = launch_group_by_genome(all_genomes, all_alns_nucl, status_nucl, outfile_nucl, dname, "nucleic", quiet)
-    if not res_nucl:
-        utils.remove(all_alns_nucl)
+    grp_prefix = os.path.join(treedir, dname + ("-trim" if trimmed else ""))
+    outfile_nucl = grp_prefix + ".nucl.grp.aln"
+    jobs = [(all_alns_nucl, status_nucl, outfile_nucl, "nucleic")]
+    if prot_ali and compact:
+        all_alns_aa, status_aa = family_files(fam_nums, prefix, "aa", workspace, trimmed), "OK"
+        outfile_aa = grp_prefix + ".aa.grp.aln"
+        jobs.append((all_alns_aa, status_aa, outfile_aa, "protein"))
+    elif prot_ali:
+        all_alns_aa, status_aa = concat_alignments(fam_nums, prefix, "aa", quiet, workspace,
+                                                   trimmed)
+        outfile_aa = grp_prefix + ".aa.grp.aln"
+        jobs.append((all_alns_aa, status_aa, outfile_aa, "protein"))
+    # Group nucleic and protein alignments at the same time
+    results = launch_groups_by_genome(all_genomes, jobs, dname, quiet)
+    if not results[0]:
+        if not compact:
+            utils.remove(all_alns_nucl)
         utils.remove(outfile_nucl)
         logger.error("An error occurred. We could not group DNA alignments by genome.")
         sys.exit(1)
-    if prot_ali:
-        all_alns_aa, status_aa = concat_alignments(fam_nums, prefix, "aa", quiet)
-        outfile_aa = os.path.join(treedir, dname + ".aa.grp.aln")
-        res_aa = launch_group_by_genome(all_genomes, all_alns_aa, status_aa, outfile_aa, dname, "protein", quiet)
-        if not res_aa:
+    if prot_ali and not results[1]:
+        if not compact:
             utils.remove(all_alns_aa)
-            utils.remove(outfile_aa)
-            logger.error("An error occurred. We could not group protein alignments by genome.")
+        utils.remove(outfile_aa)
+        logger.error("An error occurred. We could not group protein alignments by genome.")
+    if matrix:
+        write_matrix(outfile_nucl, fam_nums,
+                     family_files(fam_nums, prefix, "nucl", workspace, trimmed))
+        if prot_ali and results[1]:
+            write_matrix(outfile_aa, fam_nums,
+                         family_files(fam_nums, prefix, "aa", workspace, trimmed))
+    if patterns:
+        compress_sites(outfile_nucl, variable_only=(patterns == "variable"))
     return outfile_nucl
 
 
-def concat_alignments(fam_nums, prefix, ali_type, quiet):
+def concat_alignments(fam_nums, prefix, ali_type, quiet, workspace=False, trimmed=False):
     """
     Concatenate all family alignment files to a unique file
 
@@ -111,6 +164,10 @@ def concat_alignments(fam_nums, prefix, ali_type, quiet):
         aa or nucl
     quiet : bool
         True if nothing must be sent to sdtout/stderr, False otherwise
+    workspace : bool
+        True if family alignments can be stored in the workspace
+    trimmed : bool
+        True to concatenate the trimmed family alignments
 
     Returns
     -------
@@ -120,14 +177,10 @@ def concat_alignments(fam_nums, prefix, ali_type, quiet):
         - output: path to file containing concatenation of all alignments
         - str: "OK" if concatenation file already exists, "Done" if just did concatenation
     """
-    if ali_type == "aa":
-        info = "mafft-align"
-    elif ali_type == "nucl":
-        info = "mafft-prt2nuc"
-    else:
+    if ali_type not in ["aa", "nucl"]:
         logger.error(f"Not possible to concatenate '{ali_type}' type of alignments.")
         sys.exit(1)
-    output = f"{prefix}-complete.{ali_type}.cat.aln"
+    output = f"{prefix}-complete{'-trim' if trimmed else ''}.{ali_type}.cat.aln"
     if os.path.isfile(output):
         logger.info(f"{ali_type} alignments already concatenated")
         logger.warning(f"{ali_type} alignments already concatenated in {output}. Program will use "
@@ -135,24 +188,58 @@ def concat_alignments(fam_nums, prefix, ali_type, quiet):
                         "running.")
         return output, "OK"
     logger.info(f"Concatenating all {ali_type} alignment files")
+    list_files = family_files(fam_nums, prefix, ali_type, workspace, trimmed)
+    cat = ws.cat if workspace else utils.cat
+    if quiet:
+        cat(list_files, output)
+    else:
+        cat(list_files, output, title="Concatenation")
+    return output, "Done"
+
+
+def family_files(fam_nums, prefix, ali_type, workspace=False, trimmed=False):
+    """
+    Get the alignment files of all families, and check that they all exist (in aldir,
+    or in the workspace)
+
+    Parameters
+    ----------
+    fam_nums : []
+        list of family numbers
+    prefix : str
+        path to ``aldir/<name of dataset>``
+    ali_type : str
+        aa or nucl
+    workspace : bool
+        True if family alignments can be stored in the workspace
+    trimmed : bool
+        True to get the trimmed family alignments (always in aldir)
+
+    Returns
+    -------
+    list
+        path to the alignment file of each family, or ``workspace.Member`` for families
+        stored in the workspace
+    """
+    info = "align" if ali_type == "aa" else "prt2nuc"
+    info = ("trim-" if trimmed else "mafft-") + info
     list_files = [f"{prefix}-{info}.{num_fam}.aln" for num_fam in fam_nums]
+    catalog = ws.read_catalog(prefix) if workspace else {}
     # Check that all files exist
-    for f in list_files:
+    for num, f in enumerate(list_files):
         if not os.path.isfile(f):
+            if os.path.basename(f) in catalog:
+                list_files[num] = catalog[os.path.basename(f)]
+                continue
             logger.error(f"The alignment file {f} does not exist. Please check the families you "
                          "want, and their corresponding alignment files")
             sys.exit(1)
-    if quiet:
-        utils.cat(list_files, output)
-    else:
-        utils.cat(list_files, output, title="Concatenation")
-    return output, "Done"
+    return list_files
 
 
 def launch_group_by_genome(all_genomes, all_alns, status, outfile, dname, type_ali, quiet):
     """
-    Function calling group_by_genome in a pool, while giving information to user
-    (time elapsed)
+    Group the given concatenated alignment by genome (see ``launch_groups_by_genome``)
 
     Parameters
     ----------
@@ -177,27 +264,74 @@ def launch_group_by_genome(all_genomes, all_alns, status, outfile, dname, type_a
         - True if everything went well or was already done
         - False if error occurred in at least one step
     """
-    # Status = Done means that we just did the concatenation. So, if grouped by genome
-    # file already exists, remove it.
-    if status == "Done":
+    jobs = [(all_alns, status, outfile, type_ali)]
+    return launch_groups_by_genome(all_genomes, jobs, dname, quiet)[0]
+
+
+def launch_groups_by_genome(all_genomes, jobs, dname, quiet):
+    """
+    Group each concatenated alignment by genome. When there are several alignments
+    to group (nucleic and protein), they are grouped at the same time, each one in its
+    own process, while giving information to user (time elapsed)
+
+    Parameters
+    ----------
+    all_genomes : []
+        list of all genomes in the dataset
+    jobs : list
+        list of (all_alns, status, outfile, type_ali) with:
+
+        - all_alns: path to file containing all alignments concatenated, or list of
+          compact family alignment files
+        - status: "OK" if concatenation file already existed before running, "Done" if
+          just did concatenation
+        - outfile: file containing all families align by genome
+        - type_ali: nucleic or protein
+    dname : str
+        name of dataset
+    quiet : bool
+        True if nothing must be sent to sdtout/stderr, False otherwise
+
+    Returns
+    -------
+    list
+        for each job, in the same order:
+
+        - True if everything went well or was already done
+        - False if error occurred in at least one step
+    """
+    results = [True] * len(jobs)
+    todo = []
+    for num, (all_alns, status, outfile, type_ali) in enumerate(jobs):
+        # Status = Done means that we just did the concatenation. So, if grouped by genome
+        # file already exists, remove it.
+        if status == "Done":
+            if os.path.isfile(outfile):
+                utils.remove(outfile)
+        # Status was not 'Done' (it was 'ok', concat file already existed). And by_genome file
+        # also already exists. Warn user
         if os.path.isfile(outfile):
-            utils.remove(outfile)
-    # Status was not 'Done' (it was 'ok', concat file already existed). And by_genome file
-    # also already exists. Warn user
-    if os.path.isfile(outfile):
-        logger.info(f"{type_ali} alignments already grouped by genome")
-        logger.warning((f"{type_ali} alignments already grouped by genome in {outfile}. "
-                        "Program will end. "))
-        return True
-    logger.info(f"Grouping {type_ali} alignments per genome")
+            logger.info(f"{type_ali} alignments already grouped by genome")
+            logger.warning((f"{type_ali} alignments already grouped by genome in {outfile}. "
+                            "Program will end. "))
+            continue
+        logger.info(f"Grouping {type_ali} alignments per genome")
+        todo.append(num)
+    # Only 1 alignment to group: no need to start another process
+    if len(todo) == 1:
+        all_alns, _, outfile, _ = jobs[todo[0]]
+        results[todo[0]] = group_by_genome([all_genomes, all_alns, outfile])
+        return results
+    if not todo:
+        return results
     bar = None
     if not quiet:
         widgets = [progressbar.BouncingBar(marker=progressbar.RotatingMarker(markers="◐◓◑◒")),
                    "  -  ", progressbar.Timer()]
         bar = progressbar.ProgressBar(widgets=widgets, max_value=20, term_width=50)
-    pool = multiprocessing.Pool(1)
-    args = [all_genomes, all_alns, outfile]
-    final = pool.map_async(group_by_genome, [args], chunksize=1)
+    pool = multiprocessing.Pool(len(todo))
+    args = [[all_genomes, jobs[num][0], jobs[num][2]] for num in todo]
+    final = pool.map_async(group_by_genome, args, chunksize=1)
     pool.close()
     if not quiet:
         while True:
@@ -206,20 +340,27 @@ def launch_group_by_genome(all_genomes, all_alns, status, outfile, dname, type_a
             bar.update()
         bar.finish()
     pool.join()
-    return False not in final.get()
+    for num, res in zip(todo, final.get()):
+        results[num] = res
+    return results
 
 
 def group_by_genome(args):
     """
     From the alignment file 'all_alns' containing all proteins, group the alignments of
     proteins by their genome (listed in 'all_genomes'), and save the result
-    in 'treedir'
+    in 'treedir'.
+
+    The alignment file is read twice, without keeping sequences in memory: a first time to
+    find the genome of each sequence and the length of the alignment of each genome, and
+    a second time to copy each sequence at its place in the output file.
 
     Parameters
     ----------
     args : tuple
         - all_genomes: list of all genomes
-        - all_alns: path to file containing all alignments concatenated
+        - all_alns: path to file containing all alignments concatenated, or list of
+          family alignment files, which do not contain missing genomes
         - outfile: path to file which will contain alignments grouped by genome
 
     Returns
@@ -229,10 +370,17 @@ def group_by_genome(args):
         - False if problem when trying to group by genomes
     """
     all_genomes, all_alns, outfile = args
-    sequences = read_alignments(all_alns, all_genomes)
-    if not sequences:
+    # Compact family alignments: missing genomes are only added in the grouped alignment
+    if isinstance(all_alns, list):
+        found = read_families(all_alns, all_genomes)
+        if not found:
+            return False
+        write_sparse_groups(outfile, all_alns, all_genomes, *found)
+        return True
+    found = read_alignments(all_alns, all_genomes)
+    if not found:
         return False
-    write_groups(outfile, sequences)
+    write_groups(outfile, all_alns, *found)
     return True
 
 
@@ -249,61 +397,210 @@ def read_alignments(all_alns, all_genomes):
 
     Returns
     -------
-    dict or None
-        - {genome_name: [list of sequences for this genome]}
+    tuple or None
+        - (genomes, lengths, seq_genomes) with genomes the list of genomes found in the
+          alignment file, lengths the length of the alignment of each of those genomes,
+          and seq_genomes the index (in genomes) of the genome of each sequence, in the
+          order of the file
         - None if problem with a protein for which we don't find the genome
     """
-    sequences = {}  # name: [ordered list of sequences]
-    genome = None
-    seq = ""
-    with open(all_alns, 'r') as alnf:
+    genomes = {}  # genome: index in lengths and counts
+    lengths = []
+    counts = []
+    seq_genomes = array.array("L")
+    genomes_set = set(all_genomes)
+    num = None
+    with open(all_alns, 'rb') as alnf:
         for line in alnf:
-            if line.startswith(">"):
-                # If new header, write previous protein name/sequence to 'sequences'
-                if genome and seq:
-                    sequences[genome].append(seq)
-                    seq = ""
+            if line.startswith(b">"):
                 # Get new genome header
-                genome = get_genome(line, all_genomes)
+                genome = get_genome(line.decode(), all_genomes, genomes_set)
                 if not genome:
                     return None
-                if genome not in sequences:
-                    sequences[genome] = []
-            else:
-                seq += line.strip()
-    if genome and seq:
-        sequences[genome].append(seq)
-    per_genome = [len(seq) for seq in sequences.values()]
-    if len(set(per_genome)) != 1:
+                if genome not in genomes:
+                    genomes[genome] = len(lengths)
+                    lengths.append(0)
+                    counts.append(0)
+                num = genomes[genome]
+                counts[num] += 1
+                seq_genomes.append(num)
+            elif num is not None:
+                lengths[num] += len(line.strip())
+    if len(set(counts)) != 1:
         logger.error("Problems occurred while grouping alignments by genome: all genomes "
                      "do not have the same number of sequences. Check that each protein "
                      "name contains the name of the genome from which it comes.")
         return None
-    logger.log(utils.detail_lvl(), f"{per_genome[0]} sequences found per genome")
-    return sequences
+    if len(set(lengths)) != 1:
+        logger.error("Problems occurred while grouping alignments by genome: all genomes "
+                     "do not have the same alignment length.")
+        return None
+    logger.log(utils.detail_lvl(), f"{counts[0]} sequences found per genome")
+    return list(genomes), lengths, seq_genomes
 
 
-def write_groups(outfile, sequences):
+def write_groups(outfile, all_alns, genomes, lengths, seq_genomes):
     """
     Writing alignments per genome to output file.
 
+    The size of the output file is known from the length of each genome alignment. So,
+    it is directly created with its final size, and each sequence of the alignment file is
+    copied at its place in the output file, through a memory map.
+
     Parameters
     ----------
     outfile : str
         path to file that will contain alignments grouped by genome
-    sequences : dict
-        {genome_name: [list of sequences (DNA, prot...) for this genome]}
+    all_alns : str
+        path to file containing all alignments concatenated
+    genomes : list
+        list of genomes found in all_alns
+    lengths : list
+        length of the alignment of each genome
+    seq_genomes : array.array
+        index (in genomes) of the genome of each sequence of all_alns, in the order of the file
     """
     logger.log(utils.detail_lvl(), "Writing alignments per genome")
-    with open(outfile, "w") as outf:
-        for genome in sorted(sequences, key=utils.sort_genomes_by_name):
-            # write header for genome
-            outf.write(">" + genome + "\n")
-            # Write all sequences
-            outf.write("".join(sequences[genome]) + "\n")
+    # Position, in output file, where next sequence of each genome must be written
+    positions = [0] * len(genomes)
+    headers = []
+    size = 0
+    order = sorted(range(len(genomes)), key=lambda num: utils.sort_genomes_by_name(genomes[num]))
+    for num in order:
+        header = (">" + genomes[num] + "\n").encode()
+        headers.append((size, header))
+        positions[num] = size + len(header)
+        size += len(header) + lengths[num] + 1
+    with open(outfile, "w+b") as outf:
+        outf.truncate(size)
+        with mmap.mmap(outf.fileno(), size) as outm:
+            for start, header in headers:
+                outm[start:start + len(header)] = header
+            for num in order:
+                outm[positions[num] + lengths[num]:positions[num] + lengths[num] + 1] = b"\n"
+            nseq = -1
+            with open(all_alns, "rb") as alnf:
+                for line in alnf:
+                    if line.startswith(b">"):
+                        nseq += 1
+                        num = seq_genomes[nseq]
+                    elif nseq >= 0:
+                        seq = line.strip()
+                        pos = positions[num]
+                        outm[pos:pos + len(seq)] = seq
+                        positions[num] = pos + len(seq)
+            outm.flush()
+
+
+def read_families(fam_files, all_genomes):
+    """
+    Read all family alignment files, and assign each sequence to a genome. Families do not
+    contain genomes which are missing.
 
+    Parameters
+    ----------
+    fam_files : list
+        path to the alignment file of each family (or ``workspace.Member``)
+    all_genomes : []
+        list of all genomes
 
-def get_genome(header, all_genomes):
+    Returns
+    -------
+    tuple or None
+        - (fam_lengths, seq_genomes) with fam_lengths the alignment length of each family,
+          and seq_genomes the index (in all_genomes) of the genome of each sequence, in the
+          order of the files
+        - None if problem with a protein for which we don't find the genome, a genome
+          found several times in a family, or sequences of different lengths in a family
+    """
+    genomes_set = set(all_genomes)
+    genome_nums = {genome: num for num, genome in enumerate(all_genomes)}
+    fam_lengths = []
+    seq_genomes = array.array("L")
+    for fam_file in fam_files:
+        lengths = []
+        found = set()
+        with ws.open_source(fam_file) as alnf:
+            for line in alnf:
+                if line.startswith(b">"):
+                    genome = get_genome(line.decode(), all_genomes, genomes_set)
+                    if not genome:
+                        return None
+                    if genome in found:
+                        logger.error(f"Problems occurred while grouping alignments by genome: "
+                                     f"genome {genome} found several times in {ws.source_name(fam_file)}.")
+                        return None
+                    found.add(genome)
+                    seq_genomes.append(genome_nums[genome])
+                    lengths.append(0)
+                elif lengths:
+                    lengths[-1] += len(line.strip())
+        if len(set(lengths)) != 1:
+            logger.error(f"Problems occurred while grouping alignments by genome: sequences "
+                         f"of {ws.source_name(fam_file)} do not all have the same length.")
+            return None
+        fam_lengths.append(lengths[0])
+    logger.log(utils.detail_lvl(), f"{len(fam_files)} families found")
+    return fam_lengths, seq_genomes
+
+
+def write_sparse_groups(outfile, fam_files, all_genomes, fam_lengths, seq_genomes):
+    """
+    Writing alignments per genome to output file, from family alignments which do not
+    contain missing genomes. The alignment of each genome is first filled with gaps, and
+    each sequence of a family is then copied at the position of this family, through
+    a memory map.
+
+    Parameters
+    ----------
+    outfile : str
+        path to file that will contain alignments grouped by genome
+    fam_files : list
+        path to the alignment file of each family (or ``workspace.Member``)
+    all_genomes : list
+        list of all genomes
+    fam_lengths : list
+        alignment length of each family
+    seq_genomes : array.array
+        index (in all_genomes) of the genome of each sequence of the families, in the order
+        of the files
+    """
+    logger.log(utils.detail_lvl(), "Writing alignments per genome")
+    length = sum(fam_lengths)
+    starts = [0] * len(all_genomes)  # Position of the alignment of each genome in output file
+    headers = []
+    size = 0
+    for num in sorted(range(len(all_genomes)),
+                      key=lambda num: utils.sort_genomes_by_name(all_genomes[num])):
+        header = (">" + all_genomes[num] + "\n").encode()
+        headers.append((size, header))
+        starts[num] = size + len(header)
+        size += len(header) + length + 1
+    gaps = b"-" * length + b"\n"
+    with open(outfile, "w+b") as outf:
+        outf.truncate(size)
+        with mmap.mmap(outf.fileno(), size) as outm:
+            for start, header in headers:
+                end = start + len(header)
+                outm[start:end] = header
+                outm[end:end + length + 1] = gaps
+            nseq = -1
+            fam_start = 0
+            for fam_file, fam_len in zip(fam_files, fam_lengths):
+                with ws.open_source(fam_file) as alnf:
+                    for line in alnf:
+                        if line.startswith(b">"):
+                            nseq += 1
+                            pos = starts[seq_genomes[nseq]] + fam_start
+                        elif nseq >= 0:
+                            seq = line.strip()
+                            outm[pos:pos + len(seq)] = seq
+                            pos += len(seq)
+                fam_start += fam_len
+            outm.flush()
+
+
+def get_genome(header, all_genomes, genomes_set=None):
     """
     Find to which genome belongs 'header'
 
@@ -313,6 +610,9 @@ def get_genome(header, all_genomes):
         header read in alignment file
     all_genomes : []
         list of all genomes
+    genomes_set : set or None
+        set of all genomes, to find directly the genome of headers in gembase format
+        (<genome>.<contig>_<num>), or of headers which are a genome name
 
     Returns
     -------
@@ -321,9 +621,248 @@ def get_genome(header, all_genomes):
         None if no genome found
     """
     header = header.split(">")[1].split()[0]
+    if genomes_set is not None:
+        if header in genomes_set:
+            return header
+        genome = header.rsplit(".", 1)[0]
+        if genome in genomes_set:
+            return genome
     for genome in all_genomes:
         if genome in header:
             return genome
     logger.error((f"Protein {header} does not correspond to any genome name "
                   f"given... {all_genomes}"))
     return None
+
+
+def compress_sites(grp_file, variable_only=False, chunk=PATTERNS_CHUNK):
+    """
+    Compress the alignment grouped by genome into its site patterns: each distinct column
+    of the alignment is kept only once, with its weight (number of columns having this
+    pattern). Patterns are in the order of their first column in the alignment.
+
+    Columns are read by blocks, from a uint8 matrix (genomes x columns of the block) of the
+    alignment.
+
+    Output files, next to grp_file (``<name>.grp.aln``):
+
+    - ``<name>.grp.patterns.aln`` (``<name>.grp.varpatterns.aln`` if variable_only): alignment
+      of the site patterns
+    - ``<name>.grp.patterns.weights`` (``<name>.grp.varpatterns.weights``): weight of each
+      pattern, 1 per line
+
+    Parameters
+    ----------
+    grp_file : str
+        path to the alignment grouped by genome (1 line per sequence)
+    variable_only : bool
+        True to keep only variable patterns: patterns with at least 2 different characters,
+        gaps excluded
+    chunk : int
+        max number of characters of the alignment put in the matrix at the same time
+
+    Returns
+    -------
+    tuple or None
+        (output alignment, output weights) or None if the alignment could not be read
+    """
+    base = os.path.splitext(grp_file)[0] + (".varpatterns" if variable_only else ".patterns")
+    out_aln = base + ".aln"
+    out_weights = base + ".weights"
+    if (os.path.isfile(out_aln) and os.path.isfile(out_weights)
+            and os.path.getmtime(out_weights) >= os.path.getmtime(grp_file)):
+        logger.info("Site patterns already computed")
+        logger.warning(f"Site patterns already computed in {out_aln}. Program will use it. If "
+                       "you want to redo it, remove it before running.")
+        return out_aln, out_weights
+    logger.info("Compressing alignment into site patterns")
+    rows = alignment_rows(grp_file)
+    if not rows:
+        return None
+    names = [name for name, _ in rows]
+    length = rows[0][1][1]
+    nrows = len(rows)
+    weights = {}  # {pattern: weight}, in the order of first column found
+    block = max(1, chunk // nrows)
+    with open(grp_file, "rb") as grpf, mmap.mmap(grpf.fileno(), 0, access=mmap.ACCESS_READ) as grpm:
+        for start in range(0, length, block):
+            size = min(block, length - start)
+            # columns x genomes: each pattern is a contiguous row
+            matrix = np.empty((size, nrows), dtype=np.uint8)
+            for num, (_, (offset, _)) in enumerate(rows):
+                matrix[:, num] = np.frombuffer(grpm, dtype=np.uint8, count=size,
+                                               offset=offset + start)
+            cols = np.ascontiguousarray(matrix).view(np.dtype((np.void, nrows))).ravel()
+            uniq, first_cols, counts = np.unique(cols, return_index=True, return_counts=True)
+            for num in np.argsort(first_cols, kind="stable"):
+                pattern = uniq[num].tobytes()
+                weights[pattern] = weights.get(pattern, 0) + int(counts[num])
+    pats = np.frombuffer(b"".join(weights), dtype=np.uint8).reshape(len(weights), nrows)
+    counts = np.fromiter(weights.values(), dtype=np.int64, count=len(weights))
+    if variable_only:
+        gap = ord("-")
+        # First non-gap character of each pattern (gap if only gaps)
+        nogap = pats != gap
+        first = pats[np.arange(len(pats)), np.argmax(nogap, axis=1)]
+        keep = ((pats != first[:, None]) & nogap).any(axis=1)
+        pats = pats[keep]
+        counts = counts[keep]
+    with open(out_aln, "wb") as outf:
+        for num, name in enumerate(names):
+            outf.write(b">" + name.encode() + b"\n")
+            outf.write(np.ascontiguousarray(pats[:, num]).tobytes() + b"\n")
+    with open(out_weights, "w") as outw:
+        outw.write("".join(f"{weight}\n" for weight in counts.tolist()))
+    logger.info(f"{length} sites compressed into {len(pats)} "
+                f"{'variable ' if variable_only else ''}site patterns")
+    return out_aln, out_weights
+
+
+def alignment_rows(grp_file):
+    """
+    Find where the sequence of each genome is in the alignment grouped by genome
+
+    Parameters
+    ----------
+    grp_file : str
+        path to the alignment grouped by genome (1 line per sequence)
+
+    Returns
+    -------
+    list or None
+        [(genome name, (offset of its sequence in file, length))], or None if sequences
+        do not all have the same length, or are written on several lines
+    """
+    rows = []
+    offset = 0
+    with open(grp_file, "rb") as grpf:
+        name = None
+        for line in grpf:
+            if line.startswith(b">"):
+                name = line[1:].strip().decode()
+            elif name is None:
+                logger.error(f"Sequences of {grp_file} must be written on a single line.")
+                return None
+            else:
+                rows.append((name, (offset, len(line.rstrip(b"\n")))))
+                name = None
+            offset += len(line)
+    if not rows or len({length for _, (_, length) in rows}) != 1:
+        logger.error(f"Problem with {grp_file}: all sequences must have the same length.")
+        return None
+    return rows
+
+
+def write_matrix(grp_file, fam_nums, fam_files):
+    """
+    Save the alignment grouped by genome as a binary matrix, which can be memory-mapped to
+    read its rows or columns without parsing the fasta file. Output files, next to grp_file
+    (``<name>.grp.aln``):
+
+    - ``<name>.grp.npy``: uint8 matrix (genomes x sites), in numpy format
+    - ``<name>.grp.rows``: name of the genome of each row, 1 per line
+    - ``<name>.grp.partitions``: columns of each family (family number, first column,
+      column after the last one), 1 family per line, separated by tabs
+
+    Parameters
+    ----------
+    grp_file : str
+        path to the alignment grouped by genome (1 line per sequence)
+    fam_nums : list
+        family numbers, in the order of the alignment
+    fam_files : list
+        alignment file of each family (or ``workspace.Member``), to get their lengths
+
+    Returns
+    -------
+    str or None
+        path to the matrix file, or None if it could not be written
+    """
+    base = os.path.splitext(grp_file)[0]
+    out_npy = base + ".npy"
+    if os.path.isfile(out_npy) and os.path.getmtime(out_npy) >= os.path.getmtime(grp_file):
+        logger.info("Alignment matrix already written")
+        logger.warning(f"Alignment matrix already written in {out_npy}. Program will use it. "
+                       "If you want to redo it, remove it before running.")
+        return out_npy
+    logger.info(f"Writing alignment matrix to {out_npy}")
+    rows = alignment_rows(grp_file)
+    if not rows:
+        return None
+    length = rows[0][1][1]
+    fam_lengths = [family_length(fam_file) for fam_file in fam_files]
+    if sum(fam_lengths) != length:
+        logger.error(f"Problem with {grp_file}: its length ({length}) is not the sum of the "
+                     f"family alignment lengths ({sum(fam_lengths)}).")
+        return None
+    with open(base + ".rows", "w") as rowf:
+        rowf.write("".join(f"{name}\n" for name, _ in rows))
+    with open(base + ".partitions", "w") as partf:
+        start = 0
+        for num_fam, fam_len in zip(fam_nums, fam_lengths):
+            partf.write(f"{num_fam}\t{start}\t{start + fam_len}\n")
+            start += fam_len
+    # Write the matrix to a temporary file: an existing matrix file is always complete
+    tmp_npy = out_npy + ".tmp.npy"
+    matrix = np.lib.format.open_memmap(tmp_npy, mode="w+", dtype=np.uint8,
+                                       shape=(len(rows), length))
+    with open(grp_file, "rb") as grpf, mmap.mmap(grpf.fileno(), 0, access=mmap.ACCESS_READ) as grpm:
+        for num, (_, (offset, _)) in enumerate(rows):
+            matrix[num] = np.frombuffer(grpm, dtype=np.uint8, count=length, offset=offset)
+    matrix.flush()
+    del matrix
+    os.replace(tmp_npy, out_npy)
+    return out_npy
+
+
+def family_length(fam_file):
+    """
+    Get the alignment length of a family, from its first sequence
+
+    Parameters
+    ----------
+    fam_file : str or workspace.Member
+        family alignment file
+
+    Returns
+    -------
+    int
+        alignment length
+    """
+    length = 0
+    with ws.open_source(fam_file) as alnf:
+        for line in alnf:
+            if line.startswith(b">"):
+                if length:
+                    break
+            else:
+                length += len(line.strip())
+    return length
+
+
+def load_matrix(grp_file):
+    """
+    Load the binary matrix of an alignment grouped by genome (see ``write_matrix``)
+
+    Parameters
+    ----------
+    grp_file : str
+        path to the alignment grouped by genome (``<name>.grp.aln``)
+
+    Returns
+    -------
+    tuple
+        (matrix, names, partitions) with matrix the read-only memory-mapped uint8 matrix
+        (genomes x sites), names the genome of each row, and partitions the list of
+        (family number, first column, column after the last one)
+    """
+    base = os.path.splitext(grp_file)[0]
+    matrix = np.load(base + ".npy", mmap_mode="r")
+    with open(base + ".rows", "r") as rowf:
+        names = [line.rstrip("\n") for line in rowf]
+    partitions = []
+    with open(base + ".partitions", "r") as partf:
+        for line in partf:
+            num_fam, start, end = line.split("\t")
+            partitions.append((num_fam, int(start), int(end)))
+    return matrix, names, partitions
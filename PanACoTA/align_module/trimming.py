@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ###############################################################################
+# This file is part of PanACOTA.                                                #
+#                                                                               #
+# Authors: Amandine Perrin                                                      #
+# Copyright © 2018-2020 Institut Pasteur (Paris).                               #
+# See the COPYRIGHT file for details.                                           #
+#                                                                               #
+# PanACOTA is a software providing tools for large scale bacterial comparative  #
+# genomics. From a set of complete and/or draft genomes, you can:               #
+#    -  Do a quality control of your strains, to eliminate poor quality         #
+# genomes, which would not give any information for the comparative study       #
+#    -  Uniformly annotate all genomes                                          #
+#    -  Do a Pan-genome                                                         #
+#    -  Do a Core or Persistent genome                                          #
+#    -  Align all Core/Persistent families                                      #
+#    -  Infer a phylogenetic tree from the Core/Persistent families             #
+#                                                                               #
+# PanACOTA is free software: you can redistribute it and/or modify it under the #
+# terms of the Affero GNU General Public License as published by the Free       #
+# Software Foundation, either version 3 of the License, or (at your option)     #
+# any later version.                                                            #
+#                                                                               #
+# PanACOTA is distributed in the hope that it will be useful, but WITHOUT ANY   #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS     #
+# FOR A PARTICULAR PURPOSE. See the Affero GNU General Public License           #
+# for more details.                                                             #
+#                                                                               #
+# You should have received a copy of the Affero GNU General Public License      #
+# along with PanACOTA (COPYING file).                                           #
+# If not, see <https://www.gnu.org/licenses/>.                                  #
+# ###############################################################################
+
+
+"""
+Remove, from each family alignment, the codons which are gaps in too many genomes, before
+concatenating all families.
+
+For each family, the back-translated alignment is read into a numpy matrix (genomes x
+nucleotides), and a codon is removed if the fraction of genomes having a gap at this codon
+is higher than the given threshold. Genomes missing in the family count as gaps, whether they
+were added to the alignment or not (compact alignments). The corresponding columns are also
+removed from the protein alignment. Trimmed alignments are saved in
+``<dname>-trim-prt2nuc.<fam>.aln`` and ``<dname>-trim-align.<fam>.aln``.
+
+@author GEM, Institut Pasteur
+"""
+
+import os
+import sys
+import logging
+import threading
+import multiprocessing
+import progressbar
+import numpy as np
+
+from PanACoTA import utils
+from PanACoTA.align_module import workspace as ws
+
+main_logger = logging.getLogger("align.trimming")
+
+
+def trim_all_families(prefix, all_fams, ngenomes, dname, max_gaps, quiet, threads=1,
+                      workspace=False):
+    """
+    Trim all family alignments (protein and back-translated), in parallel if several
+    threads.
+
+    Parameters
+    ----------
+    prefix : str
+        path to ``aldir/<name of dataset>``
+    all_fams : []
+        list of all family numbers
+    ngenomes : int
+        total number of genomes in dataset
+    dname : str
+        name of dataset (used to name concat and grouped files, as well as tree folder)
+    max_gaps : float
+        max fraction of genomes with a gap to keep a codon
+    quiet : bool
+        True if nothing must be written in stdout/stderr, False otherwise
+    threads : int
+        max number of processes trimming families at the same time
+    workspace : bool
+        True if family alignments can be stored in the workspace (see ``workspace`` module)
+
+    Returns
+    -------
+    bool
+        True if all families were trimmed, False if there was a problem in at least 1 family
+    """
+    main_logger.info(f"Removing codons with gaps in more than {max_gaps * 100:g}% of the "
+                     "genomes in each family alignment")
+    catalog = ws.read_catalog(prefix) if workspace else {}
+    # Families trimmed with another threshold must be trimmed again
+    threshold_file = f"{prefix}-trim.threshold"
+    same_threshold = False
+    if os.path.isfile(threshold_file):
+        with open(threshold_file, "r") as thf:
+            same_threshold = thf.read().strip() == str(max_gaps)
+    utils.remove(threshold_file)
+    arguments = [(prefix, num_fam, ngenomes, max_gaps, catalog_sources(prefix, num_fam, catalog),
+                  same_threshold) for num_fam in all_fams]
+    bar = None
+    if not quiet:
+        widgets = ['Trimming: ', progressbar.Bar(marker='█', left='', right='', fill=' '),
+                   ' ', progressbar.Counter(), f"/{len(all_fams)}", ' (',
+                   progressbar.Percentage(), ') - ', progressbar.Timer()]
+        bar = progressbar.ProgressBar(widgets=widgets, max_value=len(all_fams),
+                                      term_width=79).start()
+    final = []
+    if threads == 1:
+        for args in arguments:
+            final.append(trim_family(args))
+            if not quiet:
+                bar.update(len(final))
+    else:
+        pool = multiprocessing.Pool(threads)
+        # Put logs from processes in a queue, and handle them from a single thread
+        m = multiprocessing.Manager()
+        q = m.Queue()
+        try:
+            lp = threading.Thread(target=utils.logger_thread, args=(q,))
+            lp.start()
+            chunksize = max(1, len(arguments) // (threads * 4))
+            for res in pool.imap_unordered(trim_family_queue, [args + (q,) for args in arguments],
+                                           chunksize=chunksize):
+                final.append(res)
+                if not quiet:
+                    bar.update(len(final))
+            pool.close()
+            pool.join()
+            q.put(None)
+            lp.join()
+        # If an error occurs (or user kills with keybord), terminate pool and exit
+        except Exception as excp:  # pragma: no cover
+            pool.terminate()
+            main_logger.error(excp)
+            sys.exit(1)
+    if not quiet:
+        bar.finish()
+    if False in final:
+        return False
+    with open(threshold_file, "w") as thf:
+        thf.write(f"{max_gaps}\n")
+    # Trimmed at least 1 family again: remove concatenated and grouped files
+    if set(final) != {"OK"}:
+        aldir = os.path.split(prefix)[0]
+        treedir = os.path.join(os.path.split(aldir)[0], "Phylo-" + dname)
+        for ali_type in ["nucl", "aa"]:
+            utils.remove(os.path.join(aldir, f"{dname}-complete-trim.{ali_type}.cat.aln"))
+            utils.remove(os.path.join(treedir, f"{dname}-trim.{ali_type}.grp.aln"))
+    kept = sum(res[1] for res in final if isinstance(res, tuple))
+    total = sum(res[2] for res in final if isinstance(res, tuple))
+    if total:
+        main_logger.info(f"{kept} codons kept out of {total} in trimmed families")
+    return True
+
+
+def catalog_sources(prefix, num_fam, catalog):
+    """
+    Get the family alignments stored in the workspace, if they are not in aldir
+
+    Parameters
+    ----------
+    prefix : str
+        path to ``aldir/<name of dataset>``
+    num_fam : int
+        family number
+    catalog : dict
+        {name: workspace.Member} of the workspace (empty if no workspace)
+
+    Returns
+    -------
+    tuple
+        (back-translated alignment, protein alignment): path in aldir, or workspace.Member
+    """
+    sources = []
+    for info in ["mafft-prt2nuc", "mafft-align"]:
+        source = f"{prefix}-{info}.{num_fam}.aln"
+        name = os.path.basename(source)
+        if not os.path.isfile(source) and name in catalog:
+            source = catalog[name]
+        sources.append(source)
+    return tuple(sources)
+
+
+def trim_family_queue(args):
+    """
+    Trim the given family, sending logs to the queue 'q' (see ``trim_family``)
+
+    Parameters
+    ----------
+    args : tuple
+        (prefix, num_fam, ngenomes, max_gaps, sources, same_threshold, q)
+
+    Returns
+    -------
+    bool or tuple
+        same as ``trim_family``
+    """
+    q = args[-1]
+    qh = logging.handlers.QueueHandler(q)
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.handlers = []
+    logging.addLevelName(utils.detail_lvl(), "DETAIL")
+    root.addHandler(qh)
+    return trim_family(args[:-1])
+
+
+def trim_family(args):
+    """
+    Remove codons with too many gaps from the back-translated and protein alignments of
+    the given family.
+
+    Parameters
+    ----------
+    args : tuple
+        (prefix, num_fam, ngenomes, max_gaps, sources, same_threshold) with:
+
+        - prefix: path to ``aldir/<name of dataset>``
+        - num_fam: family number
+        - ngenomes: total number of genomes in dataset
+        - max_gaps: max fraction of genomes with a gap to keep a codon
+        - sources: (back-translated alignment, protein alignment), paths or workspace.Member
+        - same_threshold: False if existing trimmed alignments were done with another max_gaps
+
+    Returns
+    -------
+    bool or tuple
+        - "OK" if trimmed alignments already exist and are more recent than the alignments
+        - (True, number of codons kept, number of codons) if family just trimmed
+        - False if problem with the alignments
+    """
+    prefix, num_fam, ngenomes, max_gaps, (btr_src, prt_src), same_threshold = args
+    logger = logging.getLogger("align.trimming.family")
+    trim_btr = f"{prefix}-trim-prt2nuc.{num_fam}.aln"
+    trim_prt = f"{prefix}-trim-align.{num_fam}.aln"
+    # Alignments stored in the workspace are compared with their mtime when they were stored
+    src_mtimes = [ws.source_mtime(src) for src in (btr_src, prt_src)]
+    if (same_threshold and all(os.path.isfile(f) for f in [trim_btr, trim_prt])
+            and None not in src_mtimes
+            and min(os.stat(trim_btr).st_mtime_ns, os.stat(trim_prt).st_mtime_ns)
+            >= max(src_mtimes)):
+        return "OK"
+    try:
+        headers, btr = read_matrix(btr_src)
+        prt_headers, prt = read_matrix(prt_src)
+    except (OSError, ValueError) as err:
+        logger.error(f"fam {num_fam}: could not read alignments to trim: {err}")
+        return False
+    # Missing genomes are added to both alignments, or to none of them with compact
+    # alignments, but alignments from older runs may only have them in the back-translated
+    # one: rows are trimmed independently, so only check that there is 1 amino acid per codon
+    if btr.shape[1] != 3 * prt.shape[1]:
+        logger.error(f"fam {num_fam}: protein alignment {ws.source_name(prt_src)} does not "
+                     f"correspond to back-translated alignment {ws.source_name(btr_src)}.")
+        return False
+    keep = codons_to_keep(btr, ngenomes, max_gaps)
+    write_matrix(trim_btr, headers, btr[:, np.repeat(keep, 3)])
+    write_matrix(trim_prt, prt_headers, prt[:, keep])
+    logger.log(utils.detail_lvl(), f"fam {num_fam}: {int(keep.sum())} codons kept out of "
+                                   f"{len(keep)}")
+    return True, int(keep.sum()), len(keep)
+
+
+def codons_to_keep(btr, ngenomes, max_gaps):
+    """
+    Find the codons which are gaps in at most max_gaps of the genomes
+
+    Parameters
+    ----------
+    btr : numpy.ndarray
+        back-translated alignment (uint8 matrix, 1 row per sequence)
+    ngenomes : int
+        total number of genomes in dataset. Genomes not in the alignment are counted as gaps
+    max_gaps : float
+        max fraction of genomes with a gap to keep a codon
+
+    Returns
+    -------
+    numpy.ndarray
+        boolean for each codon, True if it must be kept
+    """
+    nseqs, length = btr.shape
+    gaps = (btr == ord("-")).reshape(nseqs, length // 3, 3).all(axis=2)
+    nb_gaps = gaps.sum(axis=0) + max(0, ngenomes - nseqs)
+    return nb_gaps <= max_gaps * ngenomes
+
+
+def read_matrix(source):
+    """
+    Read an alignment into a matrix
+
+    Parameters
+    ----------
+    source : str or workspace.Member
+        alignment file, in aldir or in the workspace
+
+    Returns
+    -------
+    tuple
+        (headers, matrix) with headers the list of header lines (without '>'), and matrix
+        the uint8 numpy matrix of the sequences (1 row per sequence)
+
+    Raises
+    ------
+    ValueError
+        if sequences do not all have the same length
+    """
+    headers = []
+    seqs = []
+    with ws.open_source(source) as alnf:
+        for line in alnf:
+            if line.startswith(b">"):
+                headers.append(line[1:].rstrip(b"\n"))
+                seqs.append([])
+            elif seqs:
+                seqs[-1].append(line.strip())
+    seqs = [b"".join(seq) for seq in seqs]
+    if len({len(seq) for seq in seqs}) > 1:
+        raise ValueError(f"sequences of {ws.source_name(source)} do not all have the same length")
+    length = len(seqs[0]) if seqs else 0
+    matrix = np.frombuffer(b"".join(seqs), dtype=np.uint8).reshape(len(seqs), length)
+    return headers, matrix
+
+
+def write_matrix(outfile, headers, matrix):
+    """
+    Write an alignment from its matrix, 60 characters per line
+
+    Parameters
+    ----------
+    outfile : str
+        path to the alignment file to write
+    headers : list
+        header lines (without '>'), as bytes
+    matrix : numpy.ndarray
+        uint8 matrix of the sequences (1 row per sequence)
+    """
+    with open(outfile, "wb") as outf:
+        for header, row in zip(headers, matrix):
+            seq = row.tobytes()
+            outf.write(b">" + header + b"\n")
+            outf.write(b"".join(seq[i:i + 60] + b"\n" for i in range(0, len(seq), 60)))
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ###############################################################################
+# This file is part of PanACOTA.                                                #
+#                                                                               #
+# Authors: Amandine Perrin                                                      #
+# Copyright © 2018-2020 Institut Pasteur (Paris).                               #
+# See the COPYRIGHT file for details.                                           #
+#                                                                               #
+# PanACOTA is a software providing tools for large scale bacterial comparative  #
+# genomics. From a set of complete and/or draft genomes, you can:               #
+#    -  Do a quality control of your strains, to eliminate poor quality         #
+# genomes, which would not give any information for the comparative study       #
+#    -  Uniformly annotate all genomes                                          #
+#    -  Do a Pan-genome                                                         #
+#    -  Do a Core or Persistent genome                                          #
+#    -  Align all Core/Persistent families                                      #
+#    -  Infer a phylogenetic tree from the Core/Persistent families             #
+#                                                                               #
+# PanACOTA is free software: you can redistribute it and/or modify it under the #
+# terms of the Affero GNU General Public License as published by the Free       #
+# Software Foundation, either version 3 of the License, or (at your option)     #
+# any later version.                                                            #
+#                                                                               #
+# PanACOTA is distributed in the hope that it will be useful, but WITHOUT ANY   #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS     #
+# FOR A PARTICULAR PURPOSE. See the Affero GNU General Public License           #
+# for more details.                                                             #
+#                                                                               #
+# You should have received a copy of the Affero GNU General Public License      #
+# along with PanACOTA (COPYING file).                                           #
+# If not, see <https://www.gnu.org/licenses/>.                                  #
+# ###############################################################################
+
+
+"""
+Alignment workspace: instead of keeping, for each family, its extraction files (prt, gen,
+list of missing genomes), its alignment files and their logs in ``Align-<dname>``, store
+them in a single container file ``<dname>-workspace.pack``. Files are only appended to this
+container. Its catalog ``<dname>-workspace.cat`` gives, for each file stored, its position
+in the container, the alignment mode in which it was written, and its modification time
+when it was stored (1 line per file: ``name<TAB>offset<TAB>size<TAB>mode<TAB>mtime``, mode
+being ``compact`` or ``full``, mtime in ns). If a file is stored several times (family
+aligned again), the last entry is used.
+
+Each family is stored as soon as its alignments are finished, so a family found in the
+workspace with the mode of the current run does not need to be checked or aligned again.
+A family stored with another mode is extracted and aligned again.
+
+@author GEM, Institut Pasteur
+"""
+
+import os
+import io
+import logging
+import collections
+import progressbar
+
+from PanACoTA import utils
+
+logger = logging.getLogger("align.workspace")
+
+# A file stored in the workspace
+Member = collections.namedtuple("Member", ["pack", "name", "offset", "size", "mode", "mtime"])
+
+# Files of a family which are stored in the workspace once its alignment is finished
+FAMILY_FILES = ["current.{}.prt", "current.{}.gen", "current.{}.miss.lst",
+                "mafft-align.{}.aln", "mafft-align.{}.aln.log", "mafft-prt2nuc.{}.aln"]
+
+
+def workspace_files(prefix):
+    """
+    Get the container and catalog files of the workspace
+
+    Parameters
+    ----------
+    prefix : str
+        path to ``aldir/<name of dataset>``
+
+    Returns
+    -------
+    tuple
+        (container, catalog) paths
+    """
+    return prefix + "-workspace.pack", prefix + "-workspace.cat"
+
+
+def family_files(prefix, num_fam):
+    """
+    Get the path to all files of a family which are stored in the workspace
+
+    Parameters
+    ----------
+    prefix : str
+        path to ``aldir/<name of dataset>``
+    num_fam : int
+        family number
+
+    Returns
+    -------
+    list
+        path to each file of the family (in aldir)
+    """
+    return [f"{prefix}-{name.format(num_fam)}" for name in FAMILY_FILES]
+
+
+def align_mode(compact):
+    """
+    Get the alignment mode recorded in the catalog for the files of a family
+
+    Parameters
+    ----------
+    compact : bool
+        True if family alignments do not contain missing genomes
+
+    Returns
+    -------
+    str
+        "compact" or "full"
+    """
+    return "compact" if compact else "full"
+
+
+def read_catalog(prefix):
+    """
+    Read the catalog of the workspace
+
+    Parameters
+    ----------
+    prefix : str
+        path to ``aldir/<name of dataset>``
+
+    Returns
+    -------
+    dict
+        {name: Member} for each file stored in the workspace (name is the basename of the
+        file in aldir). Empty if there is no workspace yet.
+    """
+    pack, catalog = workspace_files(prefix)
+    members = {}
+    if not os.path.isfile(catalog):
+        return members
+    with open(catalog, "r") as catf:
+        for line in catf:
+            fields = line.rstrip("\n").split("\t")
+            # Incomplete line, if a previous run was killed while writing it
+            if len(fields) != 5 or not line.endswith("\n"):
+                continue
+            name, offset, size, mode, mtime = fields
+            members[name] = Member(pack, name, int(offset), int(size), mode, int(mtime))
+    return members
+
+
+def family_stored(catalog, prefix, num_fam, mode="full"):
+    """
+    Check if all files of the given family are stored in the workspace, in the given mode
+
+    Parameters
+    ----------
+    catalog : dict
+        {name: Member}, as returned by ``read_catalog``
+    prefix : str
+        path to ``aldir/<name of dataset>``
+    num_fam : int
+        family number
+    mode : str
+        alignment mode of the current run (see ``align_mode``)
+
+    Returns
+    -------
+    bool
+        True if the family prt, gen and alignment files are stored in the workspace, with
+        the given mode
+    """
+    names = [os.path.basename(f) for f in family_files(prefix, num_fam)]
+    # Log and list of missing genomes are not needed to use the family alignments
+    return all(name in catalog and catalog[name].mode == mode
+               for name in names[:2] + [names[3], names[5]])
+
+
+def stored_families(prefix, all_fams, mode="full"):
+    """
+    Get the families already stored in the workspace with the given mode
+
+    Parameters
+    ----------
+    prefix : str
+        path to ``aldir/<name of dataset>``
+    all_fams : iterable
+        family numbers
+    mode : str
+        alignment mode of the current run (see ``align_mode``)
+
+    Returns
+    -------
+    set
+        numbers of families stored in the workspace
+    """
+    catalog = read_catalog(prefix)
+    return {num_fam for num_fam in all_fams if family_stored(catalog, prefix, num_fam, mode)}
+
+
+def store(prefix, files, mode="full"):
+    """
+    Append the given files to the workspace, and remove them from aldir. Files which do not
+    exist are ignored.
+
+    Parameters
+    ----------
+    prefix : str
+        path to ``aldir/<name of dataset>``
+    files : list
+        path to the files to store
+    mode : str
+        alignment mode in which the files were written (see ``align_mode``)
+
+    Returns
+    -------
+    int
+        number of files stored
+    """
+    pack, catalog = workspace_files(prefix)
+    nb_stored = 0
+    with open(pack, "ab") as packf, open(catalog, "a") as catf:
+        for file in files:
+            if not os.path.isfile(file):
+                continue
+            offset = packf.tell()
+            mtime = os.stat(file).st_mtime_ns
+            with open(file, "rb") as inf:
+                utils.copy_file(inf, packf)
+            size = packf.tell() - offset
+            # Container must contain the file before the catalog refers to it, and the file
+            # can only be removed once it is in the catalog
+            packf.flush()
+            catf.write(f"{os.path.basename(file)}\t{offset}\t{size}\t{mode}\t{mtime}\n")
+            catf.flush()
+            os.remove(file)
+            nb_stored += 1
+    return nb_stored
+
+
+def open_source(source):
+    """
+    Open a file to read, which is either in aldir or in the workspace
+
+    Parameters
+    ----------
+    source : str or Member
+        path to the file, or file stored in the workspace
+
+    Returns
+    -------
+    _io.BufferedReader or _io.BytesIO
+        file open to read bytes
+    """
+    if not isinstance(source, Member):
+        return open(source, "rb")
+    with open(source.pack, "rb") as packf:
+        packf.seek(source.offset)
+        return io.BytesIO(packf.read(source.size))
+
+
+def source_mtime(source):
+    """
+    Get the modification time of a file which is either in aldir or in the workspace. For a
+    file in the workspace, it is its modification time when it was stored (not the one of
+    the container, which changes each time a family is stored).
+
+    Parameters
+    ----------
+    source : str or Member
+        path to the file, or file stored in the workspace
+
+    Returns
+    -------
+    int or None
+        modification time in ns, or None if the file does not exist
+    """
+    if isinstance(source, Member):
+        return source.mtime
+    if not os.path.isfile(source):
+        return None
+    return os.stat(source).st_mtime_ns
+
+
+def source_name(source):
+    """
+    Get the name of a file which is either in aldir or in the workspace, for messages
+
+    Parameters
+    ----------
+    source : str or Member
+        path to the file, or file stored in the workspace
+
+    Returns
+    -------
+    str
+        path to the file, or ``<container>:<name>`` for a file in the workspace
+    """
+    if isinstance(source, Member):
+        return f"{source.pack}:{source.name}"
+    return source
+
+
+def cat(sources, output, title=None):
+    """
+    Concatenate files which are in aldir or in the workspace (see ``utils.cat``)
+
+    Parameters
+    ----------
+    sources : list
+        list of paths or of files stored in the workspace
+    output : str
+        output filename, where all concatenated files will be written
+    title : str or None
+        title of the progressbar shown while concatenating files. If no title, nothing
+        will be shown during concatenation.
+    """
+    bar = None
+    if title:
+        widgets = [title + ': ', progressbar.Bar(marker='█', left='', right='', fill=' '),
+                   ' ', progressbar.Counter(), f"/{len(sources)}" ' (',
+                   progressbar.Percentage(), ") - ", progressbar.Timer()]
+        bar = progressbar.ProgressBar(widgets=widgets, max_value=len(sources),
+                                      term_width=79).start()
+    with open(output, "wb") as outf:
+        for curnum, source in enumerate(sources, start=1):
+            if bar:
+                bar.update(curnum)
+            if isinstance(source, Member):
+                with open(source.pack, "rb") as packf:
+                    utils.copy_file(packf, outf, source.offset, source.size)
+            else:
+                with open(source, "rb") as inf:
+                    utils.copy_file(inf, outf)
+    if bar:
+        bar.finish()
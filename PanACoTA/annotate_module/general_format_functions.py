@@ -76,6 +76,8 @@ def format_genomes(genomes_ok, res_path, annot_path, prodigal_only, threads=1, q
     * Proteins: containing 1 multi-fasta per genome, with all its proteins in aa
     * gff: containing all gff files
 
+    Proteins and Genes files are indexed (``<file>.idx``, see ``utils.index_fasta``).
+
     Parameters
     ----------
     genomes_ok : dict
@@ -209,6 +211,10 @@ def handle_genome(args):
     # Handle genome
     ok_format = format_one_genome(gpath, name, annot_path, lst_dir,
                                   prot_dir, gene_dir, rep_dir, gff_dir)
+    # Index proteins and genes, so that 'align' can directly read the sequences it needs
+    if ok_format:
+        utils.index_fasta(os.path.join(prot_dir, name + ".prt"))
+        utils.index_fasta(os.path.join(gene_dir, name + ".gen"))
     return ok_format, genome
 
 
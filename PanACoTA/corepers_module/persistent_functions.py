@@ -41,6 +41,7 @@ April 2017
 """
 import logging
 import math
+import numpy as np
 
 from PanACoTA import utils
 from PanACoTA import utils_pangenome as utilsp
@@ -162,29 +163,114 @@ def get_pers(fam_by_strain, fam_all_members, nb_strains, tol=1, multi=False, mix
             if len(family) >= min_members and (multi or uniq_members(family)):
                 pers[fam_num] = family
                 fams[fam_num] = fam_all_members[fam_num]
+    log_pers(len(pers), min_members, nb_strains, tol, multi, mixed)
+    return fams
+
+
+def get_pers_model(model, tol=1, multi=False, mixed=False, floor=False, list_genomes=None):
+    """
+    Same as ``get_pers``, but from the compact model of the pangenome (see
+    ``utils_pangenome.build_pan_model``), without building a dict for each family.
+
+    Parameters
+    ----------
+    model : dict
+        {field: numpy array} compact model of the pangenome
+    tol : float
+        min percentage of different genomes present in a family
+    multi : bool
+        True if multiple genes from the same genome/strain in a family are tolerated
+    mixed : bool
+        True if mixed families are allowed
+    floor : bool
+        Use floor(nb_strains*tol) genomes as minimum number of genomes if True,
+        ceil(nb_strains*tol) if False.
+    list_genomes : list or None
+        If given, only consider members from those genomes (see ``get_subset_genomes``)
+
+    Returns
+    -------
+    dict
+        {fam_num: [list of members]} for persistent families
+    """
+    genomes = utilsp.array_to_names(model["genomes"])
+    if list_genomes is None:
+        nb_strains = len(genomes)
+        genome_mask = None
+    else:
+        nb_strains = len(list_genomes)
+        genome_mask = np.isin(genomes, list_genomes)
+    logger.info("Generating Persistent genome of a dataset "
+                f"containing {nb_strains} genomes")
+    if floor:
+        min_members = math.floor(tol * nb_strains)
+    else:
+        min_members = math.ceil(tol * nb_strains)
+    nfams = len(model["fam_names"])
+    fams, _, counts = utilsp.family_genome_counts(model, genome_mask)
+    nb_genomes = np.bincount(fams, minlength=nfams)
+    nb_mono = np.bincount(fams[counts == 1], minlength=nfams)
+    if mixed:
+        keep = (nb_genomes > 0) & (nb_mono >= min_members)
+    else:
+        keep = (nb_genomes > 0) & (nb_genomes >= min_members)
+        if not multi:
+            keep &= nb_mono == nb_genomes
+    log_pers(int(keep.sum()), min_members, nb_strains, tol, multi, mixed)
+    # Only decode names of persistent families
+    offsets = model["fam_offsets"]
+    fam_names = model["fam_names"]
+    pers = {}
+    for num in np.flatnonzero(keep).tolist():
+        start, end = offsets[num], offsets[num + 1]
+        members = model["members"][start:end]
+        if genome_mask is not None:
+            members = members[genome_mask[model["member_genome"][start:end]]]
+        pers[fam_names[num].decode()] = utilsp.array_to_names(members)
+    return pers
+
+
+def log_pers(nb_pers, min_members, nb_strains, tol, multi, mixed):
+    """
+    Give information on the persistent genome generated to logger
+
+    Parameters
+    ----------
+    nb_pers : int
+        number of persistent families
+    min_members : int
+        minimum number of genomes required in a persistent family
+    nb_strains : int
+        total number of strains/genomes in dataset
+    tol : float
+        min percentage of different genomes present in a family
+    multi : bool
+        True if multigenic families are allowed
+    mixed : bool
+        True if mixed families are allowed
+    """
     # coregenome computed
     if tol == 1 and not multi and not mixed:
-        logger.info(f"The core genome contains {len(pers)} families, each one having "
+        logger.info(f"The core genome contains {nb_pers} families, each one having "
                     f"exactly {int(min_members)} members, from the {nb_strains} different genomes.")
     # multi persistent genome with multigenic families allowed
     elif multi:
-        logger.info(f"The persistent genome contains {len(pers)} families with members present "
+        logger.info(f"The persistent genome contains {nb_pers} families with members present "
                     f"in at least {min_members} different genomes ({tol*100}% of the total number of "
                     "genomes).")
     # mixed persistent genome, tol% families with exactly 1 member from each genome,
     # multigenic families allowed for the '1-tol'% remaining families
     elif mixed:
-        logger.info(f"The persistent genome contains {len(pers)} families, "
+        logger.info(f"The persistent genome contains {nb_pers} families, "
                     f"each one having exactly 1 member from at least {tol*100}% of the genomes ({min_members} "
                     f"genomes). In the remaining {round((1-tol)*100,3)}% genomes, there can be 0, 1 or "
                     "several members.")
     # Strict persistent genome. tol% families with exactly one member in each genome
     else:
-        logger.info(f"The persistent genome contains {len(pers)} families, each one having "
+        logger.info(f"The persistent genome contains {nb_pers} families, each one having "
                     f"exactly 1 member from at least {tol*100}% of the {nb_strains} "
                     f"different genomes (that is {min_members} genomes). The other genomes are absent from "
                     "the family.")
-    return fams
 
 
 def mixed_family(family, thres):
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# ###############################################################################
+# This file is part of PanACOTA.                                                #
+#                                                                               #
+# Authors: Amandine Perrin                                                      #
+# Copyright © 2018-2020 Institut Pasteur (Paris).                               #
+# See the COPYRIGHT file for details.                                           #
+#                                                                               #
+# PanACOTA is a software providing tools for large scale bacterial comparative  #
+# genomics. From a set of complete and/or draft genomes, you can:               #
+#    -  Do a quality control of your strains, to eliminate poor quality         #
+# genomes, which would not give any information for the comparative study       #
+#    -  Uniformly annotate all genomes                                          #
+#    -  Do a Pan-genome                                                         #
+#    -  Do a Core or Persistent genome                                          #
+#    -  Align all Core/Persistent families                                      #
+#    -  Infer a phylogenetic tree from the Core/Persistent families             #
+#                                                                               #
+# PanACOTA is free software: you can redistribute it and/or modify it under the #
+# terms of the Affero GNU General Public License as published by the Free       #
+# Software Foundation, either version 3 of the License, or (at your option)     #
+# any later version.                                                            #
+#                                                                               #
+# PanACOTA is distributed in the hope that it will be useful, but WITHOUT ANY   #
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS     #
+# FOR A PARTICULAR PURPOSE. See the Affero GNU General Public License           #
+# for more details.                                                             #
+#                                                                               #
+# You should have received a copy of the Affero GNU General Public License      #
+# along with PanACOTA (COPYING file).                                           #
+# If not, see <https://www.gnu.org/licenses/>.                                  #
+# ###############################################################################
+
+"""
+Functions to assign the proteins of new genomes to the families of an existing pangenome,
+without clustering again.
+
+Proteins are searched against a database of 1 representative per family (the
+representatives of the mmseqs clusters from which the pangenome was built). This database
+is written once, with the family of each representative, and reused for all next genomes
+while the pangenome and its mmseqs clustering do not change.
+
+Output, for each new genome, in ``<outdir>/Assign-<dataset_name>``:
+
+- ``<genome>.assign.tsv``: 1 line per assigned protein, with the protein name, its family
+  number, the representative found and the sequence identity with it
+- ``<genome>.unassigned.lst``: names of proteins which do not belong to any family
+
+@author gem
+"""
+import logging
+import os
+import glob
+
+from PanACoTA import utils
+from PanACoTA import utils_pangenome as utils_pan
+from PanACoTA.pangenome_module import mmseqs_functions as mmf
+
+logger = logging.getLogger("pangenome.assign")
+
+# Minimum coverage of the alignments between a protein and a representative (as the default
+# coverage of 'mmseqs cluster', used to build the families)
+MIN_COVERAGE = 0.8
+
+
+def run_assign(assign, lstinfo, dbpath, min_id, outdir, name, threads):
+    """
+    Assign all proteins of the genomes in lstinfo to the families of an existing pangenome:
+
+    - write (or reuse) the mmseqs database of the representatives of all families
+    - write the mmseqs database of proteins of new genomes, directly from their protein files
+    - search those proteins against the representatives
+    - write the family of each protein, and the proteins without family, for each genome
+
+    Parameters
+    ----------
+    assign : tuple
+        (pangenome, mmseqs_db, clust_db): existing pangenome file, and the mmseqs database and
+        clustering from which it was created
+    lstinfo : str
+        file with name of new genomes in the first column
+    dbpath : str
+        path to the folder containing the protein files of new genomes
+    min_id : float
+        minimum percentage of identity with a representative to be assigned to its family
+    outdir : str
+        directory where output files must be saved
+    name : str
+        name of the dataset of new genomes
+    threads : int
+        number of threads which can be used by mmseqs search
+
+    Returns
+    -------
+    str
+        directory containing assignments of all genomes
+    """
+    pangenome, old_db, old_clust = assign
+    logger.info(f"Will assign proteins to the families of {pangenome} with MMseqs2 search:\n"
+                f"\t- minimum sequence identity = {min_id*100}%\n"
+                f"\t- minimum coverage = {MIN_COVERAGE*100}%")
+    tmpdir = os.path.join(outdir, "tmp_assign_" + os.path.basename(pangenome))
+    os.makedirs(tmpdir, exist_ok=True)
+    logmmseq = os.path.join(outdir, "mmseq_assign_" + name + ".log")
+    repdb = os.path.join(tmpdir, os.path.basename(pangenome) + "-repDB")
+    stamp = rep_db_stamp(pangenome, old_clust)
+    if read_rep_stamp(repdb + ".fams") == stamp:
+        logger.info(f"Using existing database of family representatives {repdb}")
+    else:
+        # Pangenome or clustering changed since the database was written: write it again
+        for file in glob.glob(repdb + "*"):
+            utils.remove(file)
+        build_rep_db(pangenome, old_db, old_clust, repdb, logmmseq, stamp)
+    genomes = utils_pan.read_lstinfo(lstinfo, logger)
+    prt_files = [os.path.join(dbpath, gen + ".prt") for gen in genomes]
+    querydb = os.path.join(tmpdir, name + "-msDB")
+    resdb = os.path.join(tmpdir, name + "-search")
+    # New genomes may have changed: always search again
+    for file in glob.glob(querydb + "*") + glob.glob(resdb + "*"):
+        utils.remove(file)
+    mmf.write_mmseqs_db(querydb, prt_files, threads)
+    logger.info(f"Searching proteins of {len(genomes)} genomes against family representatives")
+    run_mmseqs_search(querydb, repdb, resdb, os.path.join(tmpdir, "tmp"), logmmseq, min_id,
+                      threads)
+    assigndir = os.path.join(outdir, "Assign-" + name)
+    os.makedirs(assigndir, exist_ok=True)
+    write_assignments(querydb + ".lookup", resdb + ".tsv", read_rep_families(repdb + ".fams"),
+                      genomes, assigndir)
+    return assigndir
+
+
+def rep_db_stamp(pangenome, old_clust):
+    """
+    Get the size and modification time of the pangenome and of its mmseqs clustering, saved
+    with the family of each representative to know if the database of representatives is
+    up to date
+
+    Parameters
+    ----------
+    pangenome : str
+        existing pangenome file
+    old_clust : str
+        mmseqs clustering from which the pangenome was created
+
+    Returns
+    -------
+    list
+        [pangenome size, pangenome mtime_ns, clustering index size, clustering index mtime_ns]
+    """
+    return (utils_pan.source_stamp(pangenome).tolist()
+            + utils_pan.source_stamp(old_clust + ".index").tolist())
+
+
+def read_rep_stamp(repfams):
+    """
+    Read the stamp saved in the first line of the file with the family of each
+    representative (see ``rep_db_stamp``)
+
+    Parameters
+    ----------
+    repfams : str
+        file with the family of each representative
+
+    Returns
+    -------
+    list or None
+        stamp saved, None if there is no file or no stamp
+    """
+    if not os.path.isfile(repfams):
+        return None
+    with open(repfams, "r") as repf:
+        line = repf.readline()
+    if not line.startswith("#"):
+        return None
+    return [int(val) for val in line[1:].split()]
+
+
+def build_rep_db(pangenome, old_db, old_clust, repdb, logmmseq, stamp=None):
+    """
+    Write the mmseqs database of the representatives of all clusters, and the family of each
+    representative (``<repdb>.fams``, written last: when it exists, the database is complete)
+
+    Parameters
+    ----------
+    pangenome : str
+        existing pangenome file
+    old_db : str
+        mmseqs database from which the pangenome was created
+    old_clust : str
+        mmseqs clustering from which the pangenome was created
+    repdb : str
+        path to base filename of the database of representatives
+    logmmseq : str
+        path to file where logs must be written
+    stamp : list or None
+        stamp of the pangenome and clustering (see ``rep_db_stamp``). None to compute it.
+    """
+    logger.info(f"Writing database of family representatives {repdb}")
+    if stamp is None:
+        stamp = rep_db_stamp(pangenome, old_clust)
+    mmf.run_mmseqs_createsubdb(old_clust, old_db, repdb, logmmseq)
+    if not os.path.isfile(old_clust + ".tsv"):
+        mmf.run_mmseqs_createtsv(old_db, old_clust, logmmseq)
+    write_rep_families(pangenome, old_clust + ".tsv", repdb + ".fams", stamp)
+
+
+def write_rep_families(pangenome, tsvfile, repfams, stamp=None):
+    """
+    Write the family number of the representative of each mmseqs cluster
+
+    Parameters
+    ----------
+    pangenome : str
+        pangenome file built from the clusters
+    tsvfile : str
+        clusters in tsv format (output of mmseqs createtsv)
+    repfams : str
+        output file, with 1 line per representative: its name and its family number,
+        separated by a tab
+    stamp : list or None
+        stamp of the pangenome and clustering (see ``rep_db_stamp``), written in the first
+        line (``#<values>``). None to compute it.
+    """
+    if stamp is None:
+        stamp = rep_db_stamp(pangenome, os.path.splitext(tsvfile)[0])
+    model = utils_pan.open_pan_model(pangenome, logger)
+    fam_names = utils_pan.array_to_names(model["fam_names"])
+    fam_sizes = model["fam_offsets"][1:] - model["fam_offsets"][:-1]
+    fam_of = {}
+    members = iter(utils_pan.array_to_names(model["members"]))
+    for fam_num, size in zip(fam_names, fam_sizes.tolist()):
+        for _ in range(size):
+            fam_of[next(members)] = fam_num
+    missing = 0
+    with open(repfams + ".tmp", "w") as repf:
+        repf.write("#" + " ".join(str(val) for val in stamp) + "\n")
+        for clust in mmf.read_tsv_clusters(tsvfile):
+            if clust[0] in fam_of:
+                repf.write(f"{clust[0]}\t{fam_of[clust[0]]}\n")
+            else:
+                missing += 1
+    if missing:
+        logger.warning(f"{missing} cluster representatives are not in {pangenome}: the "
+                       "proteins they represent will not be assigned.")
+    os.replace(repfams + ".tmp", repfams)
+
+
+def read_rep_families(repfams):
+    """
+    Read the family of each representative (see ``write_rep_families``)
+
+    Parameters
+    ----------
+    repfams : str
+        file with the family of each representative
+
+    Returns
+    -------
+    dict
+        {representative: fam_num}
+    """
+    rep_fams = {}
+    with open(repfams, "r") as repf:
+        for line in repf:
+            if line.startswith("#"):
+                continue
+            rep, fam_num = line.split()
+            rep_fams[rep] = fam_num
+    return rep_fams
+
+
+def run_mmseqs_search(querydb, repdb, resdb, tmpdir, logmmseq, min_id, threads):
+    """
+    Search proteins of querydb against representatives, and convert the hits to a tsv file
+    (``<resdb>.tsv``: query, representative, sequence identity). Hits of each query are
+    sorted from the best one.
+
+    Parameters
+    ----------
+    querydb : str
+        mmseqs database of proteins to assign
+    repdb : str
+        mmseqs database of family representatives
+    resdb : str
+        path to base filename for search output
+    tmpdir : str
+        folder which will contain mmseqs temporary files
+    logmmseq : str
+        path to file where logs must be written
+    min_id : float
+        minimum percentage of identity of a hit
+    threads : int
+        max number of threads to use
+    """
+    cmds = [(f"mmseqs search {querydb} {repdb} {resdb} {tmpdir} --min-seq-id {min_id} "
+             f"-c {MIN_COVERAGE} --threads {threads}",
+             f"Problem while searching proteins against family representatives. "
+             f"See log in {logmmseq}"),
+            (f"mmseqs convertalis {querydb} {repdb} {resdb} {resdb}.tsv "
+             "--format-output query,target,fident",
+             "Problem while trying to convert mmseqs search result to tsv file")]
+    for cmd, msg in cmds:
+        logger.details(f"MMseqs command: {cmd}")
+        with open(logmmseq, "a") as logm:
+            utils.run_cmd(cmd, msg, eof=True, stdout=logm, stderr=logm)
+
+
+def write_assignments(lookup, restsv, rep_fams, genomes, assigndir):
+    """
+    Write the family of each protein of each genome, and the proteins without family
+
+    Parameters
+    ----------
+    lookup : str
+        lookup file of the database of proteins to assign (key, protein name, number of the
+        genome in genomes)
+    restsv : str
+        hits of proteins against representatives, best hit first for each protein
+    rep_fams : dict
+        {representative: fam_num}
+    genomes : list
+        genome names, in the order of protein files used to write the database
+    assigndir : str
+        directory where output files are written
+
+    Returns
+    -------
+    (nb_assigned, nb_unassigned) : tuple
+        number of proteins assigned to a family, and number of proteins without family
+    """
+    best = {}  # {protein: (representative, identity)}
+    with open(restsv, "r") as resf:
+        for line in resf:
+            query, target, ident = line.split()[:3]
+            if query not in best and target in rep_fams:
+                best[query] = (target, ident)
+    nb_assigned = 0
+    nb_unassigned = 0
+    current = None
+    assf = unasf = None
+    try:
+        with open(lookup, "r") as lookf:
+            for line in lookf:
+                _, prot, num = line.split()
+                if num != current:
+                    for outf in (assf, unasf):
+                        if outf:
+                            outf.close()
+                    current = num
+                    genome = genomes[int(num)]
+                    assf = open(os.path.join(assigndir, genome + ".assign.tsv"), "w")
+                    unasf = open(os.path.join(assigndir, genome + ".unassigned.lst"), "w")
+                if prot in best:
+                    rep, ident = best[prot]
+                    assf.write(f"{prot}\t{rep_fams[rep]}\t{rep}\t{ident}\n")
+                    nb_assigned += 1
+                else:
+                    unasf.write(prot + "\n")
+                    nb_unassigned += 1
+    finally:
+        for outf in (assf, unasf):
+            if outf:
+                outf.close()
+    logger.info(f"{nb_assigned} proteins assigned to a family, {nb_unassigned} proteins "
+                f"without family. Assignments written in {assigndir}")
+    return nb_assigned, nb_unassigned
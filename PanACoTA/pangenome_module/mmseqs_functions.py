@@ -42,21 +42,31 @@ April 2017
 import logging
 import os
 import sys
+import glob
 import time
 import threading
 import progressbar
 import copy
+import struct
+import multiprocessing
 
 from PanACoTA import utils
 from PanACoTA import utils_pangenome as utils_pan
+from PanACoTA.pangenome_module import protein_seq_functions as protf
 
 logger = logging.getLogger("pangenome.mmseqs")
 
+# mmseqs database types, written in .dbtype files
+MMSEQS_DBTYPE_AA = 0
+MMSEQS_DBTYPE_GENERIC = 12
 
-def run_all_pangenome(min_id, clust_mode, outdir, prt_path, threads, panfile=None, quiet=False):
+
+def run_all_pangenome(min_id, clust_mode, outdir, prt_path, threads, panfile=None, quiet=False,
+                      dedup=False, prt_files=None, keep_families=True):
     """
     Run all steps to build a pangenome:
 
+    - if asked, keep only distinct proteins of the bank
     - create mmseqs database from protein bank
     - cluster proteins
     - convert to pangenome
@@ -78,12 +88,22 @@ def run_all_pangenome(min_id, clust_mode, outdir, prt_path, threads, panfile=Non
         name for output pangenome file. Otherwise, will use default name
     quiet : bool
         True if nothing must be written on stdout, False otherwise.
+    dedup : bool
+        True to cluster only 1 copy of identical proteins, and add their duplicates to
+        their family afterwards. Pangenome file is the same as without dedup.
+    prt_files : list or None
+        protein file of each genome, to write the mmseqs database directly from them (see
+        ``write_mmseqs_db``). In this case, prt_path is not created, and only used to name
+        output files. None to create the database from prt_path with mmseqs.
+    keep_families : bool
+        True to return all families, False to only write them to the pangenome file (the
+        conversion of mmseqs results then uses a bounded amount of memory)
 
     Returns
     -------
     (families, outfile) : tuple
 
-        - families : {fam_num: [all members]}
+        - families : {fam_num: [all members]}, or None if keep_families is False
         - outfile : pangenome filename
     """
     # Get general information and file/directory names
@@ -98,7 +118,7 @@ def run_all_pangenome(min_id, clust_mode, outdir, prt_path, threads, panfile=Non
     infoname = get_info(threads, min_id, clust_mode)
     logmmseq = get_logmmseq(outdir, prt_bank, infoname)
 
-    tmpdir = os.path.join(outdir, "tmp_" + prt_bank + "_" + infoname)
+    tmpdir = os.path.join(outdir, "tmp_" + prt_bank + "_" + infoname + ("-dedup" if dedup else ""))
     mmseqdb = os.path.join(tmpdir, prt_bank + "-msDB")
     mmseqclust = os.path.join(tmpdir, prt_bank + "-clust-" + infoname)
     mmseqstsv = mmseqclust + ".tsv"
@@ -111,20 +131,438 @@ def run_all_pangenome(min_id, clust_mode, outdir, prt_path, threads, panfile=Non
     # If pangenome file already exists, read it to get families
     if os.path.isfile(panfile):
         logger.warning(f"Pangenome file {panfile} already exists. PanACoTA will read it to get families.")
-        _, families, _ = utils_pan.read_pan_file(panfile, logger)
+        families = None
+        if keep_families:
+            _, families, _ = utils_pan.read_pan_file(panfile, logger)
     else:
         os.makedirs(tmpdir, exist_ok=True)
+        members = None
+        if dedup:
+            prt_path, members_path = protf.dedup_prt_bank(prt_path)
+            members = protf.read_members(members_path)
         # Create ffindex of DB if not already done
-        status = do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet)
+        status = do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet, prt_files, threads)
         # status = create_mmseqs_db(mmseqdb, prt_path, logmmseq)
         # Status = ok means that mmseqs_db files already existed and were not re-done
         # If they were redone (or just done), remove any existing following file (mmseqs clust, tsv, csv)
         # Cluster with mmseqs
         families, panfile = do_pangenome(outdir, prt_bank, mmseqdb, mmseqclust, tmpdir, logmmseq, min_id,
-                                         clust_mode, status, threads, panfile, quiet)
+                                         clust_mode, status, threads, panfile, quiet,
+                                         members=members, keep_families=keep_families)
     return families, panfile
 
 
+def run_sweep_pangenome(min_ids, clust_mode, outdir, prt_path, threads, quiet=False,
+                        prt_files=None):
+    """
+    Build the pangenomes corresponding to several minimum identities, from a single mmseqs
+    database:
+
+    - create mmseqs database from protein bank (once for all identities)
+    - cluster proteins with the highest identity
+    - for each next identity (from the highest to the lowest), only cluster the
+      representatives of the previous clustering: each family contains all members of the
+      families of the clustered representatives
+    - convert each clustering to a pangenome
+
+    Families are then nested: a family of a given identity is the union of families of the
+    higher identities. As all clusterings except the first one only compare representatives,
+    it is much faster than clustering all proteins for each identity.
+
+    Parameters
+    ----------
+    min_ids : list
+        minimum percentages of identity to be in the same family, one pangenome per value
+    clust_mode : [0, 1, 2]
+        0 for 'set cover', 1 for 'single-linkage', 2 for 'CD-Hit'
+    outdir : str
+        directory where output cluster files must be saved
+    prt_path : str
+        path to file containing all proteins to cluster.
+    threads : int
+        number of threads which can be used
+    quiet : bool
+        True if nothing must be written on stdout, False otherwise.
+    prt_files : list or None
+        protein file of each genome, to write the mmseqs database directly from them (see
+        ``write_mmseqs_db``). None to create the database from prt_path with mmseqs.
+
+    Returns
+    -------
+    list
+        pangenome filename for each identity, from the highest to the lowest. Families are
+        only written to those files, not kept in memory.
+    """
+    prt_bank = os.path.basename(prt_path)
+    min_ids = sorted(set(min_ids), reverse=True)
+    information = ("Will run MMseqs2 hierarchically with:\n"
+                   f"\t- minimum sequence identities = "
+                   f"{', '.join(str(min_id*100) + '%' for min_id in min_ids)}\n"
+                   f"\t- cluster mode {clust_mode}")
+    if threads > 1:
+        information += f"\n\t- {threads} threads"
+    logger.info(information)
+    sweepinfo = get_info(threads, "sweep", clust_mode)
+    logmmseq = get_logmmseq(outdir, prt_bank, sweepinfo)
+    tmpdir = os.path.join(outdir, "tmp_" + prt_bank + "_" + sweepinfo)
+    mmseqdb = os.path.join(tmpdir, prt_bank + "-msDB")
+    os.makedirs(tmpdir, exist_ok=True)
+    # If the database was just (re)created, all clusterings must be redone
+    redo = do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet, prt_files, threads)
+    level_db = mmseqdb
+    members = None
+    pangenomes = []
+    for min_id in min_ids:
+        infoname = get_info(threads, min_id, clust_mode)
+        mmseqclust = os.path.join(tmpdir, prt_bank + "-clust-" + infoname)
+        panfile = os.path.join(outdir, f"PanGenome-{prt_bank}-clust-{infoname}.lst")
+        if redo or not os.path.isfile(mmseqclust):
+            utils.remove(mmseqclust)
+            logger.info(f"Clustering {'representatives' if members else 'proteins'} with "
+                        f"minimum identity {min_id*100}%...")
+            run_mmseqs_clust((level_db, mmseqclust, os.path.join(tmpdir, "tmp"), logmmseq,
+                              min_id, threads, clust_mode))
+            redo = True
+        else:
+            logger.warning(f"mmseqs clustering {mmseqclust} already exists. The program will "
+                           "now convert it to a pangenome file.")
+        mmseqs_to_pangenome(level_db, mmseqclust, logmmseq, panfile, members,
+                            keep_families=False)
+        pangenomes.append(panfile)
+        # Next identity: only cluster the representatives of current families
+        rep_db = os.path.join(tmpdir, prt_bank + "-reps-" + infoname)
+        if redo or not os.path.isfile(rep_db):
+            run_mmseqs_createsubdb(mmseqclust, level_db, rep_db, logmmseq)
+        level_db = rep_db
+        members = merge_level_clusters(read_tsv_clusters(mmseqclust + ".tsv"), members)
+    return pangenomes
+
+
+def merge_level_clusters(clusters, members=None):
+    """
+    Get all proteins represented by each representative of a clustering, when this
+    clustering only contains the representatives of a previous one (see
+    ``run_sweep_pangenome``).
+
+    Representatives are read from the mmseqs clusters (first member of each cluster), and
+    not from the families written in the pangenome file, whose members are sorted.
+
+    Parameters
+    ----------
+    clusters : iterable
+        [representative, other members] of each cluster, as given by ``read_tsv_clusters``
+    members : dict or None
+        {representative: [other proteins it represents]} for the previous clustering. None
+        if clusters contain all proteins.
+
+    Returns
+    -------
+    dict
+        {representative: [other proteins it represents]} for the current clustering
+    """
+    members = members or {}
+    merged = {}
+    for clust in clusters:
+        merged[clust[0]] = clust[1:] + [prot for repres in clust
+                                        for prot in members.get(repres, [])]
+    return merged
+
+
+def run_update_pangenome(update, lstinfo, dbpath, min_id, clust_mode, outdir, prt_path,
+                         threads, panfile=None, quiet=False):
+    """
+    Update an existing pangenome with the proteins of new genomes, without clustering all
+    proteins again:
+
+    - write the mmseqs database of all proteins (genomes of the existing pangenome + new
+      genomes) directly from their protein files. The database is stamped with the existing
+      pangenome and the protein files it was written from (see ``update_stamp``): if they
+      changed since a previous update, the database, clustering and updated pangenome are
+      done again.
+    - assign the new proteins to the existing clusters, or to new clusters, with
+      'mmseqs clusterupdate'
+    - convert to pangenome: existing families keep their number, and new families are
+      numbered after the last existing one
+
+    Parameters
+    ----------
+    update : tuple
+        (pangenome, mmseqs_db, clust_db): existing pangenome file, and the mmseqs database and
+        clustering from which it was created
+    lstinfo : str
+        file with name of genomes in the first column. Those which are not already in the
+        existing pangenome are added.
+    dbpath : str
+        path to the folder containing all protein files (of existing and new genomes)
+    min_id : float
+        minimum percentage of identity to be in the same family
+    clust_mode : [0, 1, 2]
+        0 for 'set cover', 1 for 'single-linkage', 2 for 'CD-Hit'
+    outdir : str
+        directory where output cluster file must be saved
+    prt_path : str
+        path to the bank of all proteins. It is not created, and only used to name output files.
+    threads : int
+        number of threads which can be used
+    panfile : str or None
+        name for output pangenome file. Otherwise, will use default name
+    quiet : bool
+        True if nothing must be written on stdout, False otherwise.
+
+    Returns
+    -------
+    (families, outfile) : tuple
+
+        - families : {fam_num: [all members]}
+        - outfile : pangenome filename
+    """
+    old_pan, old_db, old_clust = update
+    prt_bank = os.path.basename(prt_path)
+    logger.info(f"Will update pangenome {old_pan} with MMseqs2 clusterupdate:\n"
+                f"\t- minimum sequence identity = {min_id*100}%\n"
+                f"\t- cluster mode {clust_mode}")
+    infoname = get_info(threads, min_id, clust_mode)
+    logmmseq = get_logmmseq(outdir, prt_bank, infoname + "-update")
+    tmpdir = os.path.join(outdir, "tmp_" + prt_bank + "_" + infoname + "-update")
+    mmseqdb = os.path.join(tmpdir, prt_bank + "-msDB")
+    mmseqclust = os.path.join(tmpdir, prt_bank + "-clust-" + infoname)
+    if not panfile:
+        panfile = os.path.join(outdir, f"PanGenome-{prt_bank}-clust-{infoname}-update.lst")
+    else:
+        panfile = os.path.join(outdir, panfile)
+    if os.path.abspath(panfile) == os.path.abspath(old_pan):
+        logger.error(f"Updated pangenome would overwrite the existing pangenome {old_pan}. "
+                     "Give another name for the updated pangenome (-f option).")
+        sys.exit(1)
+    # Genomes of the existing pangenome, followed by new genomes
+    _, old_families, old_genomes = utils_pan.model_to_dicts(utils_pan.open_pan_model(old_pan,
+                                                                                     logger))
+    known = set(old_genomes)
+    new_genomes = [gen for gen in utils_pan.read_lstinfo(lstinfo, logger) if gen not in known]
+    prt_files = [os.path.join(dbpath, gen + ".prt") for gen in old_genomes + new_genomes]
+    stamp_file = os.path.join(tmpdir, prt_bank + "-update.stamp")
+    stamp = update_stamp(old_pan, old_clust, prt_files)
+    saved_stamp = read_update_stamp(stamp_file)
+    if saved_stamp != stamp:
+        # Files of a previous update were done from other genomes or another pangenome
+        for file in glob.glob(mmseqdb + "*") + glob.glob(mmseqclust + "*"):
+            utils.remove(file)
+        if saved_stamp is not None and os.path.isfile(panfile):
+            logger.warning(f"Genomes or existing pangenome changed since {panfile} was "
+                           "written. PanACoTA will update the pangenome again.")
+            os.remove(panfile)
+    if os.path.isfile(panfile):
+        logger.warning(f"Pangenome file {panfile} already exists. PanACoTA will read it to get families.")
+        _, families, _ = utils_pan.read_pan_file(panfile, logger)
+        return families, panfile
+    logger.info(f"{len(new_genomes)} new genomes will be added to the {len(old_genomes)} "
+                "genomes of the existing pangenome.")
+    if not new_genomes:
+        logger.warning("No new genome to add: the updated pangenome will contain the same "
+                       "families as the existing one.")
+    os.makedirs(tmpdir, exist_ok=True)
+    just_done = create_mmseqs_db(mmseqdb, prt_path, logmmseq, prt_files, threads)
+    write_update_stamp(stamp_file, stamp)
+    updated_db = mmseqdb + "-updated"
+    if just_done or not os.path.isfile(mmseqclust):
+        utils.remove(mmseqclust)
+        logger.info("Assigning new proteins to clusters...")
+        run_mmseqs_clusterupdate(old_db, mmseqdb, old_clust, updated_db, mmseqclust,
+                                 os.path.join(tmpdir, "tmp"), logmmseq, min_id, threads,
+                                 clust_mode)
+    else:
+        logger.warning(f"mmseqs clustering {mmseqclust} already exists. The program will now "
+                       "convert it to a pangenome file.")
+    logger.info("Converting mmseqs results to pangenome file")
+    run_mmseqs_createtsv(updated_db, mmseqclust, logmmseq)
+    families = update_families(old_families, read_tsv_clusters(mmseqclust + ".tsv"), panfile)
+    end = time.strftime('%Y-%m-%d_%H-%M-%S')
+    with open(logmmseq, "a") as logm:
+        logm.write(f"End: {end}")
+    return families, panfile
+
+
+def update_stamp(old_pan, old_clust, prt_files):
+    """
+    Get the stamp of the files from which a pangenome is updated: the existing pangenome,
+    its mmseqs clustering, and the protein file of each genome, with their size and
+    modification time
+
+    Parameters
+    ----------
+    old_pan : str
+        existing pangenome file
+    old_clust : str
+        mmseqs clustering from which the existing pangenome was created
+    prt_files : list
+        protein file of each genome of the updated pangenome
+
+    Returns
+    -------
+    list
+        [(path, size, mtime_ns)] for each file, (path, -1, -1) if it does not exist
+    """
+    return [(path, *utils_pan.source_stamp(path).tolist())
+            for path in [old_pan, old_clust + ".index"] + prt_files]
+
+
+def write_update_stamp(stamp_file, stamp):
+    """
+    Save the stamp of the files from which the mmseqs database of an update was written
+    (see ``update_stamp``)
+
+    Parameters
+    ----------
+    stamp_file : str
+        file where the stamp must be saved
+    stamp : list
+        [(path, size, mtime_ns)] for each file
+    """
+    with open(stamp_file + ".tmp", "w") as stampf:
+        for path, size, mtime in stamp:
+            stampf.write(f"{path}\t{size}\t{mtime}\n")
+    os.replace(stamp_file + ".tmp", stamp_file)
+
+
+def read_update_stamp(stamp_file):
+    """
+    Read the stamp saved by a previous update (see ``write_update_stamp``)
+
+    Parameters
+    ----------
+    stamp_file : str
+        file where the stamp was saved
+
+    Returns
+    -------
+    list or None
+        [(path, size, mtime_ns)] for each file, None if there is no stamp
+    """
+    if not os.path.isfile(stamp_file):
+        return None
+    stamp = []
+    with open(stamp_file, "r") as stampf:
+        for line in stampf:
+            path, size, mtime = line.rstrip("\n").rsplit("\t", 2)
+            stamp.append((path, int(size), int(mtime)))
+    return stamp
+
+
+def run_mmseqs_clusterupdate(old_db, mmseqdb, old_clust, updated_db, mmseqclust, tmpdir,
+                             logmmseq, min_id, threads, clust_mode):
+    """
+    Run mmseqs clusterupdate: keep the clusters of old_db proteins, and add the new proteins
+    of mmseqdb to them or to new clusters
+
+    Parameters
+    ----------
+    old_db : str
+        mmseqs database which was clustered
+    mmseqdb : str
+        mmseqs database with all proteins (proteins of old_db + new proteins)
+    old_clust : str
+        mmseqs clustering of old_db
+    updated_db : str
+        output mmseqs database, with all proteins, keys being consistent with old_db
+    mmseqclust : str
+        output mmseqs clustering of updated_db
+    tmpdir : str
+        folder which will contain mmseqs temporary files
+    logmmseq : str
+        path to file where logs must be written
+    min_id : float
+        min percentage of identity to be considered in the same family (between 0 and 1)
+    threads : int
+        max number of threads to use
+    clust_mode : [0, 1, 2]
+        0 for 'set cover', 1 for 'single-linkage', 2 for 'CD-Hit'
+    """
+    cmd = (f"mmseqs clusterupdate {old_db} {mmseqdb} {old_clust} {updated_db} {mmseqclust} "
+           f"{tmpdir} --min-seq-id {min_id} --threads {threads} --cluster-mode {clust_mode}")
+    logger.details(f"MMseqs command: {cmd}")
+    msg = f"Problem while updating clusters with mmseqs. See log in {logmmseq}"
+    with open(logmmseq, "a") as logm:
+        utils.run_cmd(cmd, msg, eof=True, stdout=logm, stderr=logm)
+
+
+def run_mmseqs_createsubdb(mmseqclust, mmseqdb, subdb, logmmseq):
+    """
+    Write the mmseqs database of the representatives of all clusters (sequences and headers)
+
+    Parameters
+    ----------
+    mmseqclust : str
+        mmseqs clustering of mmseqdb
+    mmseqdb : str
+        mmseqs database which was clustered
+    subdb : str
+        path to base filename of the database of representatives
+    logmmseq : str
+        path to file where logs must be written
+    """
+    for ext in ["", "_h"]:
+        cmd = f"mmseqs createsubdb {mmseqclust} {mmseqdb}{ext} {subdb}{ext}"
+        msg = f"Problem while extracting representatives of {mmseqclust} from {mmseqdb}{ext}."
+        logger.details(f"MMseqs command: {cmd}")
+        with open(logmmseq, "a") as logm:
+            utils.run_cmd(cmd, msg, eof=True, stdout=logm, stderr=logm)
+
+
+def update_families(old_families, clusters, fileout):
+    """
+    Add the new proteins of updated clusters to the existing families, and write the updated
+    pangenome.
+
+    A cluster containing members of an existing family gets its number. Clusters with only
+    new proteins are new families, numbered after the last existing family, in the order of
+    the clusters.
+
+    Parameters
+    ----------
+    old_families : dict
+        {fam_num: [members]} existing families
+    clusters : iterable
+        [all members] of each updated cluster
+    fileout : str
+        filename of pangenome where families must be written
+
+    Returns
+    -------
+    dict
+        families : {fam_num: [members]}, existing and new families
+    """
+    fam_of = {member: num for num, fam in old_families.items() for member in fam}
+    families = {num: list(fam) for num, fam in old_families.items()}
+    next_num = max((int(num) for num in old_families), default=0) + 1
+    nb_added = 0
+    nb_new_fams = 0
+    for clust in clusters:
+        new = [member for member in clust if member not in fam_of]
+        if not new:
+            continue
+        old_nums = sorted({fam_of[member] for member in clust if member in fam_of}, key=int)
+        if len(old_nums) > 1:
+            logger.warning(f"Updated cluster contains members of families {old_nums}: new "
+                           f"proteins are added to family {old_nums[0]}.")
+        if old_nums:
+            num = old_nums[0]
+            families[num].extend(new)
+            nb_added += len(new)
+        else:
+            num = str(next_num)
+            families[num] = new
+            next_num += 1
+            nb_new_fams += 1
+        for member in new:
+            fam_of[member] = num
+    logger.info(f"{nb_added} proteins added to existing families, and {nb_new_fams} new "
+                "families created.")
+    families, nb_fams = write_families(((num, families[num])
+                                        for num in sorted(families, key=int)), fileout)
+    logger.info("Pangenome has {} families.".format(nb_fams))
+    return families
+
+
 def get_info(threads, min_id, clust_mode):
     """
     Get string containing all information on future run
@@ -172,7 +610,7 @@ def get_logmmseq(outdir, prt_bank, infoname):
     return os.path.join(outdir, "mmseq_" + prt_bank + "_" + infoname + ".log")
 
 
-def do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet):
+def do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet, prt_files=None, threads=1):
     """
     Runs create_mmseqs_db with an "infinite progress bar" in the background.
     
@@ -190,6 +628,10 @@ def do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet):
          path to file where logs must be written
     quiet : bool
         True if no output in stderr/stdout, False otherwise
+    prt_files : list or None
+        protein files of all genomes, to write the database directly from them
+    threads : int
+        max number of threads to use when writing the database from prt_files
 
     Returns
     -------
@@ -209,7 +651,7 @@ def do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet):
                        "  -  ", progressbar.Timer()]
         x = threading.Thread(target=utils.thread_progressbar, args=(widgets, lambda : stop_bar,))
         x.start()
-        res = create_mmseqs_db(mmseqdb, prt_path, logmmseq)
+        res = create_mmseqs_db(mmseqdb, prt_path, logmmseq, prt_files, threads)
     # except KeyboardInterrupt: # pragma: no cover
     except: # pragma: no cover
         stop_bar = True
@@ -222,7 +664,7 @@ def do_mmseqs_db(mmseqdb, prt_path, logmmseq, quiet):
 
 
 def do_pangenome(outdir, prt_bank, mmseqdb, mmseqclust, tmpdir, logmmseq, min_id, clust_mode, 
-                just_done, threads, panfile, quiet=False):
+                just_done, threads, panfile, quiet=False, members=None, keep_families=True):
     """
     Use mmseqs to cluster proteins
 
@@ -253,12 +695,16 @@ def do_pangenome(outdir, prt_bank, mmseqdb, mmseqclust, tmpdir, logmmseq, min_id
         if a pangenome file is specified. Otherwise, default pangenome name will be used
     quiet : bool
         true if nothing must be print on stdout/stderr, false otherwise (show progress bar)
+    members : dict or None
+        {representative: [its duplicates]} if only distinct proteins were clustered
+    keep_families : bool
+        True to return all families, False to only write them to the pangenome file
 
     Returns
     -------
     (families, outfile) : tuple
 
-        - families : {fam_num: [all members]}
+        - families : {fam_num: [all members]}, or None if keep_families is False
         - outfile : pangenome filename
     """
     mmseqstsv = mmseqclust + ".tsv"
@@ -304,7 +750,8 @@ def do_pangenome(outdir, prt_bank, mmseqdb, mmseqclust, tmpdir, logmmseq, min_id
     # Convert output to tsv file (one line per comparison done)
     #  # Convert output to tsv file (one line per comparison done)
     # -> returns (families, outfile)
-    families = mmseqs_to_pangenome(mmseqdb, mmseqclust, logmmseq, panfile)
+    families = mmseqs_to_pangenome(mmseqdb, mmseqclust, logmmseq, panfile, members,
+                                   keep_families)
     return families, panfile
 
 
@@ -336,7 +783,8 @@ def run_mmseqs_clust(args):
         utils.run_cmd(cmd, msg, eof=False, stdout=logm, stderr=logm)
 
 
-def mmseqs_to_pangenome(mmseqdb, mmseqclust, logmmseq, outfile):
+def mmseqs_to_pangenome(mmseqdb, mmseqclust, logmmseq, outfile, members=None,
+                        keep_families=True):
     """
     Convert mmseqs clustering to a pangenome file:
 
@@ -353,26 +801,50 @@ def mmseqs_to_pangenome(mmseqdb, mmseqclust, logmmseq, outfile):
          path to file where logs must be written
     outfile : str
         pangenome filename
+    members : dict or None
+        {representative: [its duplicates]} if only distinct proteins were clustered
+    keep_families : bool
+        True to return all families, False to only write them to outfile
 
     Returns
     -------
-    dict
-        - families : {fam_num: [all members]}
+    dict or None
+        - families : {fam_num: [all members]}, or None if keep_families is False
+    """
+    run_mmseqs_createtsv(mmseqdb, mmseqclust, logmmseq)
+    # Convert the tsv file to a 'pangenome' file: one line per family
+    families = mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile, members, keep_families)
+    return families
+
+
+def run_mmseqs_createtsv(mmseqdb, mmseqclust, logmmseq):
+    """
+    Convert mmseqs clustering to a tsv file (``<mmseqclust>.tsv``), with 1 line per member:
+    its representative and itself
+
+    Parameters
+    ----------
+    mmseqdb : str
+        path to base filename of the mmseqs database clustered
+    mmseqclust : str
+        path to base filename of mmseq clustering
+    logmmseq : str
+        path to file where logs must be written
     """
     cmd = f"mmseqs createtsv {mmseqdb} {mmseqdb} {mmseqclust} {mmseqclust}.tsv"
     msg = "Problem while trying to convert mmseq result file to tsv file"
     logger.details(f"MMseqs command: {cmd}")
     with open(logmmseq, "a") as logf:
         utils.run_cmd(cmd, msg, eof=True, stdout=logf, stderr=logf)
-    # Convert the tsv file to a 'pangenome' file: one line per family
-    families = mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile)
-    return families
 
 
-def mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile):
+def mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile, members=None, keep_families=True):
     """
     Convert the tsv output file of mmseqs to the pangenome file
 
+    The tsv file is streamed: each family is written as soon as all its members are read, so
+    that only the current family is kept in memory (plus all families if keep_families).
+
     Parameters
     ----------
     mmseqclust : str
@@ -381,17 +853,26 @@ def mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile):
         path to file where logs must be written
     outfile : str
         pangenome filename, or None if default one must be used
+    members : dict or None
+        {representative: [its duplicates]} if only distinct proteins were clustered:
+        duplicates are added to the family of their representative
+    keep_families : bool
+        True to return all families, False to only write them to outfile
 
     Returns
     -------
-    dict
+    dict or None
 
-        - families : {fam_num: [all members]}
+        - families : {fam_num: [all members]}, or None if keep_families is False
     """
     logger.info("Converting mmseqs results to pangenome file")
     tsvfile = mmseqclust + ".tsv"
-    clusters = mmseq_tsv_to_clusters(tsvfile)
-    families = clusters_to_file(clusters, outfile)
+    clusters = read_tsv_clusters(tsvfile)
+    if members:
+        clusters = (fam + [dup for repres in fam for dup in members.get(repres, [])]
+                    for fam in clusters)
+    families, nb_fams = write_families(enumerate(clusters, start=1), outfile, keep_families)
+    logger.info("Pangenome has {} families.".format(nb_fams))
     end = time.strftime('%Y-%m-%d_%H-%M-%S')
     with open(logmmseq, "a") as logm:
         logm.write(f"End: {end}")
@@ -425,6 +906,40 @@ def mmseq_tsv_to_clusters(mmseq):
     return clusters
 
 
+def read_tsv_clusters(mmseq):
+    """
+    Reads the output of mmseq as a tsv file, one cluster after the other.
+
+    mmseqs createtsv writes all members of a cluster on consecutive lines, starting with the
+    representative (line 'representative representative'), so a cluster is complete as soon
+    as the representative changes.
+
+    Parameters
+    ----------
+    mmseq : str
+        filename of mmseq clustering output in tsv format
+
+    Returns
+    -------
+    generator
+        [list of members] of each cluster, representative first
+    """
+    fam = []
+    current = None
+    with open(mmseq) as mmsf:
+        for line in mmsf:
+            repres, other = line.strip().split()
+            if repres != current:
+                if fam:
+                    yield fam
+                current = repres
+                fam = [repres]
+            else:
+                fam.append(other)
+    if fam:
+        yield fam
+
+
 def clusters_to_file(clust, fileout):
     """
     Write all clusters to a file
@@ -439,21 +954,43 @@ def clusters_to_file(clust, fileout):
     dict
         families : {famnum: [members]}
     """
-    families = {}  # {famnum: [members]}
-    with open(fileout, "w") as fout:
-        num = 1
-        for _, fam in clust.items():
-            families[num] = []
-            fout.write(str(num))
-            for mem in sorted(fam, key=utils.sort_proteins):
-                families[num].append(mem)
-                fout.write(" " + mem)
-            fout.write("\n")
-            num += 1
+    families, _ = write_families(enumerate(clust.values(), start=1), fileout)
     return families
 
 
-def create_mmseqs_db(mmseqdb, prt_path, logmmseq):
+def write_families(fams, fileout, keep_families=True):
+    """
+    Write families to the pangenome file, with members sorted
+
+    Parameters
+    ----------
+    fams : iterable
+        (famnum, [all members]) for each family
+    fileout : str
+        filename of pangenome where families must be written
+    keep_families : bool
+        True to return all families written, False to only write them
+
+    Returns
+    -------
+    (families, nb_fams) : tuple
+
+        - families : {famnum: [members]}, or None if keep_families is False
+        - nb_fams : number of families written
+    """
+    families = {} if keep_families else None  # {famnum: [members]}
+    nb_fams = 0
+    with open(fileout, "w") as fout:
+        for num, fam in fams:
+            fam = sorted(fam, key=utils.sort_proteins)
+            fout.write(f"{num} {' '.join(fam)}\n")
+            if keep_families:
+                families[num] = fam
+            nb_fams += 1
+    return families, nb_fams
+
+
+def create_mmseqs_db(mmseqdb, prt_path, logmmseq, prt_files=None, threads=1):
     """
     Create ffindex of protein bank (prt_path) if not already done. If done, just write a message
     to tell the user that the current existing file will be used.
@@ -466,7 +1003,11 @@ def create_mmseqs_db(mmseqdb, prt_path, logmmseq):
         path to the file containing all proteins to cluster
     logmmseq : str
          path to file where logs must be written
-
+    prt_files : list or None
+        protein files of all genomes, to write the database directly from them (see
+        ``write_mmseqs_db``), instead of running mmseqs createdb on prt_path
+    threads : int
+        max number of threads to use when writing the database from prt_files
 
     Returns
     -------
@@ -496,6 +1037,11 @@ def create_mmseqs_db(mmseqdb, prt_path, logmmseq):
             return False
     logger.debug("Existing files: {}".format(len(files_existing)))
     logger.debug("Expected extensions: {}".format(len(outext)))
+    if prt_files:
+        write_mmseqs_db(mmseqdb, prt_files, threads)
+        with open(logmmseq, "w") as logf:
+            logf.write(f"mmseqs database {mmseqdb} written from {len(prt_files)} protein files\n")
+        return True
     cmd = f"mmseqs createdb {prt_path} {mmseqdb}"
     msg = (f"Problem while trying to convert database {prt_path} to mmseqs "
            "database format.")
@@ -503,3 +1049,138 @@ def create_mmseqs_db(mmseqdb, prt_path, logmmseq):
     with open(logmmseq, "w") as logf:
         utils.run_cmd(cmd, msg, eof=True, stdout=logf, stderr=logf)
     return True
+
+
+def write_mmseqs_db(mmseqdb, prt_files, threads=1):
+    """
+    Write the mmseqs database of all proteins directly from the protein files of the genomes,
+    in the same format as 'mmseqs createdb': sequences (mmseqdb), headers (mmseqdb_h), their
+    index and dbtype files, the lookup file (key, protein name, number of the protein file)
+    and the source file (number and name of each protein file).
+
+    The proteins of each genome are written to temporary parts in parallel, with the list of
+    their entries. Each part is merged as soon as it and all previous parts are written:
+    parts are concatenated in the order of prt_files, and the indexes and lookup are written
+    from its list of entries, so that entries of all proteins are never kept in memory. The
+    sequence file is written last: when it exists, the database is complete.
+
+    Parameters
+    ----------
+    mmseqdb : str
+        path to base filename of the database
+    prt_files : list
+        protein file of each genome
+    threads : int
+        max number of genomes read at the same time
+    """
+    logger.info(f"Writing mmseqs database from {len(prt_files)} protein files")
+    arguments = [(prt_file, f"{mmseqdb}.part{num}", f"{mmseqdb}_h.part{num}",
+                  f"{mmseqdb}.part{num}.entries")
+                 for num, prt_file in enumerate(prt_files)]
+    pool = None
+    if threads > 1 and len(prt_files) > 1:
+        pool = multiprocessing.Pool(threads)
+        # imap returns parts in the order of prt_files, as soon as they are written
+        parts = pool.imap(write_db_parts, arguments)
+    else:
+        parts = map(write_db_parts, arguments)
+    key = 0
+    offset = 0
+    offset_h = 0
+    tmpdb = mmseqdb + ".tmp"
+    try:
+        with open(tmpdb, "wb") as dbf, open(mmseqdb + "_h", "wb") as headf, \
+             open(mmseqdb + ".index", "w") as indexf, \
+             open(mmseqdb + "_h.index", "w") as indexhf, \
+             open(mmseqdb + ".lookup", "w") as lookf:
+            for num, (part, part_h, part_entries) in enumerate(parts):
+                with open(part_entries, "r") as entf:
+                    for line in entf:
+                        name, size, size_h = line.rstrip("\n").split("\t")
+                        indexf.write(f"{key}\t{offset}\t{size}\n")
+                        indexhf.write(f"{key}\t{offset_h}\t{size_h}\n")
+                        lookf.write(f"{key}\t{name}\t{num}\n")
+                        key += 1
+                        offset += int(size)
+                        offset_h += int(size_h)
+                os.remove(part_entries)
+                for part_file, outf in [(part, dbf), (part_h, headf)]:
+                    with open(part_file, "rb") as partf:
+                        utils.copy_file(partf, outf)
+                    os.remove(part_file)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    with open(mmseqdb + ".source", "w") as sourcef:
+        for num, prt_file in enumerate(prt_files):
+            sourcef.write(f"{num}\t{os.path.basename(prt_file)}\n")
+    for dbtype_file, dbtype in [(mmseqdb + ".dbtype", MMSEQS_DBTYPE_AA),
+                                (mmseqdb + "_h.dbtype", MMSEQS_DBTYPE_GENERIC)]:
+        with open(dbtype_file, "wb") as typef:
+            typef.write(struct.pack("<i", dbtype))
+    os.replace(tmpdb, mmseqdb)
+    logger.log(utils.detail_lvl(), f"{key} proteins written to mmseqs database {mmseqdb}")
+
+
+def write_db_parts(args):
+    """
+    Write the proteins of a genome in mmseqs database format: each sequence (or header, without
+    '>') is followed by a new line and a null character.
+
+    Parameters
+    ----------
+    args : tuple
+        (prt_file, part, part_h, part_entries) with prt_file the protein file of the genome,
+        part the file where sequences must be written, part_h the file where headers must be
+        written, and part_entries the file where the entries written must be listed (protein
+        name, size of its sequence entry, size of its header entry, for each protein in the
+        order of prt_file)
+
+    Returns
+    -------
+    tuple
+        (part, part_h, part_entries)
+    """
+    prt_file, part, part_h, part_entries = args
+    with open(prt_file, "rb") as prtf, open(part, "wb") as partf, \
+         open(part_h, "wb") as parthf, open(part_entries, "w") as entf:
+        header = None
+        seq = []
+        for line in prtf:
+            if line.startswith(b">"):
+                if header is not None:
+                    write_db_entry(header, seq, partf, parthf, entf)
+                header = line[1:].rstrip(b"\r\n")
+                seq = []
+            elif header is not None:
+                seq.append(line.strip())
+        if header is not None:
+            write_db_entry(header, seq, partf, parthf, entf)
+    return part, part_h, part_entries
+
+
+def write_db_entry(header, seq, partf, parthf, entf):
+    """
+    Write a protein in mmseqs database format (see ``write_db_parts``)
+
+    Parameters
+    ----------
+    header : bytes
+        protein header, without '>'
+    seq : list
+        lines of the protein sequence, stripped
+    partf : io.BufferedWriter
+        open file where sequence entry must be written
+    parthf : io.BufferedWriter
+        open file where header entry must be written
+    entf : _io.TextIOWrapper
+        open file where the entry must be listed (protein name, size of its sequence entry,
+        size of its header entry)
+    """
+    seq_entry = b"".join(seq) + b"\n\x00"
+    head_entry = header + b"\n\x00"
+    partf.write(seq_entry)
+    parthf.write(head_entry)
+    name = header.split()[0].decode() if header.split() else ""
+    entf.write(f"{name}\t{len(seq_entry)}\t{len(head_entry)}\n")
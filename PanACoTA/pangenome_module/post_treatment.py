@@ -42,14 +42,17 @@ April 2017
 """
 import logging
 import numpy as np
+import scipy.sparse
 
-from PanACoTA import utils
 from PanACoTA import utils_pangenome as utilsp
 
 logger = logging.getLogger("pangenome.post-treat")
 
+# Max number of cells of the quali/quanti matrices converted to text at the same time
+CHUNK_CELLS = 2 ** 22
 
-def post_treat(families, pangenome):
+
+def post_treat(families, pangenome, matrix=False):
     """
     From clusters = {num: [members]}, create:
 
@@ -75,10 +78,103 @@ def post_treat(families, pangenome):
         pangenome file
     pangenome : str
         file containing pangenome
+    matrix : bool
+        True to also save the qualitative and quantitative matrices in binary format (see
+        ``write_binary_matrices``)
+    """
+    model = utilsp.open_pan_model(pangenome, logger, families)
+    fam_nums, counts = model_counts(model)
+    nb_members = np.diff(model["fam_offsets"])[fam_order(model["fam_names"])]
+    all_strains = utilsp.array_to_names(model["genomes"])
+    logger.info("Generating qualitative and quantitative matrix, and summary file")
+    with open(pangenome + ".summary.txt", "w") as psf:
+        write_summary_header(psf)
+        write_outputs(fam_nums, counts, nb_members, all_strains,
+                      pangenome + ".quali.txt", pangenome + ".quanti.txt", psf)
+    if matrix:
+        write_binary_matrices(fam_nums, counts, all_strains, pangenome)
+
+
+def fam_order(fam_names):
+    """
+    Get the order of families in output files: sorted by family number
+
+    Parameters
+    ----------
+    fam_names : numpy.ndarray
+        family numbers, as byte strings
+
+    Returns
+    -------
+    numpy.ndarray
+        indexes of families, sorted by family number
+    """
+    return np.argsort(fam_names.astype(np.int64), kind="stable")
+
+
+def model_counts(model):
+    """
+    Get the sparse matrix of the number of members of each genome in each family, from the
+    compact model of the pangenome
+
+    Parameters
+    ----------
+    model : dict
+        {field: numpy array} compact model of the pangenome (see
+        ``utils_pangenome.build_pan_model``)
+
+    Returns
+    -------
+    (fam_nums, counts) : tuple
+
+        - fam_nums: list of family numbers, sorted
+        - counts: scipy.sparse.csr_matrix, lines = families (in fam_nums order),
+          columns = genomes (in model["genomes"] order)
     """
-    fams_by_strain, families, all_strains = utilsp.read_pangenome(pangenome, logger, families)
-    open_outputs_to_write(fams_by_strain, families, all_strains, pangenome)
-    # result of open_outputs_to_write = (qualis, quantis, summaries)
+    order = fam_order(model["fam_names"])
+    fams, genomes, nb_mems = utilsp.family_genome_counts(model)
+    # Line of each family in the matrix
+    lines = np.empty(len(order), dtype=np.int64)
+    lines[order] = np.arange(len(order))
+    counts = scipy.sparse.csr_matrix((nb_mems, (lines[fams], genomes)),
+                                     shape=(len(order), len(model["genomes"])))
+    fam_nums = [str(num) for num in model["fam_names"][order].astype(np.int64).tolist()]
+    return fam_nums, counts
+
+
+def dict_counts(fams_by_strain, all_strains):
+    """
+    Get the sparse matrix of the number of members of each genome in each family, from the
+    pangenome python objects
+
+    Parameters
+    ----------
+    fams_by_strain : dict
+        {fam_num: {strain: [members]}}
+    all_strains : list
+        list of all genome names
+
+    Returns
+    -------
+    (fam_nums, counts) : tuple
+
+        - fam_nums: list of family numbers, sorted
+        - counts: scipy.sparse.csr_matrix, lines = families (in fam_nums order),
+          columns = genomes (in all_strains order)
+    """
+    fam_nums = sorted(fams_by_strain, key=lambda x: int(x))
+    strain_index = {strain: num for num, strain in enumerate(all_strains)}
+    lines = []
+    columns = []
+    nb_mems = []
+    for line, fam_num in enumerate(fam_nums):
+        for strain, members in fams_by_strain[fam_num].items():
+            lines.append(line)
+            columns.append(strain_index[strain])
+            nb_mems.append(len(members))
+    counts = scipy.sparse.csr_matrix((nb_mems, (lines, columns)),
+                                     shape=(len(fam_nums), len(all_strains)), dtype=int)
+    return fam_nums, counts
 
 
 def open_outputs_to_write(fams_by_strain, families, all_strains, pangenome):
@@ -114,13 +210,25 @@ def open_outputs_to_write(fams_by_strain, families, all_strains, pangenome):
     panquanti = pangenome + ".quanti.txt"
     pansum = pangenome + ".summary.txt"
     with open(pansum, "w") as psf:
-        psf.write("num_fam,nb_members,sum_quanti,sum_quali,"
-                  "nb_0,nb_mono,nb_multi,sum_0_mono_multi,max_multi\n")
+        write_summary_header(psf)
         res = generate_and_write_outputs(fams_by_strain, families,
                                          all_strains, panquali, panquanti, psf)
     return res
 
 
+def write_summary_header(psf):
+    """
+    Write header of the summary file
+
+    Parameters
+    ----------
+    psf : _io.TextIOWrapper
+        open file where summary will be written
+    """
+    psf.write("num_fam,nb_members,sum_quanti,sum_quali,"
+              "nb_0,nb_mono,nb_multi,sum_0_mono_multi,max_multi\n")
+
+
 def generate_and_write_outputs(fams_by_strain, families, all_strains, panquali, panquanti, psf):
     """
     From the python objects of pangenome, generate qualitative and quantitative matrix,
@@ -134,10 +242,10 @@ def generate_and_write_outputs(fams_by_strain, families, all_strains, panquali,
         {fam_num: [all members]}
     all_strains : list
         list of all strains
-    pqlf : _io.TextIOWrapper
-        open file where qualitative matrix will be written
-    pqtf : _io.TextIOWrapper
-        open file where quantitative matrix will be written
+    pqlf : str or _io.TextIOWrapper
+        file where qualitative matrix will be written
+    pqtf : str or _io.TextIOWrapper
+        file where quantitative matrix will be written
     psf : _io.TextIOWrapper
         open file where summary will be written
 
@@ -155,45 +263,151 @@ def generate_and_write_outputs(fams_by_strain, families, all_strains, panquali,
 
     """
     logger.info("Generating qualitative and quantitative matrix, and summary file")
-
-    # Matrix has:
-    # - 1 row per family (header will be added after)
-    # - 1 column for fam nums + 1 column per strain
-    matrix_quali = np.empty((len(families), len(all_strains) + 1), dtype=int)
-    matrix_quanti = np.empty((len(families), len(all_strains) + 1), dtype=int)
-
-    # also save matrix as python objects
-    qualis = {}
-    quantis = {}
-    summaries = {}
-    row = 0
-    for fam_num in sorted(fams_by_strain, key=lambda x: int(x)):
-        strains = fams_by_strain[fam_num]
-        quali = [1 if strain in strains else 0 for strain in all_strains]
-        quanti = [len(strains[strain]) if strain in strains else 0 for strain in all_strains]
-        nb_0 = quanti.count(0)
-        nb_mono = quanti.count(1)
-        nb_multi = len(quanti) - nb_0 - nb_mono
-        max_multi = max(quanti)
-        # Add line to quali and quanti matrices
-        matrix_quali[row,:] = [fam_num] + quali
-        matrix_quanti[row,:] = [fam_num] + quanti
-        # Write summary line
-        summ = [len(families[fam_num]), sum(quanti), sum(quali),
-                nb_0, nb_mono, nb_multi, nb_0 + nb_mono + nb_multi, max_multi]
-        psf.write(f"{fam_num},{utils.list_to_str(summ, sep=',')}")
-        # Complete python objects with quali, quanti, sumary
-        qualis[fam_num] = quali
-        quantis[fam_num] = quanti
-        summaries[fam_num] = summ
-        row += 1
-    # Add headers to quali and quanti matrix
-    header = np.array(["fam_num"] + all_strains)
-    matrix_quali = np.vstack((header, matrix_quali))
-    matrix_quanti = np.vstack((header, matrix_quanti))
-    # Transpose matrix: lines = genomes, columns = families
-    tmatrix_quali = matrix_quali.transpose()
-    np.savetxt(panquali, tmatrix_quali, delimiter=",", fmt="%s")
-    tmatrix_quanti = matrix_quanti.transpose()
-    np.savetxt(panquanti, tmatrix_quanti, delimiter=",", fmt="%s")
+    fam_nums, counts = dict_counts(fams_by_strain, all_strains)
+    nb_members = np.array([len(families[fam_num]) for fam_num in fam_nums], dtype=int)
+    summary = write_outputs(fam_nums, counts, nb_members, all_strains, panquali, panquanti, psf)
+    # also give matrix as python objects
+    quantis = dict(zip(fam_nums, counts.toarray().tolist()))
+    qualis = {fam_num: [1 if num else 0 for num in quanti] for fam_num, quanti in quantis.items()}
+    summaries = dict(zip(fam_nums, summary.tolist()))
     return qualis, quantis, summaries
+
+
+def write_outputs(fam_nums, counts, nb_members, all_strains, panquali, panquanti, psf):
+    """
+    Write qualitative and quantitative matrix, as well as summary file, from the sparse matrix
+    of the number of members of each genome in each family
+
+    Parameters
+    ----------
+    fam_nums : list
+        family numbers, in the order of lines of counts
+    counts : scipy.sparse.csr_matrix
+        lines = families, columns = genomes, number of members of the genome in the family
+    nb_members : numpy.ndarray
+        total number of members of each family
+    all_strains : list
+        list of all strains, in the order of columns of counts
+    panquali : str or _io.TextIOWrapper
+        file where qualitative matrix will be written
+    panquanti : str or _io.TextIOWrapper
+        file where quantitative matrix will be written
+    psf : _io.TextIOWrapper
+        open file where summary will be written
+
+    Returns
+    -------
+    numpy.ndarray
+        summary: 1 line per family, with [nb_members, sum_quanti, sum_quali,\
+        nb_0, nb_mono, nb_multi, sum_0-mono-multi, max_multi]
+    """
+    counts.eliminate_zeros()
+    nb_strains = counts.shape[1]
+    sum_quanti = np.asarray(counts.sum(axis=1)).ravel()
+    sum_quali = np.diff(counts.indptr)
+    nb_mono = np.asarray((counts == 1).sum(axis=1)).ravel()
+    max_multi = counts.max(axis=1).toarray().ravel() if nb_strains else np.zeros_like(sum_quali)
+    summary = np.column_stack((nb_members, sum_quanti, sum_quali, nb_strains - sum_quali,
+                               nb_mono, sum_quali - nb_mono, np.full_like(sum_quali, nb_strains),
+                               max_multi)).astype(int)
+    step = max(1, CHUNK_CELLS // summary.shape[1])
+    for start in range(0, len(fam_nums), step):
+        chunk = summary[start:start + step].astype(str_dtype(summary))
+        psf.writelines(f"{fam_num},{','.join(line)}\n"
+                       for fam_num, line in zip(fam_nums[start:], chunk))
+    # Transposed matrices: lines = genomes, columns = families
+    counts = counts.tocsc()
+    write_transposed(counts, fam_nums, all_strains, panquanti)
+    counts.data[:] = 1
+    write_transposed(counts, fam_nums, all_strains, panquali)
+    return summary
+
+
+def write_transposed(counts, fam_nums, all_strains, outfile):
+    """
+    Write the matrix with 1 line per genome and 1 column per family, in csv format, a few
+    genomes at a time.
+
+    Parameters
+    ----------
+    counts : scipy.sparse.csc_matrix
+        lines = families, columns = genomes
+    fam_nums : list
+        family numbers, in the order of lines of counts
+    all_strains : list
+        list of all strains, in the order of columns of counts
+    outfile : str or _io.TextIOWrapper
+        file where matrix will be written
+    """
+    if isinstance(outfile, str):
+        with open(outfile, "w") as outf:
+            write_transposed(counts, fam_nums, all_strains, outf)
+        return
+    outfile.write(f"fam_num,{','.join(fam_nums)}\n")
+    step = max(1, CHUNK_CELLS // max(len(fam_nums), 1))
+    dtype = str_dtype(counts.data)
+    for start in range(0, len(all_strains), step):
+        chunk = counts[:, start:start + step].T.toarray().astype(dtype)
+        outfile.writelines(f"{strain},{','.join(line)}\n"
+                           for strain, line in zip(all_strains[start:], chunk))
+
+
+def write_binary_matrices(fam_nums, counts, all_strains, pangenome):
+    """
+    Save qualitative and quantitative matrices in binary format, with 1 line per genome and
+    1 column per family as in the csv files:
+
+    - ``<pangenome>.quanti.npz``: scipy.sparse matrix of the number of members
+    - ``<pangenome>.quali.npy``: dense presence/absence matrix, bit-packed on each line
+      (``numpy.packbits``), which can be memory-mapped
+    - ``<pangenome>.genomes``: genome of each line, 1 per line
+    - ``<pangenome>.families``: family number of each column, 1 per line
+
+    They can be loaded with ``utils_pangenome.load_pan_matrices``.
+
+    Parameters
+    ----------
+    fam_nums : list
+        family numbers, in the order of lines of counts
+    counts : scipy.sparse.csr_matrix
+        lines = families, columns = genomes, number of members of the genome in the family
+    all_strains : list
+        list of all strains, in the order of columns of counts
+    pangenome : str
+        filename containing pangenome. Will be extended for the output files
+    """
+    logger.info("Saving qualitative and quantitative matrices in binary format")
+    quanti = counts.T.tocsr()
+    quanti.eliminate_zeros()
+    # Numbers of members are stored with the smallest unsigned int type
+    quanti = quanti.astype(np.min_scalar_type(quanti.max() if quanti.nnz else 0))
+    quali = quanti.astype(bool)
+    scipy.sparse.save_npz(pangenome + ".quanti.npz", quanti, compressed=False)
+    packed = np.lib.format.open_memmap(pangenome + ".quali.npy", mode="w+", dtype=np.uint8,
+                                       shape=(len(all_strains), (len(fam_nums) + 7) // 8))
+    step = max(1, CHUNK_CELLS // max(len(fam_nums), 1))
+    for start in range(0, len(all_strains), step):
+        packed[start:start + step] = np.packbits(quali[start:start + step].toarray(), axis=1)
+    packed.flush()
+    del packed
+    with open(pangenome + ".genomes", "w") as genf:
+        genf.writelines(f"{strain}\n" for strain in all_strains)
+    with open(pangenome + ".families", "w") as famf:
+        famf.writelines(f"{fam_num}\n" for fam_num in fam_nums)
+
+
+def str_dtype(values):
+    """
+    Get the smallest numpy str dtype able to contain all given (positive) int values
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        int values which will be converted to str
+
+    Returns
+    -------
+    str
+        numpy dtype
+    """
+    return f"U{len(str(values.max())) if values.size else 1}"
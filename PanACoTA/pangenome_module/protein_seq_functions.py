@@ -42,6 +42,7 @@ April 2017
 from PanACoTA import utils
 from PanACoTA import utils_pangenome as utilsp
 import logging
+import hashlib
 import os
 
 logger = logging.getLogger('pangenome.bank')
@@ -72,21 +73,149 @@ def build_prt_bank(lstinfo, dbpath, name, spedir, quiet):
     str
         name (with path) of the protein databank generated
     """
-    if not spedir:
-        outdir = dbpath
-    else:
+    outfile = bank_name(dbpath, name, spedir)
+    if spedir:
         os.makedirs(spedir, exist_ok=True)
-        outdir = spedir
-    outfile = os.path.join(outdir, name + ".All.prt")
     if os.path.isfile(outfile):
         logger.warning((f"Protein bank {outfile} already exists. "
                         "It will be used by mmseqs."))
         return outfile
     logger.info(f"Building bank with all proteins to {outfile}")
-    genomes = utilsp.read_lstinfo(lstinfo, logger)
-    all_names = [os.path.join(dbpath, gen + ".prt") for gen in genomes]
+    all_names = genome_prt_files(lstinfo, dbpath)
     if quiet:
         utils.cat(all_names, outfile)
     else:
         utils.cat(all_names, outfile, title="Building bank")
     return outfile
+
+
+def bank_name(dbpath, name, spedir):
+    """
+    Get the path to the bank with all proteins
+
+    Parameters
+    ----------
+    dbpath : str
+        Proteins folder, containing all proteins for each genome
+    name : str
+        dataset name
+    spedir : str or None
+        folder where the bank must be saved, None to save it in dbpath
+
+    Returns
+    -------
+    str
+        path to ``<dbpath or spedir>/<name>.All.prt``
+    """
+    return os.path.join(spedir or dbpath, name + ".All.prt")
+
+
+def genome_prt_files(lstinfo, dbpath):
+    """
+    Get the protein file of each genome contained in lstinfo
+
+    Parameters
+    ----------
+    lstinfo : str
+        1 line per genome, only 1st column considered here, as the genome name
+        without extension
+    dbpath : str
+        Proteins folder, containing all proteins for each genome. Each genome has
+        its own protein file, called `<genome_name>.prt`.
+
+    Returns
+    -------
+    list
+        path to the protein file of each genome, in the order of lstinfo
+    """
+    genomes = utilsp.read_lstinfo(lstinfo, logger)
+    return [os.path.join(dbpath, gen + ".prt") for gen in genomes]
+
+
+def dedup_prt_bank(prt_path):
+    """
+    Write only 1 copy of each distinct protein of the bank, so that mmseqs clusters only
+    distinct sequences. The representative of identical proteins is the first one found in
+    the bank. Sequences are compared through their hash.
+
+    Output files, next to the bank ``<name>.All.prt``:
+
+    - ``<name>.All.uniq.prt``: distinct proteins
+    - ``<name>.All.uniq.members``: 1 line per representative having duplicates, with
+      the representative followed by all its duplicates, separated by spaces
+
+    Parameters
+    ----------
+    prt_path : str
+        path to the protein bank
+
+    Returns
+    -------
+    tuple
+        (path to file with distinct proteins, path to members file)
+    """
+    base = os.path.splitext(prt_path)[0]
+    uniq_path = base + ".uniq.prt"
+    members_path = base + ".uniq.members"
+    if (os.path.isfile(uniq_path) and os.path.isfile(members_path)
+            and os.path.getmtime(members_path) >= os.path.getmtime(prt_path)
+            and os.path.getmtime(members_path) >= os.path.getmtime(uniq_path)):
+        logger.warning(f"Distinct proteins of {prt_path} already in {uniq_path}. "
+                       "They will be used by mmseqs.")
+        return uniq_path, members_path
+    logger.info(f"Keeping only distinct proteins of {prt_path}")
+    representatives = {}  # {hash of sequence: representative}
+    duplicates = {}  # {representative: [duplicates]}
+    nb_prots = 0
+
+    def add_protein(name, lines, uniqf):
+        digest = hashlib.blake2b(b"".join(line.strip() for line in lines[1:]),
+                                 digest_size=16).digest()
+        repres = representatives.get(digest)
+        if repres is None:
+            representatives[digest] = name
+            uniqf.write(b"".join(lines))
+        else:
+            duplicates.setdefault(repres, []).append(name)
+
+    with open(prt_path, "rb") as prtf, open(uniq_path, "wb") as uniqf:
+        lines = []
+        for line in prtf:
+            if line.startswith(b">"):
+                if lines:
+                    add_protein(lines[0][1:].split()[0], lines, uniqf)
+                lines = [line]
+                nb_prots += 1
+            elif lines:
+                lines.append(line)
+        if lines:
+            add_protein(lines[0][1:].split()[0], lines, uniqf)
+    # Write members file last: when it exists, the file with distinct proteins is complete
+    with open(members_path, "wb") as memf:
+        for repres, dups in duplicates.items():
+            memf.write(b" ".join([repres] + dups) + b"\n")
+    logger.info(f"{len(representatives)} distinct proteins out of {nb_prots}")
+    return uniq_path, members_path
+
+
+def read_members(members_path):
+    """
+    Read the members file written by ``dedup_prt_bank``
+
+    Parameters
+    ----------
+    members_path : str
+        path to members file
+
+    Returns
+    -------
+    dict
+        {representative: [its duplicates]}
+    """
+    members = {}
+    with open(members_path, "r") as memf:
+        for line in memf:
+            names = line.split()
+            if names:
+                members[names[0]] = names[1:]
+    return members
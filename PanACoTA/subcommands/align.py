@@ -55,12 +55,21 @@ def main_from_parse(args):
         result of argparse parsing of all arguments in command line
     """
     cmd = "PanACoTA " + ' '.join(args.argv)
+    mode_thresholds = None
+    if args.mafft_mode == "adaptive":
+        mode_thresholds = {name: getattr(args, name)
+                           for name in ["linsi_max_seqs", "linsi_max_len", "parttree_min_seqs"]
+                           if getattr(args, name) is not None}
     main(cmd, args.corepers, args.list_genomes, args.dataset_name, args.dbpath, 
-         args.outdir, args.prot_ali, args.threads, args.force, args.verbose, args.quiet)
+         args.outdir, args.prot_ali, args.threads, args.force, args.verbose, args.quiet,
+         btr_awk=args.btr_awk, dedup=args.dedup, compact=args.compact,
+         workspace=args.workspace, write_lists=not args.no_lists, patterns=args.patterns,
+         trim=args.trim, mode_thresholds=mode_thresholds, matrix=args.matrix)
 
 
 def main(cmd, corepers, list_genomes, dname, dbpath, outdir, prot_ali, threads, force, verbose=0,
-         quiet=False):
+         quiet=False, btr_awk=False, dedup=False, compact=False, workspace=False,
+         write_lists=True, patterns=None, trim=None, mode_thresholds=None, matrix=False):
     """
     Align given core genome families
 
@@ -92,6 +101,31 @@ def main(cmd, corepers, list_genomes, dname, dbpath, outdir, prot_ali, threads,
 
     quiet : bool
         True if nothing must be sent to stdout/stderr, False otherwise
+    btr_awk : bool
+        True to back-translate protein alignments with the awk script, False to use the
+        python back-translation (default)
+    dedup : bool
+        True to align only 1 copy of identical proteins of a family
+    compact : bool
+        True to keep family alignments without missing genomes: gaps are only added in
+        the alignments grouped by genome, and alignments are not concatenated
+    workspace : bool
+        True to store all files of each family in a single container file, once it is aligned
+    write_lists : bool
+        True to write, for each genome, the lists of proteins and genes to extract in
+        ``List-<dname>``. False to keep them in memory
+    patterns : str or None
+        "all" to also write the site patterns of the final nucleic alignment, with their
+        weights, "variable" to write only its variable site patterns. None by default.
+    trim : float or None
+        If given, remove from each family alignment the codons which are gaps in more than
+        this fraction of the genomes, before grouping alignments by genome. None by default.
+    mode_thresholds : dict or None
+        None to align all families with ``mafft --auto``. Otherwise, the mafft mode of each
+        family is chosen from its size, with those thresholds (see
+        ``alignment.MODE_THRESHOLDS``: {} to use the default ones)
+    matrix : bool
+        True to also save the alignments grouped by genome as binary uint8 matrices
     """
     # import needed packages
     import logging
@@ -101,6 +135,7 @@ def main(cmd, corepers, list_genomes, dname, dbpath, outdir, prot_ali, threads,
     from PanACoTA.align_module import get_seqs as gseqs
     from PanACoTA.align_module import alignment as ali
     from PanACoTA.align_module import post_align as post
+    from PanACoTA.align_module import trimming as trimg
     from PanACoTA import __version__ as version
 
     # test if prokka is installed and in the path
@@ -129,22 +164,41 @@ def main(cmd, corepers, list_genomes, dname, dbpath, outdir, prot_ali, threads,
     logger.info(f'PanACoTA version {version}')
     logger.info("Command used\n \t > " + cmd)
 
-    all_genomes, aldir, listdir, fam_nums = p2g.get_per_genome(corepers, list_genomes,
-                                                               dname, outdir)
+    all_genomes, aldir, listdir, fam_nums, plan = p2g.get_per_genome(corepers, list_genomes,
+                                                                     dname, outdir,
+                                                                     write_lists=write_lists,
+                                                                     workspace=workspace,
+                                                                     compact=compact)
     # generate required files
-    gseqs.get_all_seqs(all_genomes, dname, dbpath, listdir, aldir, fam_nums, quiet)
+    gseqs.get_all_seqs(all_genomes, dname, dbpath, listdir, aldir, fam_nums, quiet, threads,
+                       workspace=workspace, compact=compact, plan=plan)
     prefix = os.path.join(aldir, dname)
 
     # Align all families
-    status = ali.align_all_families(prefix, fam_nums, len(all_genomes), dname, quiet, threads)
+    options = {"btr_awk": btr_awk, "dedup": dedup, "compact": compact, "workspace": workspace,
+               "mode_thresholds": mode_thresholds}
+    status = ali.align_all_families(prefix, fam_nums, len(all_genomes), dname, quiet, threads,
+                                    options=options)
     if not status:
         logger.error(("At least one alignment did not run well. See detailed log file for "
                       "more information. Program will stop here, alignments won't be "
                       "grouped by genome."))
         sys.exit(1)
 
+    # Remove codons with too many gaps from family alignments
+    if trim is not None:
+        status = trimg.trim_all_families(prefix, fam_nums, len(all_genomes), dname, trim, quiet,
+                                         threads, workspace=workspace)
+        if not status:
+            logger.error("At least one alignment could not be trimmed. See detailed log file "
+                         "for more information. Program will stop here, alignments won't be "
+                         "grouped by genome.")
+            sys.exit(1)
+
     # post-process alignment files
-    align_file = post.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, prot_ali, quiet)
+    align_file = post.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, prot_ali, quiet,
+                                     compact=compact, workspace=workspace, patterns=patterns,
+                                     trimmed=trim is not None, matrix=matrix)
     logger.info("END")
     return align_file
 
@@ -201,6 +255,71 @@ def build_parser(parser):
                           help=("Add this option if you also need the aa alignment of the concatenation of "
                                 "all persistent proteins. "
                                 "By default, PanACoTA only gives the nucleic alignment."))
+    optional.add_argument("--btr_awk", dest="btr_awk", default=False, action="store_true",
+                          help=("Add this option if you want to back-translate protein "
+                                "alignments to nucleotides with the awk script used by previous "
+                                "versions of PanACoTA (1 awk process per family). By default, "
+                                "back-translation is done by PanACoTA itself."))
+    optional.add_argument("--dedup", dest="dedup", default=False, action="store_true",
+                          help=("Add this option if you want to align only 1 copy of "
+                                "identical proteins in each family. Their aligned sequence "
+                                "is then copied for all their duplicates. It is much faster "
+                                "for datasets of very close genomes."))
+    optional.add_argument("--compact", dest="compact", default=False, action="store_true",
+                          help=("Add this option if you do not want to add missing genomes "
+                                "as sequences of gaps in each family alignment. They are "
+                                "only added in the final alignment grouped by genome, and "
+                                "family alignments are not concatenated. It saves a lot of "
+                                "disk space when many genomes are missing in families."))
+    optional.add_argument("--workspace", dest="workspace", default=False, action="store_true",
+                          help=("Add this option if you want to store all files of a family "
+                                "(extracted sequences, alignments) in a single container file "
+                                "once it is aligned, instead of keeping 6 files per family "
+                                "in the Align folder. Families already stored are not "
+                                "aligned again if you rerun the same command."))
+    optional.add_argument("--no_lists", dest="no_lists", default=False, action="store_true",
+                          help=("Add this option if you do not want to write, for each "
+                                "genome, the lists of proteins and genes to extract in "
+                                "'List-<dataset_name>'. They are kept in memory and directly "
+                                "used to extract sequences."))
+    optional.add_argument("--site_patterns", dest="patterns", choices=["all", "variable"],
+                          help=("Add this option if you also want the final nucleic alignment "
+                                "compressed into its site patterns: each distinct column is "
+                                "written only once, and its weight (number of columns "
+                                "with this pattern) is written to a weights file. With "
+                                "'variable', only variable site patterns are kept."))
+    optional.add_argument("--trim", dest="trim", type=utils_argparse.gap_fraction,
+                          help=("Add this option, with a value in [0, 1], if you want to "
+                                "remove from each family alignment the codons which are gaps "
+                                "in more than this fraction of the genomes, before grouping "
+                                "alignments by genome (genomes missing in a family count as "
+                                "gaps). Trimmed alignments are written in "
+                                "'<dataset_name>-trim-prt2nuc.<fam>.aln' and "
+                                "'<dataset_name>-trim-align.<fam>.aln'."))
+    optional.add_argument("--mafft_mode", dest="mafft_mode", choices=["auto", "adaptive"],
+                          default="auto",
+                          help=("Choose how mafft aligns each family. 'auto' (default) runs "
+                                "'mafft --auto' for all families. 'adaptive' chooses the mode "
+                                "of each family from its size: L-INS-i (accurate) for small "
+                                "families, PartTree (fast) for huge ones, and FFT-NS-2 for "
+                                "the others. The mode chosen for each family is written in "
+                                "'<dataset_name>-mafft-modes.tsv'."))
+    optional.add_argument("--linsi_max_seqs", dest="linsi_max_seqs", type=int,
+                          help=("With '--mafft_mode adaptive', max number of sequences of a "
+                                "family aligned with L-INS-i. Default: 200"))
+    optional.add_argument("--linsi_max_len", dest="linsi_max_len", type=int,
+                          help=("With '--mafft_mode adaptive', max length (aa) of the "
+                                "proteins of a family aligned with L-INS-i. Default: 2000"))
+    optional.add_argument("--parttree_min_seqs", dest="parttree_min_seqs", type=int,
+                          help=("With '--mafft_mode adaptive', min number of sequences of a "
+                                "family aligned with PartTree. Default: 10000"))
+    optional.add_argument("--matrix", dest="matrix", default=False, action="store_true",
+                          help=("Add this option if you also want the alignments grouped by "
+                                "genome saved as binary matrices ('<dataset_name>.nucl.grp.npy', "
+                                "uint8, 1 row per genome), with the genome of each row "
+                                "('.rows' file) and the columns of each family "
+                                "('.partitions' file). They can be memory-mapped with numpy "
+                                "to read rows or columns without parsing the fasta file."))
     helper = parser.add_argument_group('Others')
     helper.add_argument("-v", "--verbose", dest="verbose", action="count", default=0,
                         help="Increase verbosity in stdout/stderr.")
@@ -144,12 +144,14 @@ def main(cmd, pangenome, tol, multi, mixed, outputdir, lstinfo_file, floor, verb
     logger.info(get_info(tol, multi, mixed, floor))
 
     # Read pangenome
-    fams_by_strain, families, all_strains = utilsp.read_pangenome(pangenome, logger)
-    # If list of genomes given, get subset of previous dicts, including only the genomes aksed
+    model = utilsp.open_pan_model(pangenome, logger)
+    # If list of genomes given, only consider members from the genomes asked
+    list_genomes = None
     if lstinfo_file:
-        fams_by_strain, families, all_strains = pers.get_subset_genomes(fams_by_strain, families, lstinfo_file)
+        logger.info(f"Getting subset of pangenome for genomes in {lstinfo_file}.")
+        list_genomes = utilsp.read_lstinfo(lstinfo_file, logger)
     # Generate persistent genome
-    fams = pers.get_pers(fams_by_strain, families, len(all_strains), tol, multi, mixed, floor)
+    fams = pers.get_pers_model(model, tol, multi, mixed, floor, list_genomes)
     # Write persistent genome to file
     pers.write_persistent(fams, outputfile)
     logger.info("Persistent genome step done.")
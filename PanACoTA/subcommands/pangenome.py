@@ -57,19 +57,29 @@ def main_from_parse(args):
     cmd = "PanACoTA " + ' '.join(args.argv)
     main(cmd, args.lstinfo_file, args.dataset_name, args.dbpath, args.min_id, args.outdir,
          args.clust_mode, args.spedir, args.threads, args.outfile, args.verbose,
-         args.quiet)
+         args.quiet, dedup=args.dedup, no_bank=args.no_bank, matrix=args.matrix,
+         update=args.update, assign=args.assign, sweep=args.sweep)
 
 
 def main(cmd, lstinfo, name, dbpath, min_id, outdir, clust_mode, spe_dir, threads, outfile=None,
-         verbose=0, quiet=False):
+         verbose=0, quiet=False, dedup=False, no_bank=False, matrix=False, update=None,
+         assign=None, sweep=None):
     """
     Main method, doing all steps:
 
-    - concatenate all protein files
-    - create database as ffindex
+    - concatenate all protein files (except if no_bank)
+    - if asked, keep only 1 copy of identical proteins
+    - create database as ffindex (directly from all protein files if no_bank)
     - cluster all proteins
     - convert to pangenome file
-    - creating summary and matrix of pangenome
+    - creating summary and matrix of pangenome (also in binary format if matrix)
+
+    If update is given, the new genomes are added to an existing pangenome instead (see
+    ``mmseqs_functions.run_update_pangenome``).
+    If assign is given, the proteins of the genomes are only assigned to the families of an
+    existing pangenome (see ``assign_functions.run_assign``).
+    If sweep is given, 1 pangenome is built for each of its identities, instead of min_id
+    (see ``mmseqs_functions.run_sweep_pangenome``).
 
     Parameters
     ----------
@@ -102,6 +112,31 @@ def main(cmd, lstinfo, name, dbpath, min_id, outdir, clust_mode, spe_dir, thread
         - >=15: Add DEBUG in stdout
     quiet : bool
         True if nothing must be sent to stdout/stderr, False otherwise
+    dedup : bool
+        True to cluster only 1 copy of identical proteins (duplicates are added back to
+        their family)
+    no_bank : bool
+        True to write the mmseqs database directly from the protein files of all genomes,
+        without concatenating them into a bank
+    matrix : bool
+        True to also save the qualitative and quantitative matrices in binary format
+    update : tuple or None
+        (pangenome, mmseqs_db, clust_db) to add the genomes of lstinfo which are not in this
+        existing pangenome, from the mmseqs database and clustering of this pangenome.
+        None to build the pangenome from scratch.
+    assign : tuple or None
+        (pangenome, mmseqs_db, clust_db) to assign the proteins of the genomes of lstinfo to
+        the families of this existing pangenome, without building a new pangenome.
+        None otherwise.
+    sweep : list or None
+        minimum percentages of identity for which a pangenome must be built, from the same
+        mmseqs database. None to only build the pangenome of min_id.
+
+    Returns
+    -------
+    str or list
+        pangenome file, directory containing the assignments of each genome if assign, or
+        list of pangenome files (from the highest to the lowest identity) if sweep
     """
     # import needed packages
     import logging
@@ -109,6 +144,7 @@ def main(cmd, lstinfo, name, dbpath, min_id, outdir, clust_mode, spe_dir, thread
     from PanACoTA.pangenome_module import protein_seq_functions as protf
     from PanACoTA.pangenome_module import mmseqs_functions as mmf
     from PanACoTA.pangenome_module import post_treatment as pt
+    from PanACoTA.pangenome_module import assign_functions as af
     from PanACoTA import __version__ as version
 
     # test if mmseqs is installed and in the path
@@ -134,13 +170,40 @@ def main(cmd, lstinfo, name, dbpath, min_id, outdir, clust_mode, spe_dir, thread
     logger.info(f'PanACoTA version {version}')
     logger.info("Command used\n \t > " + cmd)
 
-    # Build bank with all proteins to include in the pangenome
-    prt_path = protf.build_prt_bank(lstinfo, dbpath, name, spe_dir, quiet)
-    # Do pangenome
-    families, panfile = mmf.run_all_pangenome(min_id, clust_mode, outdir,
-                                              prt_path, threads, outfile, quiet)
+    if assign:
+        # Only assign proteins of new genomes to existing families
+        assigndir = af.run_assign(assign, lstinfo, dbpath, min_id, outdir, name, threads)
+        logger.info("DONE")
+        return assigndir
+    if update:
+        # Add new genomes to an existing pangenome
+        prt_path = protf.bank_name(dbpath, name, spe_dir)
+        families, panfile = mmf.run_update_pangenome(update, lstinfo, dbpath, min_id, clust_mode,
+                                                     outdir, prt_path, threads, outfile, quiet)
+    else:
+        # Build bank with all proteins to include in the pangenome
+        # (or only list protein files if the database is directly written from them)
+        prt_files = None
+        if no_bank:
+            prt_path = protf.bank_name(dbpath, name, spe_dir)
+            prt_files = protf.genome_prt_files(lstinfo, dbpath)
+        else:
+            prt_path = protf.build_prt_bank(lstinfo, dbpath, name, spe_dir, quiet)
+        if sweep:
+            # Do all pangenomes, from the same database
+            pangenomes = mmf.run_sweep_pangenome(sweep, clust_mode, outdir, prt_path, threads,
+                                                 quiet, prt_files=prt_files)
+            for panfile in pangenomes:
+                pt.post_treat(None, panfile, matrix)
+            logger.info("DONE")
+            return pangenomes
+        # Do pangenome. Families are only written to the pangenome file, not kept in memory:
+        # post-treatment reads them back from this file
+        families, panfile = mmf.run_all_pangenome(min_id, clust_mode, outdir,
+                                                  prt_path, threads, outfile, quiet, dedup=dedup,
+                                                  prt_files=prt_files, keep_families=False)
     # Create matrix pan_quali, pan_quanti and summary file
-    pt.post_treat(families, panfile)
+    pt.post_treat(families, panfile, matrix)
     logger.info("DONE")
     return panfile
 
@@ -202,6 +265,57 @@ def build_parser(parser):
                                 "Indicate on how many threads you want to parallelize. "
                                 "By default, it uses 1 thread. Put 0 if you want to use "
                                 "all threads of your computer."))
+    optional.add_argument("--dedup", dest="dedup", default=False, action="store_true",
+                          help=("Add this option if you want mmseqs to cluster only 1 copy "
+                                "of identical proteins. Their duplicates are then added to "
+                                "their family, so that the pangenome contains the same "
+                                "families, while clustering is faster when many "
+                                "proteins are identical."))
+    optional.add_argument("--no_bank", dest="no_bank", default=False, action="store_true",
+                          help=("Add this option if you do not want to concatenate all "
+                                "proteins into <dataset_name>.All.prt: the mmseqs database "
+                                "is directly written from the protein files of all genomes "
+                                "(in parallel with --threads). Cannot be used with --dedup."))
+    optional.add_argument("--matrix", dest="matrix", default=False, action="store_true",
+                          help=("Add this option if you want to also save the qualitative "
+                                "and quantitative matrices in binary format: scipy sparse "
+                                "matrices (.npz), bit-packed presence/absence matrix (.npy), "
+                                "and the genome and family of each line and column. They can "
+                                "be loaded without parsing the csv files."))
+    optional.add_argument("--update", dest="update", nargs=3,
+                          metavar=("PANGENOME", "MMSEQS_DB", "CLUST_DB"),
+                          help=("Add this option if you want to add new genomes to an "
+                                "existing pangenome, instead of clustering all proteins again. "
+                                "Give the existing pangenome file, and the mmseqs database "
+                                "and clustering from which it was built (in the tmp folder of "
+                                "the previous run). Genomes of -l which are not in the existing "
+                                "pangenome are added: existing families keep their number, "
+                                "and new families are numbered after them. Cannot be used "
+                                "with --dedup."))
+    optional.add_argument("--assign", dest="assign", nargs=3,
+                          metavar=("PANGENOME", "MMSEQS_DB", "CLUST_DB"),
+                          help=("Add this option if you only want to assign the proteins "
+                                "of the genomes of -l to the families of an existing "
+                                "pangenome, without building a new pangenome. Give the "
+                                "existing pangenome file, and the mmseqs database and "
+                                "clustering from which it was built. Proteins are searched "
+                                "against 1 representative per family (database saved in "
+                                "the tmp folder, and reused by next runs), with -i as minimum "
+                                "identity. The family of each protein, and the proteins "
+                                "without family, are written for each genome in "
+                                "<outdir>/Assign-<dataset_name>. Cannot be used with "
+                                "--update or --dedup."))
+    optional.add_argument("--sweep", dest="sweep", nargs="+", type=utils_argparse.perc_id,
+                          metavar="MIN_ID",
+                          help=("Add this option, followed by several minimum identities "
+                                "(floats between 0 and 1), if you want to build 1 pangenome "
+                                "for each of them instead of only for -i. The mmseqs database "
+                                "is created once, proteins are clustered with the highest "
+                                "identity, and each next identity only clusters the "
+                                "representatives of the previous one: families are nested, "
+                                "from the highest to the lowest identity. All pangenomes "
+                                "(and their matrices) get their default name. Cannot be used "
+                                "with -f, --update, --assign or --dedup."))
 
     helper = parser.add_argument_group('Others')
     helper.add_argument("-v", "--verbose", dest="verbose", action="count", default=0,
@@ -231,6 +345,18 @@ def parse(parser, argu):
         with error message if error occurs with arguments given.
     """
     args = parser.parse_args(argu)
+    if args.dedup and args.no_bank:
+        parser.error("--dedup needs the bank of all proteins: it cannot be used with "
+                     "--no_bank.")
+    if args.dedup and args.update:
+        parser.error("--dedup cannot be used with --update: new proteins are assigned to "
+                     "the clusters of all proteins.")
+    if args.assign and (args.update or args.dedup):
+        parser.error("--assign cannot be used with --update or --dedup: proteins are only "
+                     "assigned to the existing families.")
+    if args.sweep and (args.outfile or args.update or args.assign or args.dedup):
+        parser.error("--sweep builds 1 pangenome per identity: it cannot be used with -f, "
+                     "--update, --assign or --dedup.")
     return args
 
 
@@ -44,6 +44,7 @@ April 2017
 import os
 import sys
 import re
+import errno
 import glob
 import subprocess
 import shutil
@@ -924,8 +925,8 @@ def cat(list_files, output, title=None):
     Equivalent of 'cat' unix command.
 
     Concatenate all files in 'list_files' and save result in 'output' folder.
-    Concat using shutil.copyfileobj, in order to copy by chunks, to
-    avoid memory problems if files are big.
+    Files are copied as bytes, by the kernel when possible, without going through
+    python (see ``copy_file``).
 
     Parameters
     ----------
@@ -947,17 +948,81 @@ def cat(list_files, output, title=None):
                    progressbar.Percentage(), ") - ", progressbar.Timer()]
         bar = progressbar.ProgressBar(widgets=widgets, max_value=nbfiles, term_width=79).start()
         curnum = 1
-    with open(output, "w") as outf:
+    with open(output, "wb") as outf:
         for file in list_files:
             if title:
                 bar.update(curnum)
                 curnum += 1
-            with open(file, "r") as inf:
-                shutil.copyfileobj(inf, outf)
+            with open(file, "rb") as inf:
+                copy_file(inf, outf)
     if title:
         bar.finish()
 
 
+# Size of the buffer used to copy files when the kernel cannot copy them
+COPY_BUFFER = 1 << 20
+# Errors meaning that the kernel cannot copy between those 2 files with this method
+COPY_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF, errno.EPERM,
+                    errno.ENOTSUP, errno.EOPNOTSUPP, errno.ETXTBSY}
+
+
+def copy_file(inf, outf, offset=0, count=None):
+    """
+    Copy bytes of 'inf' at the end of 'outf'.
+
+    The copy is done by the kernel (os.copy_file_range, or os.sendfile) when it is
+    available for those files, so that the bytes do not go through python. Otherwise,
+    the copy is done by chunks of COPY_BUFFER bytes.
+
+    Parameters
+    ----------
+    inf : io.BufferedReader
+        file open to read bytes
+    outf : io.BufferedWriter
+        file open to write bytes
+    offset : int
+        position of the first byte to copy from inf
+    count : int or None
+        number of bytes to copy. None to copy until the end of inf
+    """
+    infd = inf.fileno()
+    outfd = outf.fileno()
+    if count is None:
+        count = max(0, os.fstat(infd).st_size - offset)
+    outf.flush()
+    copied = 0
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(lambda size: os.copy_file_range(infd, outfd, size, offset + copied))
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        methods.append(lambda size: os.sendfile(outfd, infd, offset + copied, size))
+    for method in methods:
+        try:
+            while copied < count:
+                sent = method(count - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as err:
+            # Kernel cannot copy those files: try next method if nothing was copied yet
+            if copied or err.errno not in COPY_UNSUPPORTED:
+                raise
+            continue
+        break
+    if copied:
+        # File position was changed by the kernel: update the one of outf
+        outf.seek(0, os.SEEK_END)
+    if copied < count:
+        inf.seek(offset + copied)
+        remaining = count - copied
+        while remaining > 0:
+            chunk = inf.read(min(remaining, COPY_BUFFER))
+            if not chunk:
+                break
+            outf.write(chunk)
+            remaining -= len(chunk)
+
+
 def grep(filein, pattern, counts=False):
     """
     Equivalent of 'grep' unix command
@@ -1030,6 +1095,92 @@ def count(filein, get="lines"):
     return num
 
 
+def fasta_index_file(fasta):
+    """
+    Get the name of the index file of the given fasta file
+
+    Parameters
+    ----------
+    fasta : str
+        path to the fasta file
+
+    Returns
+    -------
+    str
+        path to its index file: ``<fasta>.idx``
+    """
+    return fasta + ".idx"
+
+
+def index_fasta(fasta):
+    """
+    Write the index of the given fasta file, to be able to get any sequence without
+    reading the whole file.
+
+    The index file (``<fasta>.idx``) starts with a line '#<size of fasta file>', used to check
+    that the index corresponds to the current fasta file. Then, there is 1 line per sequence,
+    with 3 columns: sequence name, offset of its header in the fasta file, and size (in bytes)
+    of the whole record (header + sequence). The sequence name is the header until the first
+    space, as when extracting sequences without index (see
+    ``get_seqs.extract_sequences``): it can contain tabs. Several records can have the
+    same name.
+
+    Parameters
+    ----------
+    fasta : str
+        path to the fasta file to index
+    """
+    records = []
+    offset = 0
+    with open(fasta, "rb") as fasf:
+        for line in fasf:
+            if line[:1] == b">":
+                last_char = line.find(b" ")
+                if last_char == -1:
+                    last_char = len(line)
+                name = line[1:last_char].strip().decode()
+                records.append([name, offset, 0])
+            if records:
+                records[-1][2] += len(line)
+            offset += len(line)
+    with open(fasta_index_file(fasta), "w") as idxf:
+        idxf.write(f"#{offset}\n")
+        for name, start, size in records:
+            idxf.write(f"{name}\t{start}\t{size}\n")
+
+
+def read_fasta_index(fasta):
+    """
+    Read the index of the given fasta file, if it exists and corresponds to the current
+    fasta file.
+
+    Parameters
+    ----------
+    fasta : str
+        path to the fasta file
+
+    Returns
+    -------
+    dict or None
+        {sequence name: [(offset, size)]} with the offset and size of each record called
+        with this name, or None if there is no index for this fasta file, or if the index
+        does not correspond to it (fasta file changed since indexing)
+    """
+    idxfile = fasta_index_file(fasta)
+    if not os.path.isfile(idxfile) or os.path.getmtime(idxfile) < os.path.getmtime(fasta):
+        return None
+    index = {}
+    with open(idxfile, "r") as idxf:
+        size = idxf.readline()
+        if not size.startswith("#") or size[1:].strip() != str(os.path.getsize(fasta)):
+            return None
+        for line in idxf:
+            # Name can contain tabs: offset and size are the 2 last columns
+            name, start, length = line.rstrip("\n").rsplit("\t", 2)
+            index.setdefault(name, []).append((int(start), int(length)))
+    return index
+
+
 def check_format(info):
     """
     Check that the given information (can be the genomes name or the date) is in the right
@@ -190,6 +190,22 @@ def perc_id(param):
     return param
 
 
+def gap_fraction(param):
+    """
+    Check argument given to parameter --trim max_gaps
+    """
+    try:
+        param = float(param)
+    except Exception:
+        msg = "argument --trim: invalid float value: {}".format(param)
+        raise argparse.ArgumentTypeError(msg)
+    if param < 0 or param > 1:
+        msg = ("The maximum fraction of genomes with a gap must be in [0, 1]. "
+               "Invalid value: {}".format(param))
+        raise argparse.ArgumentTypeError(msg)
+    return param
+
+
 class Conf_all_parser(configparser.ConfigParser):
     """
     Read configfile and return arguments found, according to required type
@@ -36,16 +36,40 @@
 """
 Functions used to deal with pangenome file
 
+The pangenome is also saved, next to the pangenome file, in a compact binary model
+(``<pangenome>.bin``), which can be memory-mapped instead of parsing the text file again.
+Genome and protein names are interned into numpy arrays:
+
+- ``fam_names``: family numbers, as they are written in the pangenome file
+- ``fam_offsets``: members of family i are ``members[fam_offsets[i]:fam_offsets[i+1]]``
+- ``members``: all protein names, family after family
+- ``member_genome``: for each member, index of its genome in ``genomes``
+- ``genomes``: all genome names, sorted by species name
+
+The binary file starts with ``PAN_MAGIC``, followed by those arrays in ``.npy`` format. The
+size and modification time of the pangenome file are stored with them, so that the binary
+file is ignored (and rewritten) as soon as the pangenome file changes.
+
 @author gem
 April 2017
 """
 import logging
 import os
 import sys
+import pickle
+import numpy as np
+import scipy.sparse
 from PanACoTA import utils
 
 logger = logging.getLogger("utils.pan")
 
+# First bytes of a compact pangenome binary file (padded to 64 bytes with the arrays)
+PAN_MAGIC = b"PanACoTA-pangenome\x01\n"
+# Arrays saved in the compact pangenome binary file, in this order
+PAN_FIELDS = ["stamp", "fam_names", "fam_offsets", "members", "member_genome", "genomes"]
+# Arrays in the binary file start at a multiple of this number of bytes
+PAN_ALIGN = 64
+
 
 def read_pangenome(pangenome, logger, families=None):
     """
@@ -73,19 +97,352 @@ def read_pangenome(pangenome, logger, families=None):
     """
     if families:
         fams_by_strain, all_strains = get_fams_info(families, logger)
-        if not os.path.isfile(pangenome + ".bin"):
+        if load_pan_model(pangenome) is None:
+            logger.details("Saving all information to a binary file for later use")
+            save_pan_model(build_pan_model(families, all_strains), pangenome)
+        return fams_by_strain, families, all_strains
+    return model_to_dicts(open_pan_model(pangenome, logger))
+
+
+def open_pan_model(pangenome, logger, families=None):
+    """
+    Get the compact model of the pangenome.
+
+    If families are given, the model is built from them. Otherwise, if the binary file of the
+    pangenome is up to date, it is memory-mapped. If not, the pangenome file is read. In both
+    cases, the binary file is (re)written for later use if it is not up to date.
+
+    Parameters
+    ----------
+    pangenome : str
+        path to pangenome file
+    logger : logging.Logger
+        logger object to write log information
+    families : dict or None
+        {num: [members]} if families are given, None to read them from the binary file or
+        the pangenome file.
+
+    Returns
+    -------
+    dict
+        {field: numpy array} for all fields in PAN_FIELDS (see module documentation)
+    """
+    if families:
+        logger.info("Retrieving information from pan families")
+        model = build_pan_model(families)
+        if load_pan_model(pangenome) is None:
             logger.details("Saving all information to a binary file for later use")
-            utils.save_bin([fams_by_strain, families, all_strains], pangenome + ".bin")
-    elif os.path.isfile(pangenome + ".bin"):
+            save_pan_model(model, pangenome)
+        return model
+    model = load_pan_model(pangenome)
+    if model is not None:
+        logger.info("Retrieving info from binary file")
+        return model
+    legacy = load_legacy_bin(pangenome)
+    if legacy is not None:
         logger.info("Retrieving info from binary file")
-        fams_by_strain, families, all_strains = utils.load_bin(pangenome + ".bin")
+        _, families, all_strains = legacy
     else:
-        fams_by_strain, families, all_strains = read_pan_file(pangenome, logger)
+        _, families, all_strains = read_pan_file(pangenome, logger)
         logger.info("Saving all information to a binary file for later use")
-        utils.save_bin([fams_by_strain, families, all_strains], pangenome + ".bin")
+    model = build_pan_model(families, all_strains)
+    save_pan_model(model, pangenome)
+    return model
+
+
+def build_pan_model(families, all_strains=None):
+    """
+    Intern all genome and protein names of the pangenome into numpy arrays
+
+    Parameters
+    ----------
+    families : dict
+        {fam_num: [all members]}
+    all_strains : list or None
+        all genome names, sorted by species name. If None, they are found from the members.
+
+    Returns
+    -------
+    dict
+        {field: numpy array} for all fields in PAN_FIELDS (see module documentation)
+    """
+    sizes = [len(members) for members in families.values()]
+    strains = [gene_strain(member) for fam in families.values() for member in fam]
+    if all_strains is None:
+        all_strains = sorted(set(strains), key=utils.sort_genomes_by_name)
+    genome_index = {genome: num for num, genome in enumerate(all_strains)}
+    fam_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=fam_offsets[1:])
+    return {"stamp": np.zeros(2, dtype=np.int64),
+            "fam_names": names_to_array(families),
+            "fam_offsets": fam_offsets,
+            "members": names_to_array(member for fam in families.values() for member in fam),
+            "member_genome": np.fromiter((genome_index[strain] for strain in strains),
+                                         dtype=np.int32, count=len(strains)),
+            "genomes": names_to_array(all_strains)}
+
+
+def names_to_array(names):
+    """
+    Convert names to a numpy array of fixed-size byte strings
+
+    Parameters
+    ----------
+    names : iterable
+        names (str or int) to convert
+
+    Returns
+    -------
+    numpy.ndarray
+        array of dtype 'S<longest name>'
+    """
+    return np.array([str(name).encode() for name in names], dtype=bytes)
+
+
+def array_to_names(array):
+    """
+    Convert an array of byte strings (see ``names_to_array``) back to a list of str
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        array of byte strings
+
+    Returns
+    -------
+    list
+        list of names
+    """
+    return [name.decode() for name in array.tolist()]
+
+
+def model_to_dicts(model):
+    """
+    Get the python objects corresponding to a compact pangenome model
+
+    Parameters
+    ----------
+    model : dict
+        {field: numpy array} (see ``build_pan_model``)
+
+    Returns
+    -------
+    (fams_by_strain, families, all_strains) : tuple
+        with:
+
+        - fams_by_strain: {fam_num: {strain: [members]}}
+        - families: {fam_num: [all members]}
+        - all_strains: list of all genome names
+    """
+    all_strains = array_to_names(model["genomes"])
+    members = array_to_names(model["members"])
+    member_genome = model["member_genome"].tolist()
+    offsets = model["fam_offsets"].tolist()
+    fams_by_strain = {}
+    families = {}
+    for num, fam_num in enumerate(array_to_names(model["fam_names"])):
+        start, end = offsets[num], offsets[num + 1]
+        families[fam_num] = members[start:end]
+        by_strain = {}
+        for member, genome in zip(members[start:end], member_genome[start:end]):
+            by_strain.setdefault(all_strains[genome], []).append(member)
+        fams_by_strain[fam_num] = by_strain
     return fams_by_strain, families, all_strains
 
 
+def source_stamp(pangenome):
+    """
+    Get the size and modification time (in ns) of the pangenome file, used to know if its
+    binary file is up to date. (-1, -1) if the pangenome file does not exist.
+
+    Parameters
+    ----------
+    pangenome : str
+        path to pangenome file
+
+    Returns
+    -------
+    numpy.ndarray
+        [size, mtime_ns]
+    """
+    try:
+        stat = os.stat(pangenome)
+    except OSError:
+        return np.array([-1, -1], dtype=np.int64)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def save_pan_model(model, pangenome):
+    """
+    Save the compact model of the pangenome to ``<pangenome>.bin``, stamped with the current
+    size and modification time of the pangenome file.
+
+    The binary file is written to a temporary file first, so that a killed run never leaves
+    a truncated binary file.
+
+    Parameters
+    ----------
+    model : dict
+        {field: numpy array} (see ``build_pan_model``)
+    pangenome : str
+        path to pangenome file
+    """
+    binfile = pangenome + ".bin"
+    model["stamp"] = source_stamp(pangenome)
+    with open(binfile + ".tmp", "wb") as binf:
+        binf.write(PAN_MAGIC.ljust(PAN_ALIGN, b"\0"))
+        for field in PAN_FIELDS:
+            np.lib.format.write_array(binf, np.ascontiguousarray(model[field]),
+                                      allow_pickle=False)
+            binf.write(b"\0" * (-binf.tell() % PAN_ALIGN))
+    os.replace(binfile + ".tmp", binfile)
+
+
+def load_pan_model(pangenome):
+    """
+    Memory-map the compact model of the pangenome saved in ``<pangenome>.bin``
+
+    Parameters
+    ----------
+    pangenome : str
+        path to pangenome file
+
+    Returns
+    -------
+    dict or None
+        {field: numpy array} (see ``build_pan_model``). None if there is no binary file, if it
+        is not a compact pangenome model, or if the pangenome file changed since it was saved.
+    """
+    binfile = pangenome + ".bin"
+    if not os.path.isfile(binfile):
+        return None
+    model = {}
+    with open(binfile, "rb") as binf:
+        if binf.read(PAN_ALIGN).rstrip(b"\0") != PAN_MAGIC:
+            return None
+        try:
+            for field in PAN_FIELDS:
+                if np.lib.format.read_magic(binf) == (1, 0):
+                    shape, fortran, dtype = np.lib.format.read_array_header_1_0(binf)
+                else:
+                    shape, fortran, dtype = np.lib.format.read_array_header_2_0(binf)
+                start = binf.tell()
+                nbytes = int(np.prod(shape)) * dtype.itemsize
+                if nbytes == 0:
+                    model[field] = np.empty(shape, dtype=dtype)
+                else:
+                    model[field] = np.memmap(binf, dtype=dtype, mode="r", shape=shape,
+                                             offset=start, order="F" if fortran else "C")
+                binf.seek(start + nbytes + (-(start + nbytes) % PAN_ALIGN))
+        except ValueError:
+            return None
+    if not np.array_equal(model["stamp"], source_stamp(pangenome)):
+        return None
+    return model
+
+
+def load_legacy_bin(pangenome):
+    """
+    Read the binary file of a pangenome saved by previous versions (pickled python objects)
+
+    As those files do not say from which version of the pangenome file they were saved, they
+    are only used if they are not older than the pangenome file.
+
+    Parameters
+    ----------
+    pangenome : str
+        path to pangenome file
+
+    Returns
+    -------
+    tuple or None
+        (fams_by_strain, families, all_strains) (see ``read_pangenome``), or None if
+        there is no such binary file
+    """
+    binfile = pangenome + ".bin"
+    if not os.path.isfile(binfile):
+        return None
+    if os.path.isfile(pangenome) and os.path.getmtime(binfile) < os.path.getmtime(pangenome):
+        return None
+    try:
+        return utils.load_bin(binfile)
+    except (pickle.UnpicklingError, EOFError, ValueError):
+        return None
+
+
+def family_genome_counts(model, genome_mask=None):
+    """
+    Count the members of each genome in each family of the pangenome model.
+
+    Only (family, genome) pairs with at least 1 member are returned (sparse matrix in
+    coordinate format), sorted by family then genome.
+
+    Parameters
+    ----------
+    model : dict
+        {field: numpy array} (see ``build_pan_model``)
+    genome_mask : numpy.ndarray or None
+        boolean array, True for genomes (same order as model["genomes"]) which must be
+        considered. None to consider all genomes
+
+    Returns
+    -------
+    (fams, genomes, counts) : tuple
+        3 arrays with, for each (family, genome) pair, the family index, the genome index and
+        the number of members of this genome in this family
+    """
+    ngenomes = max(len(model["genomes"]), 1)
+    fam_index = np.repeat(np.arange(len(model["fam_names"]), dtype=np.int64),
+                          np.diff(model["fam_offsets"]))
+    member_genome = np.asarray(model["member_genome"])
+    keys = fam_index * ngenomes + member_genome
+    if genome_mask is not None:
+        keys = keys[genome_mask[member_genome]]
+    pairs, counts = np.unique(keys, return_counts=True)
+    return pairs // ngenomes, pairs % ngenomes, counts
+
+
+def load_pan_matrices(pangenome, unpack=False):
+    """
+    Load the qualitative and quantitative matrices of a pangenome saved in binary format
+    (``PanACoTA pangenome --matrix``, see ``post_treatment.write_binary_matrices``)
+
+    By default, the qualitative matrix is returned bit-packed and memory-mapped: only the
+    lines used are read from disk. The presence/absence of the families in line i is
+    ``numpy.unpackbits(quali[i], count=len(fam_nums)).astype(bool)``.
+
+    Parameters
+    ----------
+    pangenome : str
+        path to pangenome file
+    unpack : bool
+        True to load the whole qualitative matrix in memory, as a bool matrix
+
+    Returns
+    -------
+    (quali, quanti, genomes, fam_nums) : tuple
+        with:
+
+        - quali: numpy.memmap of uint8, 1 line per genome, and the bits of each family
+          packed on the line (``numpy.packbits``). If unpack, numpy.ndarray of bool,
+          1 line per genome and 1 column per family. True (bit 1) if the genome has at
+          least 1 member in the family
+        - quanti: scipy.sparse.csr_matrix, 1 line per genome and 1 column per family, number
+          of members of the genome in the family
+        - genomes: list of genome names, in the order of lines
+        - fam_nums: list of family numbers, in the order of columns
+    """
+    with open(pangenome + ".genomes", "r") as genf:
+        genomes = [line.rstrip("\n") for line in genf]
+    with open(pangenome + ".families", "r") as famf:
+        fam_nums = [line.rstrip("\n") for line in famf]
+    quali = np.load(pangenome + ".quali.npy", mmap_mode="r")
+    if unpack:
+        quali = np.unpackbits(quali, axis=1, count=len(fam_nums)).astype(bool)
+    quanti = scipy.sparse.load_npz(pangenome + ".quanti.npz").tocsr()
+    return quali, quanti, genomes, fam_nums
+
+
 def get_fams_info(families, logger):
     """
     From all families as list of members, get more information:
@@ -176,12 +533,7 @@ def read_gene(gene, num, fams_by_strain, all_strains):
         set of all strains
 
     """
-    # if format is ESCO.1512.00001.i001_12313 genome name is ESCO.1512.00001
-    if "." in gene and len(gene.split(".")) >= 3:
-        strain = ".".join(gene.split("_")[0].split(".")[:3])
-    # otherwise, genename is everything before the last "_"
-    else:
-        strain = "_".join(gene.split("_")[:-1])
+    strain = gene_strain(gene)
     if strain in fams_by_strain[num]:
         fams_by_strain[num][strain].append(gene)
     else:
@@ -190,6 +542,27 @@ def read_gene(gene, num, fams_by_strain, all_strains):
         all_strains.add(strain)
 
 
+def gene_strain(gene):
+    """
+    Get the name of the genome from which the given gene is
+
+    Parameters
+    ----------
+    gene : str
+        gene name (species.date.strain.contig_number
+
+    Returns
+    -------
+    str
+        genome name
+    """
+    # if format is ESCO.1512.00001.i001_12313 genome name is ESCO.1512.00001
+    if "." in gene and len(gene.split(".")) >= 3:
+        return ".".join(gene.split("_")[0].split(".")[:3])
+    # otherwise, genename is everything before the last "_"
+    return "_".join(gene.split("_")[:-1])
+
+
 def read_lstinfo(lstinfo, logger):
     """
     Read lstinfo file and return list of genomes
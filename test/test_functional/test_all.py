@@ -164,12 +164,14 @@ def test_main_norefseq():
     rep_fold = os.path.join(annot_dir, "Replicons")
     gff_fold = os.path.join(annot_dir, "gff3")
     lstinfo_fold = os.path.join(annot_dir, "LSTINFO")
-    for d in (gen_fold, rep_fold, gff_fold, lstinfo_fold):
+    for d in (rep_fold, gff_fold, lstinfo_fold):
         assert os.path.isdir(d)
         files = os.listdir(d)
         assert len(files) == 4
+    assert os.path.isdir(gen_fold)
+    assert len(os.listdir(gen_fold)) == 8  # 4 genomes + their index
     assert os.path.isdir(prot_fold)
-    assert len(os.listdir(prot_fold)) == 5  # 4 genomes + concatenated DB
+    assert len(os.listdir(prot_fold)) == 9  # 4 genomes + their index + concatenated DB
     # CHECK PAN
     assert(len(glob.glob(os.path.join(pan_dir, "PanACoTA*log*")))) == 3
     assert(len(glob.glob(os.path.join(pan_dir, "PanGenome-TEST*")))) == 5
@@ -281,12 +283,14 @@ def test_main_from_parse():
     rep_fold = os.path.join(annot_dir, "Replicons")
     gff_fold = os.path.join(annot_dir, "gff3")
     lstinfo_fold = os.path.join(annot_dir, "LSTINFO")
-    for d in (gen_fold, rep_fold, gff_fold, lstinfo_fold):
+    for d in (rep_fold, gff_fold, lstinfo_fold):
         assert os.path.isdir(d)
         files = os.listdir(d)
         assert len(files) == 4
+    assert os.path.isdir(gen_fold)
+    assert len(os.listdir(gen_fold)) == 8  # 4 genomes + their index
     assert os.path.isdir(prot_fold)
-    assert len(os.listdir(prot_fold)) == 5  # 4 genomes + concatenated DB
+    assert len(os.listdir(prot_fold)) == 9  # 4 genomes + their index + concatenated DB
     # CHECK PAN
     assert(len(glob.glob(os.path.join(pan_dir, "PanACoTA*log*")))) == 4
     assert(len(glob.glob(os.path.join(pan_dir, "PanGenome-TEST*")))) == 5
@@ -274,7 +274,7 @@ def test_main_existresdirforce(capsys):
                                        "A_H738.fasta-all.fna"))
     # Test all result folders are empty (in particular Proteins) as no genome is annotated
     assert os.path.isdir(protdir)
-    assert len(os.listdir(protdir)) == 4
+    assert len(os.listdir(protdir)) == 8  # 4 genomes + their index
     assert not os.path.isfile(os.path.join(protdir, "toto.prt"))
     assert os.path.isfile(os.path.join(protdir, "ESCO.0417.00001.prt"))
     assert os.path.isfile(os.path.join(protdir, "ESCO.1015.00002.prt"))
@@ -776,7 +776,7 @@ def test_main_existing_prokkadir_errorannot():
 
     # Check that only 1 genome was formated (the other one had problems with prokka)
     prot_dir = os.path.join(GENEPATH, "Proteins")
-    assert len(os.listdir(prot_dir)) == 1
+    assert len(os.listdir(prot_dir)) == 2  # 1 genome + its index
     rep_dir = os.path.join(GENEPATH, "Replicons")
     assert len(os.listdir(rep_dir)) == 1
 
@@ -938,7 +938,7 @@ def test_main_frominfo(capsys):
 
     # Check output files present
     protdir = os.path.join(GENEPATH, "Proteins")
-    assert len(os.listdir(protdir)) == 3
+    assert len(os.listdir(protdir)) == 6  # 3 genomes + their index
     gffdir = os.path.join(GENEPATH, "gff3")
     assert len(os.listdir(gffdir)) == 3
     lstdir = os.path.join(GENEPATH, "LSTINFO")
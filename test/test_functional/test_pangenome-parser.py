@@ -124,6 +124,69 @@ def test_thread_neg(capsys):
     assert "Please provide a positive number of threads (or 0 for all threads)" in err
 
 
+def test_dedup_nobank(capsys):
+    """
+    Test that asking to cluster only distinct proteins without writing the bank of all
+    proteins returns the expected error message.
+    """
+    parser = argparse.ArgumentParser(description="Do pangenome", add_help=False)
+    pangenome.build_parser(parser)
+    with pytest.raises(SystemExit):
+        pangenome.parse(parser, "-l lstinfo -n TEST4 -d dbpath -o od --dedup --no_bank".split())
+    _, err = capsys.readouterr()
+    assert "--dedup needs the bank of all proteins: it cannot be used with --no_bank." in err
+
+
+def test_dedup_update(capsys):
+    """
+    Test that asking to cluster only distinct proteins when updating a pangenome returns the
+    expected error message.
+    """
+    parser = argparse.ArgumentParser(description="Do pangenome", add_help=False)
+    pangenome.build_parser(parser)
+    with pytest.raises(SystemExit):
+        pangenome.parse(parser, ("-l lstinfo -n TEST4 -d dbpath -o od --dedup "
+                                 "--update pan.lst msDB clust").split())
+    _, err = capsys.readouterr()
+    assert "--dedup cannot be used with --update" in err
+
+
+def test_assign_update(capsys):
+    """
+    Test that asking to both assign proteins to existing families and update a pangenome
+    returns the expected error message.
+    """
+    parser = argparse.ArgumentParser(description="Do pangenome", add_help=False)
+    pangenome.build_parser(parser)
+    with pytest.raises(SystemExit):
+        pangenome.parse(parser, ("-l lstinfo -n TEST4 -d dbpath -o od "
+                                 "--assign pan.lst msDB clust "
+                                 "--update pan.lst msDB clust").split())
+    _, err = capsys.readouterr()
+    assert "--assign cannot be used with --update or --dedup" in err
+
+
+def test_sweep_outfile(capsys):
+    """
+    Test that giving a pangenome filename when building 1 pangenome per identity returns the
+    expected error message, and that identities of the sweep are checked as -i.
+    """
+    parser = argparse.ArgumentParser(description="Do pangenome", add_help=False)
+    pangenome.build_parser(parser)
+    with pytest.raises(SystemExit):
+        pangenome.parse(parser, ("-l lstinfo -n TEST4 -d dbpath -o od -f pan.lst "
+                                 "--sweep 0.9 0.8").split())
+    _, err = capsys.readouterr()
+    assert "--sweep builds 1 pangenome per identity: it cannot be used with -f" in err
+    with pytest.raises(SystemExit):
+        pangenome.parse(parser, "-l lstinfo -n TEST4 -d dbpath -o od --sweep 0.9 1.5".split())
+    _, err = capsys.readouterr()
+    assert "The minimum %% of identity must be in [0, 1]. Invalid value: 1.5" in err
+    options = pangenome.parse(parser,
+                              "-l lstinfo -n TEST4 -d dbpath -o od --sweep 0.5 0.9".split())
+    assert options.sweep == [0.5, 0.9]
+
+
 def test_parser_default():
     """
     Test that when run with the minimum required arguments, all default values are
@@ -143,6 +206,10 @@ def test_parser_default():
     assert not options.outfile
     assert options.verbose == 0
     assert not options.quiet
+    assert not options.matrix
+    assert not options.update
+    assert not options.assign
+    assert not options.sweep
 
 
 def test_parser_all_threads():
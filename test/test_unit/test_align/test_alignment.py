@@ -10,7 +10,9 @@ import subprocess
 import pytest
 import shutil
 
+import threading
 import multiprocessing
+import multiprocessing.pool
 
 import PanACoTA.align_module.alignment as al
 import test.test_unit.utilities_for_tests as tutil
@@ -201,6 +203,93 @@ def test_backtranslate_problem(caplog):
     assert not os.path.isfile(btr_file)
 
 
+def test_backtranslate_awk(caplog):
+    """
+    Test that when asking to back-translate with the awk script, it generates the same
+    btr file as the python back-translation, and returns the number of sequences
+    """
+    caplog.set_level(logging.DEBUG)
+    num_fam = 1
+    mafft_file = os.path.join(TESTPATH, "test_alignment-mafft-ok.aln")
+    gen_file = os.path.join(EXPPATH, "exp_aldir", "current.1.gen")
+    btr_file = os.path.join(GENEPATH, "test_btr_output.aln")
+    nbfal = 4
+    logger = logging.getLogger("test_backtranslate")
+    assert al.back_translate(num_fam, mafft_file, gen_file, btr_file, nbfal, logger,
+                             use_awk=True) == 4
+    assert "Back-translating family 1" in caplog.text
+    exp_btr = os.path.join(EXPPATH, "exp_btr.1.aln")
+    assert tutil.compare_file_content(btr_file, exp_btr)
+
+
+def test_backtranslate_missing_gene(caplog):
+    """
+    Test that when a protein of the alignment does not have its gene in the gene file,
+    it returns False with an error message, and does not keep the btr file.
+    """
+    caplog.set_level(logging.DEBUG)
+    num_fam = 1
+    mafft_file = os.path.join(TESTPATH, "test_alignment-mafft-ok.aln")
+    gen_file = os.path.join(GENEPATH, "current.1.gen")
+    # Keep only the 2 first genes
+    with open(os.path.join(EXPPATH, "exp_aldir", "current.1.gen"), "r") as genf, \
+            open(gen_file, "w") as outf:
+        nb = 0
+        for line in genf:
+            if line.startswith(">"):
+                nb += 1
+            if nb <= 2:
+                outf.write(line)
+    btr_file = os.path.join(GENEPATH, "test_btr_output.aln")
+    logger = logging.getLogger("test_backtranslate")
+    assert not al.back_translate(num_fam, mafft_file, gen_file, btr_file, 4, logger)
+    assert ("fam 1: no gene found in test/data/align/generated_by_unit-tests/current.1.gen for "
+            "protein GENO.1017.00001.b0002_00003 of test/data/align/test_files/test_alignment-"
+            "mafft-ok.aln. It cannot be back-translated.") in caplog.text
+    assert not os.path.isfile(btr_file)
+
+
+def test_backtranslate_awk_missing_gene(caplog):
+    """
+    Test that when back-translating with the awk script and a protein of the alignment
+    does not have its gene in the gene file, this protein is not written in the btr file,
+    and the number of sequences of the btr file is checked, so that it returns False.
+    """
+    caplog.set_level(logging.DEBUG)
+    num_fam = 1
+    mafft_file = os.path.join(TESTPATH, "test_alignment-mafft-ok.aln")
+    gen_file = os.path.join(GENEPATH, "current.1.gen")
+    # Keep only the 2 first genes
+    with open(os.path.join(EXPPATH, "exp_aldir", "current.1.gen"), "r") as genf, \
+            open(gen_file, "w") as outf:
+        nb = 0
+        for line in genf:
+            if line.startswith(">"):
+                nb += 1
+            if nb <= 2:
+                outf.write(line)
+    btr_file = os.path.join(GENEPATH, "test_btr_output.aln")
+    logger = logging.getLogger("test_backtranslate")
+    assert not al.back_translate(num_fam, mafft_file, gen_file, btr_file, 4, logger,
+                                 use_awk=True)
+    assert ("fam 1: different number of proteins aligned in test/data/align/test_files/"
+            "test_alignment-mafft-ok.aln (4) and genes back-translated in "
+            "test/data/align/generated_by_unit-tests/test_btr_output.aln (2)") in caplog.text
+
+
+def test_read_fasta_seqs():
+    """
+    Test that reading a fasta file returns the name (first word of header) and the
+    sequence (without spaces and line breaks) of each sequence
+    """
+    fasta = os.path.join(GENEPATH, "seqs.fasta")
+    with open(fasta, "w") as ff:
+        ff.write(">seq1 info\nAC-\nGT \n\n>seq2\n>seq3 \nA\n")
+    with open(fasta, "r") as ff:
+        seqs = list(al.read_fasta_seqs(ff))
+    assert seqs == [("seq1", "AC-GT"), ("seq2", ""), ("seq3", "A")]
+
+
 def test_mafft_align(caplog):
     """
     Test that when giving a file containing extracted proteins, it aligns them as expected
@@ -219,6 +308,76 @@ def test_mafft_align(caplog):
     assert tutil.compare_file_content(mafft_file, exp_mafft)
 
 
+def test_dedup_expand():
+    """
+    Test that identical proteins are written only once, and that expanding the alignment
+    of distinct proteins gives 1 row per protein, with its full header, in the initial order
+    """
+    prt_file = os.path.join(GENEPATH, "fam.prt")
+    with open(prt_file, "w") as prtf:
+        prtf.write(">prot1 info 1\nMAC\nDE\n>prot2\nMACDE\n>prot3 info\nMKE\n>prot4\nMACDE\n")
+    uniq_file = os.path.join(GENEPATH, "fam.uniq.prt")
+    nb_uniq, members = al.dedup_proteins(prt_file, uniq_file)
+    assert nb_uniq == 2
+    assert members == [("prot1 info 1", 0), ("prot2", 0), ("prot3 info", 1), ("prot4", 0)]
+    with open(uniq_file, "r") as uf:
+        assert uf.read() == ">0\nMACDE\n>1\nMKE\n"
+    uniq_aln = os.path.join(GENEPATH, "fam.uniq.aln")
+    with open(uniq_aln, "w") as uf:
+        uf.write(">0\nMACDE\n>1\nMK--E\n")
+    mafft_file = os.path.join(GENEPATH, "fam.aln")
+    al.expand_alignment(uniq_aln, members, mafft_file)
+    with open(mafft_file, "r") as mf:
+        assert mf.read() == (">prot1 info 1\nMACDE\n>prot2\nMACDE\n>prot3 info\nMK--E\n"
+                             ">prot4\nMACDE\n")
+
+
+def test_mafft_align_dedup(caplog):
+    """
+    Test that when aligning only distinct proteins, the alignment contains all proteins
+    extracted, and temporary files are removed
+    """
+    caplog.set_level(logging.DEBUG)
+    prt_file = os.path.join(GENEPATH, "current.1.prt")
+    with open(os.path.join(EXPPATH, "exp_aldir", "current.1.prt"), "r") as inf:
+        content = inf.read()
+    # Add a copy of the first protein
+    first = content.split(">")[1]
+    with open(prt_file, "w") as prtf:
+        prtf.write(content + ">" + first.replace("GEN2.1017.00001.i0002_00004", "GEN2.copy", 1))
+    mafft_file = os.path.join(GENEPATH, "test_mafft_align.aln")
+    logger = logging.getLogger("test_mafft_align_dedup")
+    assert al.mafft_align(1, prt_file, mafft_file, 5, logger, dedup=True) == 5
+    assert "fam 1: aligning 4 distinct proteins out of 5" in caplog.text
+    with open(mafft_file, "r") as mf:
+        seqs = list(al.read_fasta_seqs(mf))
+    assert [name for name, _ in seqs][-1] == "GEN2.copy"
+    assert seqs[0][1] == seqs[-1][1]
+    assert not os.path.isfile(mafft_file + ".uniq.prt")
+    assert not os.path.isfile(mafft_file + ".uniq.aln")
+
+
+def test_check_compact(caplog):
+    """
+    Test that a compact family alignment (without missing genomes) is accepted if it
+    contains all genomes which are not missing, and rejected otherwise
+    """
+    caplog.set_level(logging.DEBUG)
+    logger = logging.getLogger("test_check_compact")
+    aln_file = os.path.join(GENEPATH, "fam.aln")
+    with open(aln_file, "w") as alnf:
+        alnf.write(">GEN1.1017.00001.i1_1\nAC-T\n>GEN2.1017.00001.i1_1\nACGT\n")
+    miss_file = os.path.join(GENEPATH, "fam.miss.lst")
+    with open(miss_file, "w") as missf:
+        missf.write("GEN3.1017.00001\n")
+    assert al.check_compact(aln_file, "protein", miss_file, 1, 3, True, logger) is True
+    assert al.check_compact(aln_file, "protein", miss_file, 1, 3, "OK", logger) == "OK"
+    assert "protein alignment already done for family 1" in caplog.text
+    assert al.check_compact(aln_file, "protein", miss_file, 1, 4, True, logger) is False
+    assert ("family 1 contains 2 genomes and 1 missing genomes instead of the 4 genomes "
+            "in input") in caplog.text
+
+
 def test_mafft_align_error(caplog):
     """
     Test that when giving a wrong file with the sequence to extract (non existing file),
@@ -603,6 +762,79 @@ def test_family_align_nomafft_btrempty_errormafft(caplog):
 
 
 
+def test_fasta_stats(monkeypatch):
+    """
+    Test that it returns the number of sequences and their lengths, and that the file is
+    read again only if it changed.
+    """
+    fasta = os.path.join(GENEPATH, "seqs.aln")
+    with open(fasta, "w") as ff:
+        ff.write(">seq1\nAC-\nGT\n>seq2\nACGTA\n")
+    read = []
+    parser = al.read_fasta_stats
+    monkeypatch.setattr(al, "read_fasta_stats", lambda fasta: read.append(fasta) or parser(fasta))
+    assert al.fasta_stats(fasta) == (2, [5, 5])
+    # Same file: result already known, not read again
+    assert al.fasta_stats(fasta) == (2, [5, 5])
+    assert read == [fasta]
+    # File changed: read it again
+    with open(fasta, "a") as ff:
+        ff.write(">seq3\n---\n")
+    assert al.fasta_stats(fasta) == (3, [5, 5, 3])
+    assert read == [fasta, fasta]
+
+
+def test_fasta_stats_replaced():
+    """
+    Test that a file replaced by another one with the same size and modification time
+    (different inode) is read again
+    """
+    fasta = os.path.join(GENEPATH, "seqs.aln")
+    other = os.path.join(GENEPATH, "seqs-other.aln")
+    with open(fasta, "w") as ff:
+        ff.write(">seq1\nACGTA\n>seq2\nACGTA\n")
+    assert al.fasta_stats(fasta) == (2, [5, 5])
+    stat = os.stat(fasta)
+    with open(other, "w") as ff:
+        ff.write(">seq1\nACGTACGTACGTACGTA\n")
+    os.utime(other, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(other, fasta)
+    assert os.path.getsize(fasta) == stat.st_size
+    assert al.fasta_stats(fasta) == (1, [17])
+
+
+def test_fasta_stats_forget():
+    """
+    Test that a file rewritten with the same size and modification time is read again once
+    the pipeline forgot it (as done before writing alignment files)
+    """
+    fasta = os.path.join(GENEPATH, "seqs.aln")
+    with open(fasta, "w") as ff:
+        ff.write(">seq1\nACGTA\n>seq2\nACGTA\n")
+    assert al.fasta_stats(fasta) == (2, [5, 5])
+    stat = os.stat(fasta)
+    with open(fasta, "w") as ff:
+        ff.write(">seq1\nACGTACGTACGTACGTA\n")
+    os.utime(fasta, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(fasta) == stat.st_size
+    # Same size and mtime: stale result
+    assert al.fasta_stats(fasta) == (2, [5, 5])
+    al.forget_parsed(fasta)
+    assert al.fasta_stats(fasta) == (1, [17])
+
+
+def test_missing_genomes():
+    """
+    Test that it returns the list of genomes in the miss file, and an empty list
+    if the miss file is empty
+    """
+    miss_file = os.path.join(EXPPATH, "exp_aldir-pers", "current.8.miss.lst")
+    assert al.missing_genomes(miss_file) == ["GENO.1017.00001"]
+    empty = os.path.join(GENEPATH, "empty.miss.lst")
+    open(empty, "w").close()
+    assert al.missing_genomes(empty) == []
+
+
 def test_check_addmissing_ok():
     """
     Test that when giving a btr file with all sequences same length, and as many sequences as
@@ -797,7 +1029,7 @@ def test_handle_family_true():
     shutil.copyfile(ref_prt, cur_prt)
     shutil.copyfile(ref_gen, cur_gen)
     shutil. copyfile(ref_miss, cur_miss)
-    args = (prefix, num_fam, ngenomes, q)
+    args = (prefix, num_fam, ngenomes, q, {})
     assert al.handle_family(args) is True
     cur_mafft = os.path.join(aldir, "TESThandlefam-mafft-align.8.aln")
     cur_btr = os.path.join(aldir, "TESThandlefam-mafft-prt2nuc.8.aln")
@@ -838,7 +1070,7 @@ def test_handle_family_true_nomiss():
     shutil.copyfile(ref_prt, cur_prt)
     shutil.copyfile(ref_gen, cur_gen)
     open(cur_miss, "w").close()
-    args = (prefix, num_fam, ngenomes, q)
+    args = (prefix, num_fam, ngenomes, q, {})
     assert al.handle_family(args)
     cur_mafft = os.path.join(aldir, "TESThandlefam-mafft-align.8.aln")
     cur_btr = os.path.join(aldir, "TESThandlefam-mafft-prt2nuc.8.aln")
@@ -879,7 +1111,7 @@ def test_handle_family_emptyaln_true():
     shutil.copyfile(ref_gen, cur_gen)
     shutil. copyfile(ref_miss, cur_miss)
     open(cur_mafft, "w").close()
-    args = (prefix, num_fam, ngenomes, q)
+    args = (prefix, num_fam, ngenomes, q, {})
     assert al.handle_family(args)
     cur_btr = os.path.join(aldir, "TESThandlefam-mafft-prt2nuc.8.aln")
     exp_mafft = os.path.join(EXPPATH, "exp_aldir-pers", "mafft-align.8-completed.aln")
@@ -930,7 +1162,7 @@ def test_handle_family_emptybtr_true():
     shutil.copyfile(ref_miss, cur_miss)
     shutil.copyfile(ref_mafft, cur_mafft)
     open(cur_btr, "w").close()
-    args = (prefix, num_fam, ngenomes, q)
+    args = (prefix, num_fam, ngenomes, q, {})
     assert al.handle_family(args)
     # mafft file should have been completed with missing genomes
     exp_mafft = os.path.join(EXPPATH, "exp_aldir-pers", "mafft-align.8-completed.aln")
@@ -978,7 +1210,7 @@ def test_handle_family_already_ok():
     shutil.copyfile(ref_miss, cur_miss)
     shutil.copyfile(ref_mafft, cur_mafft)
     shutil.copyfile(ref_btr, cur_btr)
-    args = (prefix, num_fam, ngenomes, q)
+    args = (prefix, num_fam, ngenomes, q, {})
     # assert al.handle_family(args) == "OK"
     al.handle_family(args)
     q.put(None)
@@ -1018,7 +1250,7 @@ def test_handle_family_wrongextract():
     shutil.copyfile(ref_miss, cur_miss)
     shutil.copyfile(ref_mafft, cur_mafft)
     shutil.copyfile(ref_btr, cur_btr)
-    args = (prefix, num_fam, ngenomes, q)
+    args = (prefix, num_fam, ngenomes, q, {})
     assert not al.handle_family(args)
     assert not os.path.isfile(cur_mafft)
     assert not os.path.isfile(cur_btr)
@@ -1058,7 +1290,7 @@ def test_handle_family_addfalse():
     shutil. copyfile(ref_miss, cur_miss)
     shutil.copyfile(ref_mafft, cur_mafft)
     shutil.copyfile(ref_btr, cur_btr)
-    args = (prefix, num_fam, ngenomes, q)
+    args = (prefix, num_fam, ngenomes, q, {})
     assert al.handle_family(args) is False
     cur_mafft = os.path.join(aldir, "TESThandlefam-mafft-align.8.aln")
     cur_btr = os.path.join(aldir, "TESThandlefam-mafft-prt2nuc.8.aln")
@@ -1076,6 +1308,125 @@ def test_handle_family_addfalse():
     assert not q.get()
 
 
+def test_schedule_families():
+    """
+    Test that families are scheduled from the biggest to the smallest one, that huge
+    families are aligned with several mafft threads, and that small families are grouped
+    in a same task.
+    """
+    prefix = os.path.join(GENEPATH, "TESTsched")
+    # Family sizes: 1 huge family (half of total), 2 medium families, 4 small families
+    sizes = {1: 40, 2: 5000, 3: 2000, 4: 10, 5: 1930, 6: 50, 7: 60}
+    for fam, size in sizes.items():
+        with open(f"{prefix}-current.{fam}.prt", "w") as prtf:
+            prtf.write("A" * size)
+    tasks = al.schedule_families(prefix, list(sizes), 4)
+    assert tasks == [([2], 2), ([3], 1), ([5], 1), ([7, 6], 1), ([1, 4], 1)]
+    # With 1 thread, no family is huge
+    tasks = al.schedule_families(prefix, list(sizes), 1)
+    assert tasks == [([2], 1), ([3], 1), ([5], 1), ([7, 6, 1, 4], 1)]
+
+
+def test_run_tasks():
+    """
+    Test that all tasks share the threads: single-thread tasks start while a multi-thread
+    task is running, and the number of threads used at the same time never exceeds 'threads'
+    """
+    events = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def run(task):
+        name, nb_threads = task
+        with lock:
+            events.append(("start", name, nb_threads))
+        # The 2 multi-thread tasks cannot run at the same time: the first one waits until
+        # single-thread tasks were launched
+        if name == "multi1":
+            release.wait(5)
+        with lock:
+            events.append(("end", name, nb_threads))
+        return name
+
+    def fill(task):
+        # single-thread tasks release the first multi-thread task
+        res = run(task)
+        release.set()
+        return res
+
+    tasks = [("multi1", 3), ("multi2", 3), ("single1", 1), ("single2", 1)]
+    funcs = {"multi1": run, "multi2": run, "single1": fill, "single2": fill}
+    pool = multiprocessing.pool.ThreadPool(4)
+    res = list(al.run_tasks(pool, lambda task: funcs[task[0]](task), tasks,
+                            [nb for _, nb in tasks], 4))
+    pool.close()
+    pool.join()
+    assert sorted(res) == ["multi1", "multi2", "single1", "single2"]
+    # single1 started before the end of multi1, and before the start of multi2
+    assert events.index(("start", "single1", 1)) < events.index(("end", "multi1", 3))
+    assert events.index(("start", "single1", 1)) < events.index(("start", "multi2", 3))
+    used = 0
+    for event, _, nb_threads in events:
+        used += nb_threads if event == "start" else -nb_threads
+        assert used <= 4
+
+
+def test_choose_mode():
+    """
+    Test that small families are aligned with L-INS-i, huge families with PartTree, and
+    other families with FFT-NS-2, with default or given thresholds
+    """
+    thresholds = al.MODE_THRESHOLDS
+    assert al.choose_mode(200, 2000, thresholds) == "L-INS-i"
+    assert al.choose_mode(200, 2001, thresholds) == "FFT-NS-2"
+    assert al.choose_mode(201, 100, thresholds) == "FFT-NS-2"
+    assert al.choose_mode(10000, 100, thresholds) == "PartTree"
+    assert al.choose_mode(50, 100, {"linsi_max_seqs": 10}) == "FFT-NS-2"
+    assert al.choose_mode(50, 100, {"linsi_max_seqs": 10, "parttree_min_seqs": 50}) == "PartTree"
+
+
+def test_choose_modes(caplog):
+    """
+    Test that a mode is chosen for each extracted family, identical proteins being counted
+    once with dedup, and that recording modes keeps the modes of families aligned in a
+    previous run
+    """
+    caplog.set_level(logging.DEBUG)
+    prefix = os.path.join(GENEPATH, "TESTmodes")
+    with open(prefix + "-current.1.prt", "w") as prtf:
+        prtf.write(">p1\nMKKLL\nAA\n>p2\nMKKLLAA\n>p3\nMKV\n")
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir-pers", "current.8.prt"),
+                    prefix + "-current.8.prt")
+    assert al.family_profile(prefix + "-current.1.prt") == (3, 2, 7)
+    thresholds = {"linsi_max_seqs": 2, "parttree_min_seqs": 3}
+    chosen = al.choose_modes(prefix, [1, 8], thresholds)
+    assert chosen == {1: (3, 7, "PartTree"), 8: (3, 263, "PartTree")}
+    assert "mafft modes chosen: PartTree for 2 families" in caplog.text
+    assert not os.path.isfile(prefix + "-mafft-modes.tsv")
+    al.record_modes(prefix, chosen)
+    # Family 8 not aligned again: keep its mode
+    chosen = al.choose_modes(prefix, [1, 5], thresholds, dedup=True)
+    assert chosen == {1: (2, 7, "L-INS-i")}
+    al.record_modes(prefix, chosen)
+    with open(prefix + "-mafft-modes.tsv") as modf:
+        assert modf.read() == ("family\tnb_seqs\tmax_length\tmode\n"
+                               "1\t2\t7\tL-INS-i\n"
+                               "8\t3\t263\tPartTree\n")
+
+
+def test_mafft_align_mode(caplog):
+    """
+    Test that mafft is run with the options of the given mode
+    """
+    caplog.set_level(logging.DEBUG)
+    prt_file = os.path.join(EXPPATH, "exp_aldir-pers", "current.8.prt")
+    mafft_file = os.path.join(GENEPATH, "test_mafft_mode.8.aln")
+    logger = logging.getLogger("test_mafft_mode")
+    al.mafft_align(8, prt_file, mafft_file, 3, logger, mafft_threads=2, mafft_mode="FFT-NS-2")
+    assert ("Mafft command: mafft --retree 2 --maxiterate 0 --thread 2 "
+            "test/data/align/exp_files/exp_aldir-pers/current.8.prt") in caplog.text
+
+
 def test_align_all_true(caplog):
     """
     Giving aldir with prt, gen and miss files for families 1 and 8, as well as concat file (
@@ -1207,6 +1558,14 @@ def test_align_all_exists_true(caplog):
             "steps") in caplog.text
     assert ("protein alignment already done for family 8. The program will use it for next "
             "steps") in caplog.text
+    # Alignments reused with adaptive modes: modes recorded by the previous run are kept
+    modes_file = prefix + "-mafft-modes.tsv"
+    with open(modes_file, "w") as modf:
+        modf.write("family\tnb_seqs\tmax_length\tmode\n1\t4\t157\tL-INS-i\n")
+    assert al.align_all_families(prefix, all_fams, ngenomes, dname, quiet, threads,
+                                 options={"mode_thresholds": {"linsi_max_seqs": 2}})
+    with open(modes_file, "r") as modf:
+        assert modf.read() == "family\tnb_seqs\tmax_length\tmode\n1\t4\t157\tL-INS-i\n"
 
 
 def test_align_all_false(caplog):
@@ -149,6 +149,61 @@ def test_extract_seq_out_different_notasked():
     assert not os.path.isfile(out2)
 
 
+def test_extract_seq_writers_small_pool():
+    """
+    Test that when extracting sequences to different files with writers keeping only 1 file
+    open, and writing buffers at each line, output files are the same as expected.
+    """
+    out1 = os.path.join(GENEPATH, "test_extract1.prt")
+    out2 = os.path.join(GENEPATH, "test_extract2.prt")
+    to_extract = {"GEN2.1017.00001.b0001_00001": out1,
+                  "GEN2.1017.00001.i0003_00008": out2,
+                  "GEN2.1017.00001.b0004_00013": out1}
+    with gseq.ExtractionWriters(max_open=1, buffer_size=1) as writers:
+        with open(FASTA, "r") as fasf:
+            gseq.extract_sequences(to_extract, fasf, files_todo=[out1, out2], writers=writers)
+        assert len(writers.handles) == 1
+    exp_extracted1 = os.path.join(EXPPATH, "exp_extracted1.prt")
+    exp_extracted2 = os.path.join(EXPPATH, "exp_extracted2.prt")
+    assert tutil.compare_file_content(out1, exp_extracted1)
+    assert tutil.compare_file_content(out2, exp_extracted2)
+
+
+def test_extraction_writers_buffers():
+    """
+    Test that lines given to writers are kept in buffers until the buffer of the file is
+    full, or until all buffers together are full, and that everything is written when closing.
+    """
+    out1 = os.path.join(GENEPATH, "test_buffer1.txt")
+    out2 = os.path.join(GENEPATH, "test_buffer2.txt")
+    writers = gseq.ExtractionWriters(max_open=2, buffer_size=10, total_size=13)
+    writers.write(out1, ">seq1\n")
+    writers.write(out2, ">seq2\n")
+    # Nothing written yet: files not even created
+    assert not os.path.isfile(out1)
+    assert not os.path.isfile(out2)
+    assert writers.total == 12
+    # Buffer of out1 full: written to file
+    writers.write(out1, "ACGT\n")
+    assert os.path.isfile(out1)
+    assert writers.buffers[out1] == []
+    assert writers.buffers[out2] == [">seq2\n"]
+    assert writers.total == 6
+    # All buffers together are full: everything written
+    writers.write(out1, ">s3\n")
+    assert writers.total == 10
+    writers.write(out2, "AC\n")
+    assert writers.buffers == {out1: [], out2: []}
+    assert writers.total == 0
+    writers.write(out1, ">seq4\n")
+    writers.close()
+    with open(out1, "r") as outf:
+        assert outf.read() == ">seq1\nACGT\n>s3\n>seq4\n"
+    with open(out2, "r") as outf:
+        assert outf.read() == ">seq2\nAC\n"
+    assert writers.handles == {}
+
+
 def test_get_names_files():
     """
     Test that given an open tab file (containing 2 columns: name of sequence to extract,
@@ -277,6 +332,58 @@ def test_get_genome_seqs_1notasked():
     assert not os.path.isfile(outfile2)
 
 
+def test_get_genome_seqs_indexed():
+    """
+    Test that when the fasta file is indexed, it extracts the same sequences to the same
+    files as when reading the whole fasta file.
+    """
+    fasta = os.path.join(GENEPATH, "GEN2.1017.00001.prt")
+    shutil.copyfile(FASTA, fasta)
+    utils.index_fasta(fasta)
+    tabfile = os.path.join(TESTPATH, "getentry_all_2columns.txt")
+    todo = ["file1.txt", "file2.txt"]
+    todo = [os.path.join(GENEPATH, f) for f in todo]
+    gseq.get_genome_seqs(fasta, tabfile, todo)
+    for i in range(1, 3):
+        outfile = os.path.join(GENEPATH, f"file{i}.txt")
+        exp_file = os.path.join(EXPPATH, f"exp_extracted{i}.prt")
+        assert tutil.compare_file_content(outfile, exp_file)
+    # All to the same given outfile
+    outfile = os.path.join(GENEPATH, "fileout.txt")
+    gseq.get_genome_seqs(fasta, tabfile, [], outfile)
+    exp_file = os.path.join(EXPPATH, "exp_extracted.prt")
+    assert tutil.compare_file_content(outfile, exp_file)
+
+
+def test_get_genome_seqs_indexed_dup_tab():
+    """
+    Test that extracting from an indexed fasta file gives the same output as reading the whole
+    file when a name is duplicated, and when a header contains a tab before its first space
+    """
+    fasta = os.path.join(GENEPATH, "GEN9.1017.00001.prt")
+    with open(fasta, "w") as ff:
+        ff.write(">prot1 info\nMAK\n>prot2\tinfo other\nMVV\n>prot3\nMLL\n"
+                 ">prot1 dup\nMSS\n>prot2\nMTT\n")
+    to_extract = {"prot1": "out1", "prot2\tinfo": "out1", "prot2": "out2"}
+    expected = {}
+    for indexed in [False, True]:
+        if indexed:
+            utils.index_fasta(fasta)
+            assert utils.read_fasta_index(fasta)["prot1"] == [(0, 16), (49, 15)]
+        outfile = os.path.join(GENEPATH, f"extracted-{indexed}.prt")
+        with open(outfile, "w") as outf:
+            if indexed:
+                gseq.extract_indexed(to_extract, fasta, utils.read_fasta_index(fasta), outf=outf)
+            else:
+                with open(fasta, "r") as fasf:
+                    gseq.extract_sequences(to_extract, fasf, outf=outf)
+        with open(outfile, "r") as outf:
+            expected[indexed] = outf.read()
+    assert expected[True] == expected[False]
+    assert expected[True] == (">prot1 info\nMAK\n>prot2\tinfo other\nMVV\n>prot1 dup\nMSS\n"
+                              ">prot2\nMTT\n")
+
+
 def test_get_genome_seqs_exists(caplog):
     """
     Test that when the output file given aleady exists, it does not overwrite it, but returns a
@@ -442,6 +549,88 @@ def test_get_all_seqs(caplog):
         assert f"Extracting proteins and genes from {gen}" in caplog.text
 
 
+def test_get_all_seqs_plan():
+    """
+    Test that when giving the extraction plan instead of the folder containing the
+    getentry files, it extracts all expected proteins and genes, with 1 or several processes.
+    """
+    all_genomes = ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]
+    dname = "TESTgetAllSeq"
+    aldir = os.path.join(GENEPATH, "Align")
+    all_fams = [1, 6]
+    ref_listdir = os.path.join(TESTPATH, "test_listdir")
+    ref_aldir = os.path.join(EXPPATH, "exp_aldir")
+    plan = {}
+    for gen in all_genomes:
+        with open(os.path.join(ref_listdir, f"getentry-prt_{gen}"), "r") as gef:
+            plan[gen] = {line.split()[0]: line.split()[1][:-len(".prt")] for line in gef}
+    for threads in [1, 2]:
+        os.makedirs(aldir)
+        gseq.get_all_seqs(all_genomes, dname, DBPATH, ref_listdir, aldir, all_fams, True,
+                          threads=threads, plan=plan)
+        for fam in all_fams:
+            for ext in ["prt", "gen"]:
+                fam_file = os.path.join(aldir, f"{dname}-current.{fam}.{ext}")
+                exp_fam_file = os.path.join(ref_aldir, f"current.{fam}.{ext}")
+                assert tutil.compare_file_content(fam_file, exp_fam_file)
+        shutil.rmtree(aldir)
+
+
+def test_get_all_seqs_parallel(caplog):
+    """
+    Test that when giving a list of family numbers, output directories are empty, and
+    extraction is done with several processes, it extracts all expected proteins and genes,
+    in the same order as when extracting genomes one after the other.
+    """
+    caplog.set_level(logging.DEBUG)
+    all_genomes = ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]
+    dname = "TESTgetAllSeq"
+    listdir = os.path.join(GENEPATH, "Listdir")
+    aldir = os.path.join(GENEPATH, "Align")
+    all_fams = [1, 6]
+    quiet = True
+    # Create listdir and aldir and put all getentry files in listdir
+    os.makedirs(listdir)
+    os.makedirs(aldir)
+    ref_listdir = os.path.join(TESTPATH, "test_listdir")
+    ref_aldir = os.path.join(EXPPATH, "exp_aldir")
+    for gen in all_genomes:
+        genome_gen = os.path.join(ref_listdir, f"getentry-gen_{gen}")
+        genome_prt = os.path.join(ref_listdir, f"getentry-prt_{gen}")
+        gen_out = os.path.join(listdir, f"{dname}-getEntry_gen_{gen}.txt")
+        prt_out = os.path.join(listdir, f"{dname}-getEntry_prt_{gen}.txt")
+        shutil.copyfile(genome_gen, gen_out)
+        shutil.copyfile(genome_prt, prt_out)
+    gseq.get_all_seqs(all_genomes, dname, DBPATH, listdir, aldir, all_fams, quiet, threads=2)
+
+    # For each family, check that prt and gen files exist, and their content
+    for fam in all_fams:
+        fam_prt = os.path.join(aldir, f"{dname}-current.{fam}.prt")
+        exp_fam_prt = os.path.join(ref_aldir, f"current.{fam}.prt")
+        assert tutil.compare_file_content(fam_prt, exp_fam_prt)
+        fam_gen = os.path.join(aldir, f"{dname}-current.{fam}.gen")
+        exp_fam_gen = os.path.join(ref_aldir, f"current.{fam}.gen")
+        assert tutil.compare_file_content(fam_gen, exp_fam_gen)
+    # Temporary fragments were removed
+    assert not os.path.isdir(os.path.join(aldir, f"{dname}-extract_tmp"))
+
+    # Check logs
+    assert "Extracting proteins and genes from all genomes" in caplog.text
+    for gen in all_genomes:
+        assert f"Extracting proteins and genes from {gen}" in caplog.text
+
+
+def test_split_genomes():
+    """
+    Test that genomes are split into shards of consecutive genomes, with at most the given
+    number of shards.
+    """
+    genomes = ["g1", "g2", "g3", "g4", "g5"]
+    assert gseq.split_genomes(genomes, 2) == [["g1", "g2", "g3"], ["g4", "g5"]]
+    assert gseq.split_genomes(genomes, 8) == [["g1"], ["g2"], ["g3"], ["g4"], ["g5"]]
+    assert gseq.split_genomes(genomes, 1) == [genomes]
+
+
 def test_get_all_seqs_prt6(caplog):
     """
     Test that when giving a list of family numbers, and output directories contain only a prt
@@ -85,7 +85,7 @@ def test_get_per_genome(caplog):
     list_gen = os.path.join(TESTPATH, "listfile.txt")
     dname = "TEST-all-gembase"
     outdir = os.path.join(GENEPATH, "test_get_per_genome")
-    all_genomes, aldir, listdir, fams = p2p.get_per_genome(pers, list_gen, dname, outdir)
+    all_genomes, aldir, listdir, fams, plan = p2p.get_per_genome(pers, list_gen, dname, outdir)
     assert ("Reading PersGenome and constructing lists of missing genomes "
             "in each family") in caplog.text
     exp_al = os.path.join(outdir, "Align-TEST-all-gembase")
@@ -94,12 +94,67 @@ def test_get_per_genome(caplog):
     assert os.path.isdir(aldir)
     assert exp_list == listdir
     assert os.path.isdir(listdir)
+    assert plan is None
     exp_genomes = ["GEN4.1111.00001", "GENO.0817.00001", "GENO.1216.00002", "GENO.1216.00003"]
     assert all_genomes == exp_genomes
     exp_fams = ['1', '3', '5', '8', '10', '11', '12']
     assert set(fams) == set(exp_fams)
 
 
+def test_get_per_genome_plan(caplog):
+    """
+    Test that when giving a persistent genome file and a list of genomes, and asking to keep
+    the extraction plan in memory, it returns the plan, and does not create Listdir
+    """
+    caplog.set_level(logging.DEBUG)
+    pers = os.path.join("test", "data", "persgenome", "exp_files", "exp_pers-floor-mixed.txt")
+    list_gen = os.path.join(TESTPATH, "listfile.txt")
+    dname = "TEST-all-gembase"
+    outdir = os.path.join(GENEPATH, "test_get_per_genome")
+    all_genomes, aldir, listdir, fams, plan = p2p.get_per_genome(pers, list_gen, dname, outdir,
+                                                                 write_lists=False)
+    assert listdir == os.path.join(outdir, "List-TEST-all-gembase")
+    assert not os.path.isdir(listdir)
+    assert os.path.isdir(aldir)
+    assert set(plan) == set(all_genomes)
+    for genome, members in plan.items():
+        for mem, fam_file in members.items():
+            assert mem.startswith(genome)
+            fam = fam_file.split("-current.")[1]
+            assert fam_file == os.path.join(aldir, f"{dname}-current.{fam}")
+            assert fam in fams
+            assert os.path.isfile(fam_file + ".miss.lst")
+
+
+def test_extraction_plan():
+    """
+    Test that giving a list of genomes with their persistent gene names, it returns, for
+    each genome, the proteins to extract, with the family file (without extension) to which
+    they must be extracted. Genomes with several members in a family are not extracted for
+    this family.
+    """
+    aldir = os.path.join(GENEPATH, "Aldir")
+    plan = p2p.extraction_plan(ALL_PROTS, SEVERAL, aldir, "TEST6", ALL_GENOMES)
+    assert list(plan) == ALL_GENOMES
+    for num in range(1, 7):
+        exp_prt = os.path.join(EXPPATH, f"exp_getentry-prt-ESCO{num}.txt")
+        with open(exp_prt, "r") as expf:
+            exp_plan = dict(line.split() for line in expf if line.strip())
+        assert {mem: fam_file + ".prt" for mem, fam_file in plan[f"ESCO{num}"].items()} == exp_plan
+
+
+def test_extraction_plan_error(caplog):
+    """
+    Test that when a genome does not have any persistent protein, it exits with an error message
+    """
+    caplog.set_level(logging.DEBUG)
+    all_prots = {genome: ALL_PROTS[genome] for genome in ["ESCO1", "ESCO2", "ESCO3", "ESCO6"]}
+    with pytest.raises(SystemExit):
+        p2p.extraction_plan(all_prots, SEVERAL, GENEPATH, "TEST6", ALL_GENOMES)
+    assert ("There is not any protein for genome ESCO4 in any family! The program will close, "
+            "please fix this problem to be able to run the alignments") in caplog.text
+
+
 def test_prot_per_strain_gembase():
     """
     Test parser of persistent genome file when genome names are in gembase format 
@@ -523,3 +578,16 @@ def test_write_missing():
         miss_file = os.path.join(GENEPATH, f"{dname}-current.{num}.miss.lst")
         assert os.path.isfile(miss_file)
         assert tutil.compare_file_to_list(miss_file, exp_res[num])
+
+
+def test_write_missing_stored():
+    """
+    Test that the list of missing genomes is not written for families already stored in
+    the workspace
+    """
+    dname = "test_write_missing"
+    p2p.write_missing_genomes(FAM_GENOMES, SEVERAL, ALL_GENOMES, GENEPATH, dname,
+                              stored={"2", "4"})
+    for num in range(1, 5):
+        miss_file = os.path.join(GENEPATH, f"{dname}-current.{num}.miss.lst")
+        assert os.path.isfile(miss_file) == (num in [1, 3])
@@ -77,53 +77,75 @@ def test_get_genome_notfound(caplog):
             "['TOTO.0315.00001', 'ESCO.0215.00002', 'ESCO.0215.00001']") in caplog.text
 
 
+def test_get_genome_set():
+    """
+    Given a header and the set of genomes, check that it returns the expected genome, without
+    looking at all genomes, if the protein name is <genome>.<contig>_<num> or if it is the
+    genome name itself
+    """
+    genomes = ["TOTO.0315.00001", "ESCO.0215.00002", "ESCO.0215.00001", "TOTO.0215.00002"]
+    assert pal.get_genome(">TOTO.0215.00002.i006_00065 info", [],
+                          set(genomes)) == "TOTO.0215.00002"
+    assert pal.get_genome(">ESCO.0215.00002\n", [], set(genomes)) == "ESCO.0215.00002"
+    # Not gembase format: look for the genome in protein name
+    assert pal.get_genome(">mongenome,TOTO.0215.00002.i006_00065", genomes,
+                          set(genomes)) == "TOTO.0215.00002"
+
+
 def test_write_groups(caplog):
     """
-    Check that giving a list of genomes and corresponding sequences, it writes all of them in
-    fasta format in the given output file.
+    Check that giving an alignment file and the genome of each of its sequences, it writes
+    the concatenation of all sequences of each genome in fasta format in the given output file.
     """
     caplog.set_level(logging.DEBUG)
+    alnfile = os.path.join(GENEPATH, "test_write_groups.aln")
+    with open(alnfile, "w") as alnf:
+        alnf.write(">ESCO.0216.00002.i1_1\nAAAAT-\n>ESCO.0216.00001.i1_1\nAAAAA-\n"
+                   ">ESCO.0216.00003.b1_1\nAAA\nAAA\n"
+                   ">ESCO.0216.00001.i1_2\nTTTTT\n>ESCO.0216.00002.i1_2\nTTTTA\n"
+                   ">ESCO.0216.00003\nTT-TT\n")
     outfile = os.path.join(GENEPATH, "test_write_groups.fa")
-    sequences = {"ESCO.0216.00001": ["AAAAA-", "TTTTT", "CCCCC", "GGGGG"],
-                 "ESCO.0216.00002": ["AAAAT-", "TTTTA", "-CCCG", "GGGGC"],
-                 "ESCO.0216.00003": ["AAAAAA", "TT-TT", "CCC-C", "GCGG-"]}
-    pal.write_groups(outfile, sequences)
+    genomes = ["ESCO.0216.00002", "ESCO.0216.00001", "ESCO.0216.00003"]
+    pal.write_groups(outfile, alnfile, genomes, [11, 11, 11], [0, 1, 2, 1, 0, 2])
     assert "Writing alignments per genome" in caplog.text
     with open(outfile, "r") as outf:
         lines = outf.readlines()
     assert len(lines) == 6
-    exp_lines = [">ESCO.0216.00001\n", "AAAAA-TTTTTCCCCCGGGGG\n",
-                 ">ESCO.0216.00002\n", "AAAAT-TTTTA-CCCGGGGGC\n",
-                 ">ESCO.0216.00003\n", "AAAAAATT-TTCCC-CGCGG-\n"]
+    exp_lines = [">ESCO.0216.00001\n", "AAAAA-TTTTT\n",
+                 ">ESCO.0216.00002\n", "AAAAT-TTTTA\n",
+                 ">ESCO.0216.00003\n", "AAAAAATT-TT\n"]
     assert lines == exp_lines
 
 
 def test_read_alignment(caplog):
     """
-    Giving a file with proteins aligned, and a list of genomes, returns, for each genome,
-    the list of sequences found.
+    Giving a file with proteins aligned, and a list of genomes, returns the genomes found,
+    the length of alignment of each genome, and the genome of each sequence
     """
     caplog.set_level(logging.DEBUG)
     alnfile = os.path.join(TESTPATH, "complete.cat.fictive4genomes.aln")
     all_genomes = ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]
-    seqs = pal.read_alignments(alnfile, all_genomes)
-    exp_seq = {"GEN2.1017.00001": ["AAATCTCGGAGATCTCGCGCGGATATATCGCGCTATAGCGCT",
-                                   "---TTCGCGCGGAGAGGCGCTCTCGGCG",
-                                   "----------------------------------------------------"],
-               "GEN4.1111.00001": ["AAATCTCGGAGTTCTCGCGCGGGTA---CGCGCTATAGCGCT",
-                                   "---TTCGCGCGGAGAGGCGCTCTCG---",
-                                   "CGGTATAGGGCGCTAC----CCGGATATAGGGCTCTCGGAATTCGCAAC-CC"],
-               "GENO.1017.00001": ["-------GGAGATCTCGCGCGGATATATCGCGCTATAGCGCT",
-                                   "AAATTCGCGCGGAGAGGCGCTCTCGAAA",
-                                   "CGGTATAGGGCGCTACTTTTCCGGATATAGGGCTCTCGGAATTCG--ACACC"],
-               "GENO.1216.00002": ["AAATCTCGGAGATCTCGCGCGGATATATAAAACTATAGCGCT",
-                                   "----------------------------",
-                                   "CGGTATGGGGCGCTAC----CCGGATATAGGGCTCTCGGAATTCGCAAC-CG"]
-               }
-    assert seqs == exp_seq
+    genomes, lengths, seq_genomes = pal.read_alignments(alnfile, all_genomes)
+    assert genomes == all_genomes
+    assert lengths == [122] * 4
+    assert list(seq_genomes) == [0, 1, 2, 3] * 3
     assert "3 sequences found per genome" in caplog.text
 
 
+def test_read_alignment_difflen(caplog):
+    """
+    Giving a file with proteins aligned, and a list of genomes, with 1 genome whose
+    alignment is longer than the others. Returns None with an error message.
+    """
+    caplog.set_level(logging.DEBUG)
+    alnfile = os.path.join(GENEPATH, "test_read_difflen.aln")
+    with open(alnfile, "w") as alnf:
+        alnf.write(">ESCO.0216.00001.i1_1\nAAAAT-\n>ESCO.0216.00002.i1_1\nAAAAA-A\n")
+    assert pal.read_alignments(alnfile, ["ESCO.0216.00001", "ESCO.0216.00002"]) is None
+    assert ("Problems occurred while grouping alignments by genome: all genomes do not have the "
+            "same alignment length.") in caplog.text
+
+
 def test_read_alignment_diffnbseq(caplog):
     """
     Giving a file with proteins aligned, and a list of genomes, with 3 proteins for each genome,
@@ -207,6 +229,30 @@ def test_launch_gbg(caplog):
     assert "Grouping nucl alignments per genome" in caplog.text
 
 
+def test_launch_groups(caplog):
+    """
+    Giving 2 alignment files to group by genome, check that both are grouped (each one in its
+    process), and that a job whose output already exists is not redone.
+    """
+    caplog.set_level(logging.DEBUG)
+    all_genomes = ["GENO.1216.00002", "GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001"]
+    alnfile = os.path.join(TESTPATH, "complete.cat.pers4genomes.aln")
+    alnfict = os.path.join(TESTPATH, "complete.cat.fictive4genomes.aln")
+    out_grp1 = os.path.join(GENEPATH, "TESTlaunch.nucl.grp.aln")
+    out_grp2 = os.path.join(GENEPATH, "TESTlaunch.aa.grp.aln")
+    out_grp3 = os.path.join(GENEPATH, "TESTlaunch.other.grp.aln")
+    open(out_grp3, "w").close()
+    jobs = [(alnfile, "Done", out_grp1, "nucleic"), (alnfict, "Done", out_grp2, "protein"),
+            (alnfict, "OK", out_grp3, "other")]
+    assert pal.launch_groups_by_genome(all_genomes, jobs, "TESTlaunch", True) == [True] * 3
+    assert tutil.compare_order_content(out_grp1, os.path.join(EXPPATH, "exp_pers4genomes.grp.aln"))
+    assert tutil.compare_order_content(out_grp2, os.path.join(EXPPATH, "exp_fictive.grp.aln"))
+    assert os.path.getsize(out_grp3) == 0
+    assert "Grouping nucleic alignments per genome" in caplog.text
+    assert "Grouping protein alignments per genome" in caplog.text
+    assert "other alignments already grouped by genome" in caplog.text
+
+
 def test_launch_gbg_existsempty(caplog):
     """
     Giving an alignment file, and a list of genomes, and saying that we did not re-create this
@@ -520,6 +566,99 @@ def test_postalign(caplog):
     assert "Grouping protein alignments per genome" in caplog.text
 
 
+def test_postalign_compact(caplog):
+    """
+    Test that when running post-alignment on compact family alignments (missing genomes not
+    added), it does not concatenate alignments, and creates the same alignments grouped by genome
+    as with complete family alignments.
+    """
+    caplog.set_level(logging.DEBUG)
+    fam_nums = [1, 8, 11]
+    all_genomes = ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]
+    outdir = os.path.join(GENEPATH, "test_post-align")
+    aldir = os.path.join(outdir, "aldir_post-align")
+    os.makedirs(aldir)
+    dname = "TESTpost"
+    prefix = os.path.join(aldir, dname)
+    # Family 8: GENO.1017.00001 is missing, and not added to the alignments
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir", "mafft-prt2nuc.1.aln"),
+                    prefix + "-mafft-prt2nuc.1.aln")
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir-pers", "mafft-prt2nuc.11.aln"),
+                    prefix + "-mafft-prt2nuc.11.aln")
+    with open(os.path.join(EXPPATH, "exp_aldir-pers", "mafft-prt2nuc.8.aln"), "r") as inf:
+        content = inf.read()
+    with open(prefix + "-mafft-prt2nuc.8.aln", "w") as outf:
+        outf.write(content.split(">GENO.1017.00001")[0])
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir", "mafft-align.1.aln"),
+                    prefix + "-mafft-align.1.aln")
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir-pers", "mafft-align.8.aln"),
+                    prefix + "-mafft-align.8.aln")
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir-pers", "mafft-align.11.aln"),
+                    prefix + "-mafft-align.11.aln")
+    out_grp = pal.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, True, True,
+                                 compact=True)
+    assert not os.path.isfile(prefix + "-complete.nucl.cat.aln")
+    assert not os.path.isfile(prefix + "-complete.aa.cat.aln")
+    exp_grp = os.path.join(EXPPATH, "exp_grp_4genomes-fam1-8-11.aln")
+    assert tutil.compare_order_content(out_grp, exp_grp)
+    out_grp_aa = os.path.join(outdir, "Phylo-" + dname, dname + ".aa.grp.aln")
+    exp_grp_aa = os.path.join(EXPPATH, "exp_grp_4genomes-fam1-8-11.aa.aln")
+    assert tutil.compare_order_content(out_grp_aa, exp_grp_aa)
+    assert "Concatenating" not in caplog.text
+
+
+def test_read_families_twice(caplog):
+    """
+    Test that when a genome is found twice in a compact family alignment, it returns None
+    with an error message
+    """
+    fam_file = os.path.join(GENEPATH, "fam.aln")
+    with open(fam_file, "w") as famf:
+        famf.write(">ESCO.0216.00001.i1_1\nAA-\n>ESCO.0216.00001.i1_2\nAAT\n")
+    assert pal.read_families([fam_file], ["ESCO.0216.00001", "ESCO.0216.00002"]) is None
+    assert ("genome ESCO.0216.00001 found several times in "
+            "test/data/align/generated_by_unit-tests/fam.aln") in caplog.text
+
+
+def test_compress_sites(caplog):
+    """
+    Test that site patterns of an alignment grouped by genome are the distinct columns,
+    in the order of the alignment, with their weights, whatever the number of columns
+    read at the same time.
+    """
+    caplog.set_level(logging.DEBUG)
+    grp_file = os.path.join(GENEPATH, "test.grp.aln")
+    with open(grp_file, "w") as grpf:
+        grpf.write(">G1\nAAC-TAAC\n>G2\nAAG-TAAG\n>G3\nATC-TATC\n")
+    for chunk in [3, 6, 1000]:
+        assert pal.compress_sites(grp_file, chunk=chunk) == (
+            os.path.join(GENEPATH, "test.grp.patterns.aln"),
+            os.path.join(GENEPATH, "test.grp.patterns.weights"))
+        with open(os.path.join(GENEPATH, "test.grp.patterns.aln"), "r") as patf:
+            assert patf.read() == ">G1\nAAC-T\n>G2\nAAG-T\n>G3\nATC-T\n"
+        with open(os.path.join(GENEPATH, "test.grp.patterns.weights"), "r") as weif:
+            assert weif.read() == "2\n2\n2\n1\n1\n"
+        os.remove(os.path.join(GENEPATH, "test.grp.patterns.weights"))
+    assert "8 sites compressed into 5 site patterns" in caplog.text
+    pal.compress_sites(grp_file, variable_only=True)
+    with open(os.path.join(GENEPATH, "test.grp.varpatterns.aln"), "r") as patf:
+        assert patf.read() == ">G1\nAC\n>G2\nAG\n>G3\nTC\n"
+    with open(os.path.join(GENEPATH, "test.grp.varpatterns.weights"), "r") as weif:
+        assert weif.read() == "2\n2\n"
+
+
+def test_compress_sites_difflen(caplog):
+    """
+    Test that when sequences of the alignment do not all have the same length, it returns
+    None with an error message
+    """
+    grp_file = os.path.join(GENEPATH, "test.grp.aln")
+    with open(grp_file, "w") as grpf:
+        grpf.write(">G1\nAAC-TAAC\n>G2\nAAG-TAA\n")
+    assert pal.compress_sites(grp_file) is None
+    assert "all sequences must have the same length" in caplog.text
+
+
 def test_postalign_aa_missalign(caplog):
     """
     Test that when running post-alignment on a folder containing all expected alignment files
@@ -703,3 +842,59 @@ def test_postalign_diffnbseq(caplog):
     assert "Concatenating all nucl alignment files" in caplog.text
     assert "Grouping nucleic alignments per genome" in caplog.text
     assert "An error occurred. We could not group DNA alignments by genome." in caplog.text
+
+
+def test_postalign_matrix(caplog):
+    """
+    Test that post-alignment also saves the alignments grouped by genome as matrices, with
+    the genome of each row and the columns of each family, and that they are not written
+    again if they already exist
+    """
+    caplog.set_level(logging.DEBUG)
+    fam_nums = [1, 8, 11]
+    all_genomes = ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]
+    outdir = os.path.join(GENEPATH, "test_post-align")
+    aldir = os.path.join(outdir, "aldir_post-align")
+    os.makedirs(aldir)
+    dname = "TESTpost"
+    prefix = os.path.join(aldir, dname)
+    for num_fam in fam_nums:
+        folder = "exp_aldir" if num_fam == 1 else "exp_aldir-pers"
+        for info in ["mafft-prt2nuc", "mafft-align"]:
+            shutil.copyfile(os.path.join(EXPPATH, folder, f"{info}.{num_fam}.aln"),
+                            f"{prefix}-{info}.{num_fam}.aln")
+    out_grp = pal.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, True, True,
+                                 compact=True, matrix=True)
+    matrix, names, partitions = pal.load_matrix(out_grp)
+    assert names == ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001",
+                     "GENO.1216.00002"]
+    with open(out_grp, "r") as grpf:
+        seqs = [line.strip() for line in grpf if not line.startswith(">")]
+    assert [row.tobytes().decode() for row in matrix] == seqs
+    assert [part[0] for part in partitions] == ["1", "8", "11"]
+    assert partitions[0][1] == 0
+    assert partitions[1][1] == partitions[0][2]
+    assert partitions[2][2] == matrix.shape[1]
+    assert partitions[1][2] - partitions[1][1] == 789
+    matrix_aa, _, partitions_aa = pal.load_matrix(os.path.join(outdir, "Phylo-" + dname,
+                                                               dname + ".aa.grp.aln"))
+    assert matrix_aa.shape == (4, partitions_aa[-1][2])
+    assert partitions_aa[1][2] - partitions_aa[1][1] == 263
+    # Already written
+    pal.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, False, True,
+                       compact=True, matrix=True)
+    assert "Alignment matrix already written" in caplog.text
+
+
+def test_write_matrix_wrong_length(caplog):
+    """
+    Test that a matrix is not written if the families do not correspond to the alignment
+    grouped by genome
+    """
+    caplog.set_level(logging.DEBUG)
+    grp_file = os.path.join(GENEPATH, "test.grp.aln")
+    shutil.copyfile(os.path.join(EXPPATH, "exp_grp_4genomes-fam1-8-11.aln"), grp_file)
+    fam_files = [os.path.join(EXPPATH, "exp_aldir-pers", "mafft-prt2nuc.8.aln")]
+    assert not pal.write_matrix(grp_file, [8], fam_files)
+    assert "is not the sum of the family alignment lengths (789)" in caplog.text
+    assert not os.path.isfile(os.path.join(GENEPATH, "test.grp.npy"))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Unit tests for the trimming submodule in align module
+"""
+import os
+import pytest
+import shutil
+import logging
+
+import PanACoTA.align_module.trimming as trim
+import PanACoTA.align_module.post_align as pal
+import PanACoTA.align_module.workspace as ws
+import test.test_unit.utilities_for_tests as tutil
+
+# Define common variables
+ALPATH = os.path.join("test", "data", "align")
+EXPPATH = os.path.join(ALPATH, "exp_files")
+GENEPATH = os.path.join(ALPATH, "generated_by_unit-tests")
+
+
+@pytest.fixture(autouse=True)
+def setup_teardown_module():
+    """
+    Before each test, create directory to put generated files. Remove it after.
+    """
+    os.mkdir(GENEPATH)
+    print("setup")
+
+    yield
+    shutil.rmtree(GENEPATH)
+    print("teardown")
+
+
+def write_family(prefix, num_fam, btr, prt):
+    """
+    Write back-translated and protein alignments of a family, given as {header: sequence}
+    """
+    for info, seqs in [("mafft-prt2nuc", btr), ("mafft-align", prt)]:
+        with open(f"{prefix}-{info}.{num_fam}.aln", "w") as outf:
+            for header, seq in seqs.items():
+                outf.write(f">{header}\n{seq}\n")
+
+
+BTR = {"GEN1.0417.00001.b0001_00001": "ATG---AAA---CCC",
+       "GEN2.0417.00001.b0001_00001": "ATGTTTA-A---CCC",
+       "GEN3.0417.00001.b0001_00001": "ATG---AAAGG-CCC"}
+PRT = {"GEN1.0417.00001.b0001_00001": "M-K-P",
+       "GEN2.0417.00001.b0001_00001": "MFK-P",
+       "GEN3.0417.00001.b0001_00001": "M-KGP"}
+
+
+def test_trim_family():
+    """
+    Test that codons which are gaps (all 3 positions) in more than the given fraction of the
+    genomes are removed from the back-translated and protein alignments
+    """
+    prefix = os.path.join(GENEPATH, "TEST")
+    write_family(prefix, 1, BTR, PRT)
+    sources = trim.catalog_sources(prefix, 1, {})
+    assert trim.trim_family((prefix, 1, 3, 0.5, sources, True)) == (True, 3, 5)
+    with open(prefix + "-trim-prt2nuc.1.aln") as inf:
+        assert inf.read() == (">GEN1.0417.00001.b0001_00001\nATGAAACCC\n"
+                              ">GEN2.0417.00001.b0001_00001\nATGA-ACCC\n"
+                              ">GEN3.0417.00001.b0001_00001\nATGAAACCC\n")
+    with open(prefix + "-trim-align.1.aln") as inf:
+        assert inf.read() == (">GEN1.0417.00001.b0001_00001\nMKP\n"
+                              ">GEN2.0417.00001.b0001_00001\nMKP\n"
+                              ">GEN3.0417.00001.b0001_00001\nMKP\n")
+    # Already trimmed
+    assert trim.trim_family((prefix, 1, 3, 0.5, sources, True)) == "OK"
+
+
+def test_trim_family_workspace():
+    """
+    Test that trimmed alignments of a family stored in the workspace are not done again when
+    other families are stored, but are done again when the family is stored again
+    """
+    prefix = os.path.join(GENEPATH, "TEST")
+    write_family(prefix, 1, BTR, PRT)
+    ws.store(prefix, [prefix + "-mafft-prt2nuc.1.aln", prefix + "-mafft-align.1.aln"])
+    sources = trim.catalog_sources(prefix, 1, ws.read_catalog(prefix))
+    assert trim.trim_family((prefix, 1, 3, 0.5, sources, True)) == (True, 3, 5)
+    # Another family stored after trimming: container modified, but not family 1
+    write_family(prefix, 2, BTR, PRT)
+    ws.store(prefix, [prefix + "-mafft-prt2nuc.2.aln", prefix + "-mafft-align.2.aln"])
+    assert os.path.getmtime(prefix + "-workspace.pack") >= os.path.getmtime(
+        prefix + "-trim-align.1.aln")
+    sources = trim.catalog_sources(prefix, 1, ws.read_catalog(prefix))
+    assert trim.trim_family((prefix, 1, 3, 0.5, sources, True)) == "OK"
+    # Family 1 aligned and stored again after trimming
+    write_family(prefix, 1, BTR, PRT)
+    trimmed = os.stat(prefix + "-trim-align.1.aln")
+    for info in ["mafft-prt2nuc", "mafft-align"]:
+        os.utime(f"{prefix}-{info}.1.aln", ns=(trimmed.st_atime_ns, trimmed.st_mtime_ns + 1))
+    ws.store(prefix, [prefix + "-mafft-prt2nuc.1.aln", prefix + "-mafft-align.1.aln"])
+    sources = trim.catalog_sources(prefix, 1, ws.read_catalog(prefix))
+    assert trim.trim_family((prefix, 1, 3, 0.5, sources, True)) == (True, 3, 5)
+
+
+def test_trim_family_missing():
+    """
+    Test that genomes missing in a compact alignment are counted as gaps
+    """
+    prefix = os.path.join(GENEPATH, "TEST")
+    write_family(prefix, 1, BTR, PRT)
+    sources = trim.catalog_sources(prefix, 1, {})
+    # All codons are kept with 3 genomes
+    assert trim.trim_family((prefix, 1, 3, 0.7, sources, True)) == (True, 5, 5)
+    # 2 genomes missing: codons with a gap in 2 of the 3 genomes are gaps in 4/5 genomes
+    assert trim.trim_family((prefix, 1, 5, 0.7, sources, False)) == (True, 3, 5)
+    with open(prefix + "-trim-align.1.aln") as inf:
+        assert inf.read() == (">GEN1.0417.00001.b0001_00001\nMKP\n"
+                              ">GEN2.0417.00001.b0001_00001\nMKP\n"
+                              ">GEN3.0417.00001.b0001_00001\nMKP\n")
+
+
+def test_trim_family_error(caplog):
+    """
+    Test that trimming a family whose protein alignment does not correspond to its
+    back-translated alignment returns False
+    """
+    caplog.set_level(logging.DEBUG)
+    prefix = os.path.join(GENEPATH, "TEST")
+    write_family(prefix, 1, BTR, {header: seq[:-1] for header, seq in PRT.items()})
+    sources = trim.catalog_sources(prefix, 1, {})
+    assert not trim.trim_family((prefix, 1, 3, 0.5, sources, True))
+    assert "does not correspond to back-translated alignment" in caplog.text
+    assert not os.path.isfile(prefix + "-trim-prt2nuc.1.aln")
+
+
+def test_trim_all_families_workspace(caplog):
+    """
+    Test trimming families, some of them being stored in the workspace, in parallel, and
+    that keeping all codons gives the same alignment grouped by genome as without trimming
+    """
+    caplog.set_level(logging.DEBUG)
+    fam_nums = [1, 8, 11]
+    all_genomes = ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]
+    outdir = os.path.join(GENEPATH, "test_post-align")
+    aldir = os.path.join(outdir, "aldir_post-align")
+    os.makedirs(aldir)
+    dname = "TESTpost"
+    prefix = os.path.join(aldir, dname)
+    for num_fam in fam_nums:
+        folder = "exp_aldir" if num_fam == 1 else "exp_aldir-pers"
+        for info in ["mafft-prt2nuc", "mafft-align"]:
+            shutil.copyfile(os.path.join(EXPPATH, folder, f"{info}.{num_fam}.aln"),
+                            f"{prefix}-{info}.{num_fam}.aln")
+    ws.store(prefix, [prefix + "-mafft-prt2nuc.1.aln", prefix + "-mafft-align.1.aln"])
+    assert trim.trim_all_families(prefix, fam_nums, len(all_genomes), dname, 1, True,
+                                  threads=2, workspace=True)
+    out_grp = pal.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, False, True,
+                                 workspace=True, trimmed=True)
+    assert os.path.isfile(prefix + "-complete-trim.nucl.cat.aln")
+    exp_grp = os.path.join(EXPPATH, "exp_grp_4genomes-fam1-8-11.aln")
+    assert tutil.compare_order_content(out_grp, exp_grp)
+    assert out_grp == os.path.join(outdir, "Phylo-TESTpost", "TESTpost-trim.nucl.grp.aln")
+    # Untrimmed alignments are grouped in another file: trimmed one is not reused
+    out_untrimmed = pal.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, False,
+                                       True, workspace=True)
+    assert out_untrimmed == os.path.join(outdir, "Phylo-TESTpost", "TESTpost.nucl.grp.aln")
+    assert tutil.compare_order_content(out_untrimmed, exp_grp)
+    assert os.path.isfile(prefix + "-trim.threshold")
+    # Same threshold: nothing to do
+    assert trim.trim_all_families(prefix, fam_nums, len(all_genomes), dname, 1, True,
+                                  workspace=True)
+    assert os.path.isfile(out_grp)
+    # Trimmed again, with another threshold: concatenated and grouped files are removed
+    assert trim.trim_all_families(prefix, fam_nums, len(all_genomes), dname, 0, True,
+                                  workspace=True)
+    assert not os.path.isfile(prefix + "-complete-trim.nucl.cat.aln")
+    assert not os.path.isfile(out_grp)
+    assert "codons kept out of" in caplog.text
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Unit tests for the workspace submodule in align module
+"""
+import os
+import pytest
+import shutil
+import logging
+
+import PanACoTA.align_module.workspace as ws
+import PanACoTA.align_module.post_align as pal
+import test.test_unit.utilities_for_tests as tutil
+
+# Define common variables
+ALPATH = os.path.join("test", "data", "align")
+EXPPATH = os.path.join(ALPATH, "exp_files")
+GENEPATH = os.path.join(ALPATH, "generated_by_unit-tests")
+
+
+@pytest.fixture(autouse=True)
+def setup_teardown_module():
+    """
+    Before each test, create directory to put generated files. Remove it after.
+    """
+    os.mkdir(GENEPATH)
+    print("setup")
+
+    yield
+    shutil.rmtree(GENEPATH)
+    print("teardown")
+
+
+def fill_family(prefix, num_fam, content="content"):
+    """
+    Create all files of a family
+    """
+    files = ws.family_files(prefix, num_fam)
+    for file in files:
+        with open(file, "w") as outf:
+            outf.write(f"{os.path.basename(file)} {content}\n")
+    return files
+
+
+def test_store_read():
+    """
+    Test that storing files of families removes them from aldir, and that they can be read
+    from the workspace. A file stored again replaces the previous one.
+    """
+    prefix = os.path.join(GENEPATH, "TEST")
+    files1 = fill_family(prefix, 1)
+    files2 = fill_family(prefix, 2)
+    assert ws.store(prefix, files1 + [prefix + "-nofile"]) == 6
+    assert ws.store(prefix, files2) == 6
+    assert not any(os.path.isfile(f) for f in files1 + files2)
+    catalog = ws.read_catalog(prefix)
+    assert len(catalog) == 12
+    assert ws.family_stored(catalog, prefix, 1)
+    assert ws.family_stored(catalog, prefix, 2)
+    assert not ws.family_stored(catalog, prefix, 3)
+    member = catalog["TEST-mafft-align.2.aln"]
+    with ws.open_source(member) as inf:
+        assert inf.read() == b"TEST-mafft-align.2.aln content\n"
+    assert ws.source_name(member) == prefix + "-workspace.pack:TEST-mafft-align.2.aln"
+    # Store family 1 alignment again
+    fill_family(prefix, 1, "new")
+    ws.store(prefix, [prefix + "-mafft-align.1.aln"])
+    catalog = ws.read_catalog(prefix)
+    assert len(catalog) == 12
+    with ws.open_source(catalog["TEST-mafft-align.1.aln"]) as inf:
+        assert inf.read() == b"TEST-mafft-align.1.aln new\n"
+
+
+def test_read_catalog_incomplete():
+    """
+    Test that an incomplete last line of catalog (run killed while writing it) is ignored,
+    and that there is an empty catalog when there is no workspace
+    """
+    prefix = os.path.join(GENEPATH, "TEST")
+    assert ws.read_catalog(prefix) == {}
+    ws.store(prefix, fill_family(prefix, 1))
+    with open(prefix + "-workspace.cat", "a") as catf:
+        catf.write("TEST-current.2.prt\t1")
+    catalog = ws.read_catalog(prefix)
+    assert len(catalog) == 6
+    assert "TEST-current.2.prt" not in catalog
+
+
+def test_family_stored_mode():
+    """
+    Test that a family stored with compact alignments is not considered as stored for a run
+    adding missing genomes to alignments (and conversely), until it is stored again
+    """
+    prefix = os.path.join(GENEPATH, "TEST")
+    ws.store(prefix, fill_family(prefix, 1), ws.align_mode(True))
+    ws.store(prefix, fill_family(prefix, 2))
+    catalog = ws.read_catalog(prefix)
+    assert catalog["TEST-mafft-align.1.aln"].mode == "compact"
+    assert ws.family_stored(catalog, prefix, 1, "compact")
+    assert not ws.family_stored(catalog, prefix, 1, "full")
+    assert ws.stored_families(prefix, [1, 2, 3], "full") == {2}
+    assert ws.stored_families(prefix, [1, 2, 3], "compact") == {1}
+    ws.store(prefix, fill_family(prefix, 1), "full")
+    assert ws.stored_families(prefix, [1, 2, 3], "full") == {1, 2}
+
+
+def test_cat():
+    """
+    Test concatenating files from aldir and from the workspace
+    """
+    prefix = os.path.join(GENEPATH, "TEST")
+    ws.store(prefix, fill_family(prefix, 1))
+    fill_family(prefix, 2)
+    catalog = ws.read_catalog(prefix)
+    output = os.path.join(GENEPATH, "cat.aln")
+    ws.cat([catalog["TEST-mafft-align.1.aln"], prefix + "-mafft-align.2.aln"], output,
+           title="Concatenation")
+    with open(output, "r") as outf:
+        assert outf.read() == "TEST-mafft-align.1.aln content\nTEST-mafft-align.2.aln content\n"
+
+
+def test_postalign_workspace(caplog):
+    """
+    Test that post-alignment concatenates and groups family alignments, some of them being
+    stored in the workspace
+    """
+    caplog.set_level(logging.DEBUG)
+    fam_nums = [1, 8, 11]
+    all_genomes = ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]
+    outdir = os.path.join(GENEPATH, "test_post-align")
+    aldir = os.path.join(outdir, "aldir_post-align")
+    os.makedirs(aldir)
+    dname = "TESTpost"
+    prefix = os.path.join(aldir, dname)
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir", "mafft-prt2nuc.1.aln"),
+                    prefix + "-mafft-prt2nuc.1.aln")
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir-pers", "mafft-prt2nuc.8.aln"),
+                    prefix + "-mafft-prt2nuc.8.aln")
+    shutil.copyfile(os.path.join(EXPPATH, "exp_aldir-pers", "mafft-prt2nuc.11.aln"),
+                    prefix + "-mafft-prt2nuc.11.aln")
+    ws.store(prefix, [prefix + "-mafft-prt2nuc.1.aln", prefix + "-mafft-prt2nuc.8.aln"])
+    out_grp = pal.post_alignment(fam_nums, all_genomes, prefix, outdir, dname, False, True,
+                                 workspace=True)
+    out_concat = prefix + "-complete.nucl.cat.aln"
+    exp_concat = os.path.join(EXPPATH, "exp_concat_4genomes-fam1-8-11.aln")
+    assert tutil.compare_order_content(out_concat, exp_concat)
+    exp_grp = os.path.join(EXPPATH, "exp_grp_4genomes-fam1-8-11.aln")
+    assert tutil.compare_order_content(out_grp, exp_grp)
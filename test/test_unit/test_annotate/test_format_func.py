@@ -223,6 +223,9 @@ def test_handle_genome_formatok(caplog):
     exp_gen = os.path.join(EXP_ANNOTE, "res_create_gene_prokka.gen")
     res_gen_file = os.path.join(gene_dir, "test.0417.00002.gen")
     assert tutil.compare_order_content(exp_gen, res_gen_file)
+    # Proteins and genes are indexed
+    assert utils.read_fasta_index(res_prt_file) is not None
+    assert utils.read_fasta_index(res_gen_file) is not None
     # LSTINFO
     exp_lst = os.path.join(EXP_ANNOTE, "res_create_lst-prokka.lst")
     res_lst_file = os.path.join(lst_dir, "test.0417.00002.lst")
@@ -273,6 +276,9 @@ def test_handle_genome_formatok_prodigal(caplog):
     exp_gen = os.path.join(EXP_ANNOTE, "res_create_gene_lst_prodigal.gen")
     res_gen_file = os.path.join(gene_dir, "test.0417.00002.gen")
     assert tutil.compare_order_content(exp_gen, res_gen_file)
+    # Proteins and genes are indexed
+    assert utils.read_fasta_index(res_prt_file) is not None
+    assert utils.read_fasta_index(res_gen_file) is not None
     # LSTINFO
     exp_lst = os.path.join(EXP_ANNOTE, "res_create_gene_lst_prodigal.lst")
     res_lst_file = os.path.join(lst_dir, "test.0417.00002.lst")
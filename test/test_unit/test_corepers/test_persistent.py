@@ -10,6 +10,7 @@ import pytest
 import shutil
 
 import PanACoTA.corepers_module.persistent_functions as persf
+from PanACoTA import utils_pangenome as upan
 import test.test_unit.utilities_for_tests as tutils
 
 
@@ -415,3 +416,40 @@ def test_get_99pers_multi(caplog):
     assert exp_fams == fams
     assert ("The persistent genome contains 4 families with members present in "
             "at least 4 different genomes (99.0% of the total number of genomes).") in caplog.text
+
+
+@pytest.mark.parametrize("options", [{}, {"multi": True},
+                                     {"tol": 0.99, "floor": True},
+                                     {"tol": 0.99, "floor": True, "mixed": True},
+                                     {"tol": 0.99, "floor": True, "multi": True},
+                                     {"tol": 0.5, "mixed": True}])
+def test_get_pers_model(options, caplog):
+    """
+    Test that getting a persistent genome from the compact model of the pangenome gives the
+    same families as from the pangenome dicts, with the same log message
+    """
+    caplog.set_level(logging.DEBUG)
+    model = upan.build_pan_model(FAMILIES)
+    exp_fams = persf.get_pers(FAMS_BY_STRAIN, FAMILIES, 4, **options)
+    exp_log = caplog.records[-1].message
+    caplog.clear()
+    fams = persf.get_pers_model(model, **options)
+    assert fams == exp_fams
+    assert caplog.records[-1].message == exp_log
+
+
+def test_get_pers_model_subset(caplog):
+    """
+    Test that getting a persistent genome from the compact model of the pangenome, for a
+    subset of genomes, gives the same families as from the pangenome dicts
+    """
+    caplog.set_level(logging.DEBUG)
+    lstinfo = os.path.join(GENEPATH, "lstinfo-ok.lst")
+    with open(lstinfo, "w") as lst:
+        lst.write("GEN4.1111.00001 toto we don't use other fields\n")
+        lst.write("GENO.1216.00003\n")
+    fbs, fam, genomes = persf.get_subset_genomes(FAMS_BY_STRAIN, FAMILIES, lstinfo)
+    model = upan.build_pan_model(FAMILIES)
+    for options in [{}, {"multi": True}, {"tol": 0.5, "mixed": True}]:
+        exp_fams = persf.get_pers(fbs, fam, len(genomes), **options)
+        assert persf.get_pers_model(model, list_genomes=genomes, **options) == exp_fams
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Unit tests for the assign_functions submodule in pangenome module
+"""
+
+import os
+import shutil
+import logging
+import pytest
+
+import PanACoTA.pangenome_module.assign_functions as af
+import PanACoTA.pangenome_module.mmseqs_functions as mmseqs
+import PanACoTA.utils as utils
+
+LOGFILE_BASE = "logfile_test.txt"
+LOGFILES = [LOGFILE_BASE + ext for ext in [".log", ".log.debug", ".log.details", ".log.err"]]
+# Define variables shared by several tests
+PANDIR = os.path.join("test", "data", "pangenome")
+PATH_TEST_FILES = os.path.join(PANDIR, "test_files")
+GENEPATH = os.path.join(PANDIR, "generated_by_unit-tests")
+
+
+@pytest.fixture(autouse=True)
+def setup_teardown_module():
+    """
+    Remove log files at the end of this test module
+
+    Before each test:
+    - init logger
+    - create directory to put generated files
+
+    After:
+    - remove all log files
+    - remove directory with generated results
+    """
+    utils.init_logger(LOGFILE_BASE, logging.DEBUG, 'test_assign', verbose=1)
+    os.mkdir(GENEPATH)
+    print("setup")
+
+    yield
+    shutil.rmtree(GENEPATH)
+    for f in LOGFILES:
+        if os.path.exists(f):
+            os.remove(f)
+    print("teardown")
+
+
+def test_write_rep_families():
+    """
+    Test that the family written for each cluster representative is the family containing
+    this representative in the pangenome, and that the file can be read back
+    """
+    mmseqclust = os.path.join(PATH_TEST_FILES, "mmseq_clust-out")
+    logmmseq = os.path.join(GENEPATH, "test_assign.log")
+    panfile = os.path.join(GENEPATH, "test_assign_pangenome.lst")
+    fams = mmseqs.mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, panfile)
+    repfams = os.path.join(GENEPATH, "repDB.fams")
+    af.write_rep_families(panfile, mmseqclust + ".tsv", repfams)
+    rep_fams = af.read_rep_families(repfams)
+    assert len(rep_fams) == len(fams)
+    for rep, fam_num in rep_fams.items():
+        assert rep in fams[int(fam_num)]
+    assert not os.path.isfile(repfams + ".tmp")
+    assert af.read_rep_stamp(repfams) == af.rep_db_stamp(panfile, mmseqclust)
+
+
+def test_rep_stamp_changed():
+    """
+    Test that the stamp saved with the families of representatives changes when the
+    pangenome is written again, so that the database of representatives is rebuilt
+    """
+    mmseqclust = os.path.join(PATH_TEST_FILES, "mmseq_clust-out")
+    logmmseq = os.path.join(GENEPATH, "test_assign.log")
+    panfile = os.path.join(GENEPATH, "test_assign_pangenome.lst")
+    mmseqs.mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, panfile)
+    repfams = os.path.join(GENEPATH, "repDB.fams")
+    assert af.read_rep_stamp(repfams) is None
+    af.write_rep_families(panfile, mmseqclust + ".tsv", repfams,
+                          af.rep_db_stamp(panfile, mmseqclust))
+    assert af.read_rep_stamp(repfams) == af.rep_db_stamp(panfile, mmseqclust)
+    with open(panfile, "a") as panf:
+        panf.write("17 GEN4.1111.00001.i0001_00009\n")
+    assert af.read_rep_stamp(repfams) != af.rep_db_stamp(panfile, mmseqclust)
+
+
+def test_write_assignments(caplog):
+    """
+    Test that each protein is assigned to the family of its best hit, that hits against
+    representatives without family are ignored, and that proteins without hit are written
+    as unassigned, for each genome
+    """
+    caplog.set_level(logging.DEBUG)
+    genomes = ["GEN5.1017.00001", "GEN6.1017.00001"]
+    lookup = os.path.join(GENEPATH, "query-msDB.lookup")
+    with open(lookup, "w") as lookf:
+        lookf.write("0\tGEN5.1017.00001.i0001_00001\t0\n"
+                    "1\tGEN5.1017.00001.i0001_00002\t0\n"
+                    "2\tGEN6.1017.00001.b0001_00001\t1\n"
+                    "3\tGEN6.1017.00001.b0001_00002\t1\n")
+    restsv = os.path.join(GENEPATH, "query-search.tsv")
+    with open(restsv, "w") as resf:
+        resf.write("GEN5.1017.00001.i0001_00001\tREP2\t0.950\n"
+                   "GEN5.1017.00001.i0001_00001\tREP1\t0.900\n"
+                   "GEN6.1017.00001.b0001_00001\tREP3\t0.990\n"
+                   "GEN6.1017.00001.b0001_00001\tREP1\t0.850\n")
+    rep_fams = {"REP1": "1", "REP2": "4"}
+    assert af.write_assignments(lookup, restsv, rep_fams, genomes, GENEPATH) == (2, 2)
+    with open(os.path.join(GENEPATH, "GEN5.1017.00001.assign.tsv"), "r") as assf:
+        assert assf.read() == "GEN5.1017.00001.i0001_00001\t4\tREP2\t0.950\n"
+    with open(os.path.join(GENEPATH, "GEN5.1017.00001.unassigned.lst"), "r") as unasf:
+        assert unasf.read() == "GEN5.1017.00001.i0001_00002\n"
+    with open(os.path.join(GENEPATH, "GEN6.1017.00001.assign.tsv"), "r") as assf:
+        assert assf.read() == "GEN6.1017.00001.b0001_00001\t1\tREP1\t0.850\n"
+    with open(os.path.join(GENEPATH, "GEN6.1017.00001.unassigned.lst"), "r") as unasf:
+        assert unasf.read() == "GEN6.1017.00001.b0001_00002\n"
+    assert "2 proteins assigned to a family, 2 proteins without family" in caplog.text
@@ -154,6 +154,72 @@ def test_create_mmseqdb(caplog):
     assert os.path.isfile(logfile)
 
 
+def test_write_mmseqdb(caplog):
+    """
+    Test that mmseqs DB written directly from protein files of genomes contains the same
+    sequences as the one created by mmseqs from the bank of all proteins, with keys in the
+    order of the genomes, and that it is not written again if it already exists
+    """
+    caplog.set_level(logging.DEBUG)
+    filename = os.path.join(GENEPATH, "test_write_mmseqsdb.msdb")
+    dbpath = os.path.join(PATH_TEST_FILES, "example_db", "Proteins")
+    prt_files = [os.path.join(dbpath, gen + ".prt") for gen in
+                 ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]]
+    logfile = os.path.join(GENEPATH, "test_write_mmseqsdb.log")
+    assert mmseqs.create_mmseqs_db(filename, "unused.All.prt", logfile, prt_files, threads=2)
+    assert "Writing mmseqs database from 4 protein files" in caplog.text
+    assert "MMseqs command" not in caplog.text
+    outext = ["", ".index", ".lookup", "_h", "_h.index", ".dbtype", "_h.dbtype", ".source"]
+    assert sorted(glob.glob(filename + "*")) == sorted(filename + ext for ext in outext)
+    with open(filename + ".source", "r") as sourcef:
+        assert sourcef.read() == ("0\tGEN2.1017.00001.prt\n1\tGEN4.1111.00001.prt\n"
+                                  "2\tGENO.1017.00001.prt\n3\tGENO.1216.00002.prt\n")
+    exp_db = os.path.join(PATH_TEST_FILES, "mmseq_db")
+    with open(filename, "rb") as dbf, open(exp_db, "rb") as expf:
+        assert dbf.read() == expf.read()
+    with open(filename + ".index", "r") as indf, open(exp_db + ".index", "r") as expf:
+        index = [line.split() for line in indf]
+        exp_index = [line.split() for line in expf]
+    assert [line[0] for line in index] == [str(key) for key in range(45)]
+    assert [line[1:] for line in index] == [line[1:] for line in exp_index]
+    with open(filename + ".dbtype", "rb") as typef:
+        assert typef.read() == b"\x00\x00\x00\x00"
+    with open(filename + "_h.dbtype", "rb") as typef:
+        assert typef.read() == b"\x0c\x00\x00\x00"
+    with open(filename + ".lookup", "r") as lookf:
+        lookup = [line.split() for line in lookf]
+    assert lookup[0] == ["0", "GEN2.1017.00001.b0001_00001", "0"]
+    assert lookup[-1] == ["44", "GENO.1216.00002.b0003_00012", "3"]
+    with open(filename + "_h", "rb") as headf, open(filename + "_h.index") as indf:
+        headers = headf.read()
+        start, size = [int(val) for val in indf.readline().split()[1:]]
+        assert headers[start:start + size] == b"GEN2.1017.00001.b0001_00001\n\x00"
+    # Already exists
+    assert not mmseqs.create_mmseqs_db(filename, "unused.All.prt", logfile, prt_files)
+    assert "already exists. The program will use it" in caplog.text
+
+
+@pytest.mark.skipif(shutil.which("mmseqs") is None, reason="mmseqs is not installed")
+def test_write_mmseqdb_as_createdb():
+    """
+    Test that mmseqs DB written directly from protein files of genomes is the same as the one
+    written by 'mmseqs createdb' from the same protein files
+    """
+    filename = os.path.join(GENEPATH, "test_write_mmseqsdb.msdb")
+    exp_db = os.path.join(GENEPATH, "test_createdb.msdb")
+    dbpath = os.path.join(PATH_TEST_FILES, "example_db", "Proteins")
+    prt_files = [os.path.join(dbpath, gen + ".prt") for gen in
+                 ["GEN2.1017.00001", "GEN4.1111.00001", "GENO.1017.00001", "GENO.1216.00002"]]
+    mmseqs.write_mmseqs_db(filename, prt_files, threads=2)
+    logfile = os.path.join(GENEPATH, "test_createdb.log")
+    with open(logfile, "w") as logf:
+        utils.run_cmd(f"mmseqs createdb {' '.join(prt_files)} {exp_db} --shuffle 0",
+                      "mmseqs createdb failed", eof=True, stdout=logf, stderr=logf)
+    for ext in ["", ".index", ".lookup", "_h", "_h.index", ".dbtype", "_h.dbtype", ".source"]:
+        with open(filename + ext, "rb") as dbf, open(exp_db + ext, "rb") as expf:
+            assert dbf.read() == expf.read(), ext
+
+
 def test_create_mmseqdb_existok(caplog):
     """
     Check that, when trying to create mmseqdb while all output files already exist,
@@ -379,6 +445,187 @@ def test_tsv2pangenome():
         assert "End: " in end_line
 
 
+def test_tsv2pangenome_dedup():
+    """
+    Test that when only distinct proteins were clustered, their duplicates are added back to
+    their family, giving the same pangenome file as when all proteins were clustered
+    """
+    mmseqclust = os.path.join(PATH_TEST_FILES, "mmseq_clust-out")
+    logmmseq = os.path.join(GENEPATH, "test_tsv2pan.log")
+    outfile = os.path.join(GENEPATH, "test_tsv2pan_outpangenome.txt")
+    mmseqs.mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile)
+    # Same clustering, but duplicates of GEN2.1017.00001.i0002_00004 were not clustered
+    members = {"GEN2.1017.00001.i0002_00004": ["GEN4.1111.00001.i0001_00002",
+                                               "GENO.1216.00002.i0001_00003"]}
+    dedupclust = os.path.join(GENEPATH, "mmseq_clust-dedup")
+    with open(mmseqclust + ".tsv", "r") as tsvf, open(dedupclust + ".tsv", "w") as dedupf:
+        for line in tsvf:
+            if line.split()[1] not in members["GEN2.1017.00001.i0002_00004"]:
+                dedupf.write(line)
+    outdedup = os.path.join(GENEPATH, "test_tsv2pan_dedup.txt")
+    fams = mmseqs.mmseqs_tsv_to_pangenome(dedupclust, logmmseq, outdedup, members)
+    assert len(fams) == 16
+    with open(outfile, "r") as outf, open(outdedup, "r") as dedupf:
+        assert outf.read() == dedupf.read()
+
+
+def test_tsv2pangenome_stream():
+    """
+    Test that, when families are not kept in memory, the pangenome file written is the same,
+    and clusters are read one after the other from the tsv file
+    """
+    mmseqclust = os.path.join(PATH_TEST_FILES, "mmseq_clust-out")
+    logmmseq = os.path.join(GENEPATH, "test_tsv2pan.log")
+    outfile = os.path.join(GENEPATH, "test_tsv2pan_outpangenome.txt")
+    fams = mmseqs.mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile)
+    outstream = os.path.join(GENEPATH, "test_tsv2pan_stream.txt")
+    assert mmseqs.mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outstream,
+                                          keep_families=False) is None
+    with open(outfile, "r") as outf, open(outstream, "r") as streamf:
+        assert outf.read() == streamf.read()
+    clusters = mmseqs.mmseq_tsv_to_clusters(mmseqclust + ".tsv")
+    assert list(mmseqs.read_tsv_clusters(mmseqclust + ".tsv")) == list(clusters.values())
+    assert len(clusters) == len(fams)
+
+
+def test_tsv2pangenome_hierarchical():
+    """
+    Test that, when a clustering only contains the representatives of previous clusters (as
+    in a sweep of identities), each new family contains all proteins represented by its
+    members. Representatives are those of mmseqs clusters, which are not always the first
+    member of families once sorted.
+    """
+    mmseqclust = os.path.join(PATH_TEST_FILES, "mmseq_clust-out")
+    logmmseq = os.path.join(GENEPATH, "test_tsv2pan.log")
+    outfile = os.path.join(GENEPATH, "test_tsv2pan_level1.txt")
+    fams = mmseqs.mmseqs_tsv_to_pangenome(mmseqclust, logmmseq, outfile)
+    all_prots = sorted(sum(fams.values(), []))
+    clusters = list(mmseqs.read_tsv_clusters(mmseqclust + ".tsv"))
+    reps = [clust[0] for clust in clusters]
+    # Some representatives are not the first member of their sorted family
+    assert set(reps) != {fam[0] for fam in fams.values()}
+    members = mmseqs.merge_level_clusters(clusters)
+    assert list(members) == reps
+    # Cluster representatives of level 1 into 2 families
+    levelclust = os.path.join(GENEPATH, "level2-clust")
+    with open(levelclust + ".tsv", "w") as tsvf:
+        for rep in reps[:3]:
+            tsvf.write(f"{reps[0]}\t{rep}\n")
+        for rep in reps[3:]:
+            tsvf.write(f"{reps[3]}\t{rep}\n")
+    outlevel = os.path.join(GENEPATH, "test_tsv2pan_level2.txt")
+    level2 = mmseqs.mmseqs_tsv_to_pangenome(levelclust, logmmseq, outlevel, members)
+    assert len(level2) == 2
+    assert sorted(level2[1]) == sorted(sum(clusters[:3], []))
+    assert sorted(level2[2]) == sorted(sum(clusters[3:], []))
+    # Level 3: all representatives of level 2 in the same family, with all proteins
+    members = mmseqs.merge_level_clusters(mmseqs.read_tsv_clusters(levelclust + ".tsv"),
+                                          members)
+    assert list(members) == [reps[0], reps[3]]
+    level3clust = os.path.join(GENEPATH, "level3-clust")
+    with open(level3clust + ".tsv", "w") as tsvf:
+        tsvf.write(f"{reps[3]}\t{reps[3]}\n{reps[3]}\t{reps[0]}\n")
+    level3 = mmseqs.mmseqs_tsv_to_pangenome(level3clust, logmmseq, outlevel, members)
+    assert len(level3) == 1
+    assert sorted(level3[1]) == all_prots
+
+
+def test_update_families(caplog):
+    """
+    Test that new proteins of updated clusters are added to the existing family of the other
+    members, and that clusters with only new proteins become new families, numbered after
+    the existing ones
+    """
+    caplog.set_level(logging.DEBUG)
+    old_families = {"1": ["GEN1.1017.00001.i0001_00001", "GEN2.1017.00001.i0001_00003"],
+                    "3": ["GEN1.1017.00001.i0001_00002"],
+                    "2": ["GEN2.1017.00001.i0001_00001"]}
+    clusters = [["GEN1.1017.00001.i0001_00001", "GEN2.1017.00001.i0001_00003",
+                 "GEN3.1017.00001.i0001_00002"],
+                ["GEN3.1017.00001.i0001_00003", "GEN3.1017.00001.i0001_00001"],
+                ["GEN2.1017.00001.i0001_00001"],
+                ["GEN1.1017.00001.i0001_00002", "GEN3.1017.00001.i0001_00004"],
+                ["GEN3.1017.00001.i0001_00005"]]
+    outfile = os.path.join(GENEPATH, "test_update_pangenome.lst")
+    fams = mmseqs.update_families(old_families, clusters, outfile)
+    assert fams == {"1": ["GEN1.1017.00001.i0001_00001", "GEN2.1017.00001.i0001_00003",
+                          "GEN3.1017.00001.i0001_00002"],
+                    "2": ["GEN2.1017.00001.i0001_00001"],
+                    "3": ["GEN1.1017.00001.i0001_00002", "GEN3.1017.00001.i0001_00004"],
+                    "4": ["GEN3.1017.00001.i0001_00001", "GEN3.1017.00001.i0001_00003"],
+                    "5": ["GEN3.1017.00001.i0001_00005"]}
+    with open(outfile, "r") as outf:
+        assert outf.readline() == ("1 GEN1.1017.00001.i0001_00001 GEN2.1017.00001.i0001_00003 "
+                                   "GEN3.1017.00001.i0001_00002\n")
+        assert [line.split()[0] for line in outf] == ["2", "3", "4", "5"]
+    assert "2 proteins added to existing families, and 2 new families created." in caplog.text
+    assert "Pangenome has 5 families." in caplog.text
+
+
+def test_update_pangenome_same_file(caplog):
+    """
+    Test that updating a pangenome into the same file as the existing pangenome is refused
+    """
+    caplog.set_level(logging.DEBUG)
+    old_pan = os.path.join(GENEPATH, "Pangenome.lst")
+    with pytest.raises(SystemExit):
+        mmseqs.run_update_pangenome((old_pan, "oldDB", "oldclust"), "lstinfo", "dbpath", 0.8,
+                                    1, GENEPATH, "TEST.All.prt", 1, panfile="Pangenome.lst")
+    assert ("Updated pangenome would overwrite the existing pangenome "
+            "test/data/pangenome/generated_by_unit-tests/Pangenome.lst") in caplog.text
+
+
+def test_update_pangenome_new_genome(monkeypatch, caplog):
+    """
+    Test that updating a pangenome again with the same genomes reuses the updated pangenome,
+    while updating it with an extra genome writes the database and clusters proteins again.
+    mmseqs clusterupdate is replaced by a clustering putting each protein in its own cluster.
+    """
+    caplog.set_level(logging.DEBUG)
+    clustered = []
+
+    def clusterupdate(old_db, mmseqdb, old_clust, updated_db, mmseqclust, *args):
+        with open(mmseqdb + ".lookup", "r") as lookf:
+            clustered.append([line.split()[1] for line in lookf])
+        open(mmseqclust, "w").close()
+
+    def createtsv(updated_db, mmseqclust, logmmseq):
+        with open(mmseqclust + ".tsv", "w") as tsvf:
+            for name in clustered[-1]:
+                tsvf.write(f"{name}\t{name}\n")
+
+    monkeypatch.setattr(mmseqs, "run_mmseqs_clusterupdate", clusterupdate)
+    monkeypatch.setattr(mmseqs, "run_mmseqs_createtsv", createtsv)
+    old_pan = os.path.join(GENEPATH, "Pangenome.lst")
+    with open(old_pan, "w") as panf:
+        panf.write("1 GEN2.1017.00001.b0001_00001\n")
+    dbpath = os.path.join(PATH_TEST_FILES, "example_db", "Proteins")
+    lstinfo = os.path.join(GENEPATH, "lstinfo.txt")
+    update = (old_pan, "oldDB", os.path.join(GENEPATH, "oldclust"))
+    with open(lstinfo, "w") as lstf:
+        lstf.write("GEN2.1017.00001\nGEN4.1111.00001\n")
+    fams, panfile = mmseqs.run_update_pangenome(update, lstinfo, dbpath, 0.8, 1, GENEPATH,
+                                                "TEST.All.prt", 1)
+    assert len(clustered) == 1
+    assert not any(name.startswith("GENO.1017.00001") for name in clustered[0])
+    # Same genomes: updated pangenome is reused
+    mmseqs.run_update_pangenome(update, lstinfo, dbpath, 0.8, 1, GENEPATH, "TEST.All.prt", 1)
+    assert len(clustered) == 1
+    assert f"Pangenome file {panfile} already exists" in caplog.text
+    # Extra genome: database written and clustered again
+    with open(lstinfo, "a") as lstf:
+        lstf.write("GENO.1017.00001\n")
+    fams2, panfile2 = mmseqs.run_update_pangenome(update, lstinfo, dbpath, 0.8, 1, GENEPATH,
+                                                  "TEST.All.prt", 1)
+    assert panfile2 == panfile
+    assert len(clustered) == 2
+    assert any(name.startswith("GENO.1017.00001") for name in clustered[1])
+    assert ("Genomes or existing pangenome changed since "
+            f"{panfile} was written. PanACoTA will update the pangenome again.") in caplog.text
+    assert sum(len(fam) for fam in fams2.values()) == len(clustered[1])
+    assert sum(len(fam) for fam in fams.values()) < len(clustered[1])
+
+
 def test_mmseq2pan_givenout():
     """
     From mmseq clust output, convert to pangenome (with steps inside, already tested by the other
@@ -10,8 +10,10 @@ import io
 import logging
 import pytest
 import shutil
+import numpy as np
 
 import PanACoTA.pangenome_module.post_treatment as post
+from PanACoTA import utils_pangenome as upan
 import PanACoTA.utils as utils
 import test.test_unit.utilities_for_tests as tutil
 
@@ -245,4 +247,56 @@ def test_all_post():
 
     # Check that bin pangenome file was created (as it did not exist before)
     assert os.path.isfile(pangenome + ".bin")
-    
\ No newline at end of file
+    
+
+def test_all_post_from_file(monkeypatch):
+    """
+    Check that when running main method of post-treatment without families, they are read
+    from the pangenome file, and that writing matrices a few lines at a time gives the same
+    output files.
+    """
+    pangenome = os.path.join(GENEPATH, "test_all_post")
+    shutil.copyfile(os.path.join(PATH_EXP_FILES, "exp_pangenome-4genomes.lst"), pangenome)
+    # Only 5 cells converted at a time: 1 genome or 1 family line at a time
+    monkeypatch.setattr(post, "CHUNK_CELLS", 5)
+    post.post_treat(None, pangenome)
+    assert tutil.compare_order_content(pangenome + ".quali.txt", EXP_QUALIF)
+    assert tutil.compare_order_content(pangenome + ".quanti.txt", EXP_QUANTIF)
+    assert tutil.compare_order_content(pangenome + ".summary.txt", EXP_SUMF)
+    assert os.path.isfile(pangenome + ".bin")
+
+
+def test_model_counts():
+    """
+    Check that the sparse matrix built from the compact pangenome model is the same as the one
+    built from the pangenome python objects, with families sorted by number
+    """
+    model = upan.build_pan_model(FAMILIES)
+    fam_nums, counts = post.model_counts(model)
+    exp_nums, exp_counts = post.dict_counts(FAMS_BY_STRAIN, ALL_STRAINS)
+    assert fam_nums == exp_nums == [str(num) for num in range(1, 17)]
+    assert (counts != exp_counts).nnz == 0
+    assert counts.toarray().tolist() == [EXP_QUANTIS[num] for num in fam_nums]
+
+
+def test_all_post_matrix():
+    """
+    Check that when asked, qualitative and quantitative matrices are also saved in binary
+    format, and can be loaded back
+    """
+    pangenome = os.path.join(GENEPATH, "test_all_post")
+    post.post_treat(FAMILIES, pangenome, matrix=True)
+    assert tutil.compare_order_content(pangenome + ".quanti.txt", EXP_QUANTIF)
+    quali, quanti, genomes, fam_nums = upan.load_pan_matrices(pangenome, unpack=True)
+    assert genomes == ALL_STRAINS
+    assert fam_nums == [str(num) for num in range(1, 17)]
+    assert quali.tolist() == [[bool(EXP_QUALIS[num][gen]) for num in fam_nums]
+                              for gen in range(4)]
+    assert quanti.toarray().tolist() == [[EXP_QUANTIS[num][gen] for num in fam_nums]
+                                         for gen in range(4)]
+    # By default, bit-packed memory-mapped matrix: 16 families, 2 bytes per genome
+    packed = upan.load_pan_matrices(pangenome)[0]
+    assert isinstance(packed, np.memmap)
+    assert packed.shape == (4, 2)
+    assert np.array_equal(np.unpackbits(packed[1], count=16).astype(bool), quali[1])
+    assert not os.path.isfile(pangenome + ".quali.npz")
@@ -112,3 +112,41 @@ def test_build_bank_exists(caplog):
     assert ("Protein bank test/data/pangenome/generated_by_unit-tests/Proteins/"
             "EXEM.All.prt already exists. It will be used by mmseqs.") in caplog.text
     assert caplog.records[0].levelname == "WARNING"
+
+
+def test_dedup_bank(caplog):
+    """
+    Test that only the first copy of identical proteins is kept in the bank, and that
+    duplicates are written in the members file. If already done, files are used as they are.
+    """
+    caplog.set_level(logging.DEBUG)
+    prt_path = os.path.join(GENEPATH, "EXEM.All.prt")
+    shutil.copyfile(os.path.join(PATH_EXP_FILES, "exp_EXEM.All.prt"), prt_path)
+    uniq_path, members_path = psf.dedup_prt_bank(prt_path)
+    assert uniq_path == os.path.join(GENEPATH, "EXEM.All.uniq.prt")
+    assert "39 distinct proteins out of 45" in caplog.text
+    # Read all proteins of the bank
+    seqs = {}
+    with open(prt_path, "r") as prtf:
+        for line in prtf:
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                seqs[name] = ""
+            else:
+                seqs[name] += line.strip()
+    with open(uniq_path, "r") as uniqf:
+        uniq = [line[1:].split()[0] for line in uniqf if line.startswith(">")]
+    assert len(uniq) == len(set(seqs[name] for name in uniq)) == 39
+    members = psf.read_members(members_path)
+    assert members == {"GEN2.1017.00001.i0003_00009": ["GEN4.1111.00001.i0001_00008",
+                                                       "GENO.1216.00002.b0002_00009"],
+                       "GEN4.1111.00001.i0001_00005": ["GENO.1017.00001.i0002_00005"],
+                       "GEN2.1017.00001.i0003_00008": ["GENO.1017.00001.i0002_00009"],
+                       "GENO.1216.00002.b0001_00001": ["GENO.1216.00002.i0001_00002"],
+                       "GEN2.1017.00001.b0002_00003": ["GENO.1216.00002.i0001_00004"]}
+    assert sum(len(dups) for dups in members.values()) == 45 - 39
+    assert all(seqs[dup] == seqs[repres] for repres, dups in members.items() for dup in dups)
+    assert set(uniq) | {dup for dups in members.values() for dup in dups} == set(seqs)
+    # Already done
+    assert psf.dedup_prt_bank(prt_path) == (uniq_path, members_path)
+    assert "already in test/data/pangenome/generated_by_unit-tests/EXEM.All.uniq.prt" in caplog.text
@@ -180,6 +180,21 @@ def test_perc_id():
     assert ("The minimum %% of identity must be in [0, 1]. Invalid value: 1.1") in str(err.value)
 
 
+def test_gap_fraction():
+    """
+    Same as test_percentage, but for parameter --trim max_gaps
+    """
+    assert autils.gap_fraction("0.5") == 0.5
+    assert autils.gap_fraction("0") == 0.0
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        a = autils.gap_fraction("one")
+    assert ("argument --trim: invalid float value: one") in str(err.value)
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        a = autils.gap_fraction("1.1")
+    assert ("The maximum fraction of genomes with a gap must be in [0, 1]. "
+            "Invalid value: 1.1") in str(err.value)
+
+
 def test_conf_parser_init_empty(capsys):
     """
     test class Conf_all_parser init when no config file or empty config file
@@ -8,6 +8,7 @@ import logging
 import os
 import shutil
 import pytest
+import numpy as np
 
 from PanACoTA import utils_pangenome as upan
 from PanACoTA import utils
@@ -394,25 +395,83 @@ def test_read_pangenome_fams(caplog):
 def test_read_pangenome_fams_binok(caplog):
     """
     Test that when giving a pangenome file, and families, it directly extracts strain information
-    from the families: pangenome file does not need to exist. However, the pangenome.bin file
-    already exists (whatever its content), and is then not recreated.
+    from the families: pangenome file does not need to exist. The pangenome.bin file already
+    exists, but is not a pangenome model (empty file): it is replaced.
     """
-    caplog.set_level(logging.INFO)
+    caplog.set_level(logging.DEBUG)
     logger = logging.getLogger("test_pan")
     panfile = os.path.join(GENEPATH, "toto.txt")
-    # Create bn pangenome file (which is empty
+    # Create bin pangenome file (which is empty)
     open(panfile + ".bin", "w").close()
     fbs, fams, ass = upan.read_pangenome(panfile, logger, FAMILIES)
     assert fbs == FAMS_BY_STRAIN
     assert fams == FAMILIES
     assert ass == ALL_STRAINS
-    with open(panfile + ".bin", "r") as panf:
-        all_lines = panf.readlines()
-    assert all_lines == []
     assert "Retrieving information from pan families" in caplog.text
-    assert os.path.isfile(panfile + ".bin")
-    with open(panfile + ".bin", "r") as pfb:
-        assert pfb.readlines() == []
+    assert "Saving all information to a binary file for later use" in caplog.text
+    assert upan.load_pan_model(panfile) is not None
+    # Binary file up to date: not saved again
+    caplog.clear()
+    upan.read_pangenome(panfile, logger, FAMILIES)
+    assert "Saving all information to a binary file for later use" not in caplog.text
+
+
+def test_pan_model():
+    """
+    Test that the compact model of a pangenome contains all families, members and genomes,
+    and that it can be saved and memory-mapped back
+    """
+    panfile = os.path.join(GENEPATH, "Pangenome.lst")
+    shutil.copyfile(PAN_FILE, panfile)
+    model = upan.build_pan_model(FAMILIES)
+    assert upan.array_to_names(model["genomes"]) == ALL_STRAINS
+    assert model["fam_offsets"].tolist()[:5] == [0, 4, 5, 6, 11]
+    assert upan.array_to_names(model["members"][4:6]) == ['GEN2.1017.00001.b0003_00010',
+                                                          'GEN2.1017.00001.b0004_00013']
+    assert model["member_genome"][6:11].tolist() == [0, 1, 2, 3, 3]
+    upan.save_pan_model(model, panfile)
+    loaded = upan.load_pan_model(panfile)
+    assert isinstance(loaded["members"], np.memmap)
+    for field in upan.PAN_FIELDS:
+        assert np.array_equal(loaded[field], model[field])
+    fbs, fams, ass = upan.model_to_dicts(loaded)
+    assert fbs == FAMS_BY_STRAIN
+    assert fams == FAMILIES
+    assert ass == ALL_STRAINS
+    fam_idx, genomes, counts = upan.family_genome_counts(loaded)
+    assert fam_idx[5:10].tolist() == [2, 3, 3, 3, 3]
+    assert genomes[5:10].tolist() == [0, 0, 1, 2, 3]
+    assert counts[5:10].tolist() == [1, 1, 1, 1, 2]
+    mask = np.array([False, False, True, True])
+    fam_idx, genomes, counts = upan.family_genome_counts(loaded, mask)
+    assert fam_idx[:4].tolist() == [0, 0, 3, 3]
+    assert counts[:4].tolist() == [1, 1, 1, 2]
+
+
+def test_pan_model_invalidated(caplog):
+    """
+    Test that, when the pangenome file changes, its binary file is not used anymore, and is
+    replaced by the new pangenome
+    """
+    caplog.set_level(logging.INFO)
+    logger = logging.getLogger("test_pan")
+    panfile = os.path.join(GENEPATH, "Pangenome.lst")
+    shutil.copyfile(PAN_FILE, panfile)
+    upan.read_pangenome(panfile, logger)
+    assert "Saving all information to a binary file for later use" in caplog.text
+    caplog.clear()
+    upan.read_pangenome(panfile, logger)
+    assert "Retrieving info from binary file" in caplog.text
+    with open(panfile, "a") as panf:
+        panf.write("17 GEN2.1017.00001.b0005_00014 GEN4.1111.00001.b0002_00010\n")
+    assert upan.load_pan_model(panfile) is None
+    caplog.clear()
+    fbs, fams, _ = upan.read_pangenome(panfile, logger)
+    assert "Reading and getting information from pangenome file" in caplog.text
+    assert fams["17"] == ["GEN2.1017.00001.b0005_00014", "GEN4.1111.00001.b0002_00010"]
+    assert fbs["17"] == {"GEN2.1017.00001": ["GEN2.1017.00001.b0005_00014"],
+                         "GEN4.1111.00001": ["GEN4.1111.00001.b0002_00010"]}
+    assert upan.load_pan_model(panfile) is not None
 
 
 def test_read_lstinfo():
@@ -1038,6 +1038,27 @@ def test_cat_bar():
     assert utilities.compare_file_content(outfile, exp_file)
 
 
+def test_copy_file():
+    """
+    Check that copy_file appends the given bytes of a file at the end of the output file,
+    also when the output file is open in append mode (kernel copy not possible)
+    """
+    infile = os.path.join(DATA_DIR, "genomes", "genome1.fasta")
+    with open(infile, "rb") as inf:
+        content = inf.read()
+    outfile = os.path.join(GENEPATH, "test_copy_file.txt")
+    with open(outfile, "wb") as outf:
+        outf.write(b"start\n")
+        with open(infile, "rb") as inf:
+            utils.copy_file(inf, outf)
+            utils.copy_file(inf, outf, offset=5, count=10)
+        outf.write(b"end\n")
+    with open(outfile, "ab") as outf, open(infile, "rb") as inf:
+        utils.copy_file(inf, outf, offset=len(content) - 3)
+    with open(outfile, "rb") as outf:
+        assert outf.read() == b"start\n" + content + content[5:15] + b"end\n" + content[-3:]
+
+
 def test_detail():
     """
     Check value returned for detail level
@@ -1122,6 +1143,41 @@ def test_count_error(caplog):
     assert "Choose what you want to count among ['lines', 'words']" in caplog.text
 
 
+def test_index_fasta():
+    """
+    Test that indexing a fasta file writes, for each sequence, its name, the offset of its
+    header and the size of its record, and that reading the index returns them.
+    """
+    fasta = os.path.join(GENEPATH, "seqs.fasta")
+    with open(fasta, "w") as ff:
+        ff.write(">seq1 some info\nACGT\nAC\n>seq2\nA\n>seq3 info\nACGTAA\n")
+    utils.index_fasta(fasta)
+    idxfile = os.path.join(GENEPATH, "seqs.fasta.idx")
+    with open(idxfile, "r") as idxf:
+        assert idxf.read() == "#50\nseq1\t0\t24\nseq2\t24\t8\nseq3\t32\t18\n"
+    index = utils.read_fasta_index(fasta)
+    assert index == {"seq1": [(0, 24)], "seq2": [(24, 8)], "seq3": [(32, 18)]}
+    with open(fasta, "r") as ff:
+        content = ff.read()
+    assert content[24:32] == ">seq2\nA\n"
+
+
+def test_read_fasta_index_changed():
+    """
+    Test that when there is no index for the fasta file, or when the fasta file changed
+    since it was indexed, reading the index returns None
+    """
+    fasta = os.path.join(GENEPATH, "seqs.fasta")
+    with open(fasta, "w") as ff:
+        ff.write(">seq1\nACGT\n")
+    assert utils.read_fasta_index(fasta) is None
+    utils.index_fasta(fasta)
+    assert utils.read_fasta_index(fasta) == {"seq1": [(0, 11)]}
+    with open(fasta, "a") as ff:
+        ff.write(">seq2\nACGT\n")
+    assert utils.read_fasta_index(fasta) is None
+
+
 def test_save_bin():
     """
     Test that python objects are correctly saved into binary file